@@ -0,0 +1,351 @@
+# archive.py - Холодный архив старых ссылок (отдельный файл SQLite)
+#
+# Ссылки старше срока хранения чата переносятся из links в архив, чтобы
+# горячая таблица оставалась маленькой. Текст сообщения в архиве обрезается,
+# сжимается zlib и хранится один раз на все ссылки с одинаковым текстом.
+# Страницы и /export читают обе части и сливают их по (timestamp, id).
+
+import hashlib
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, LargeBinary, MetaData,
+                        String, Table, Text, bindparam, create_engine, func, insert, inspect,
+                        select, text, tuple_)
+from sqlalchemy.engine import make_url
+
+import chat_stats
+import config
+import database as db
+import metrics
+import preset_index
+from links import YOUTUBE_KINDS, link_kind
+
+logger = logging.getLogger(__name__)
+
+# None - ссылки хранятся в горячей таблице бессрочно (если у чата не задан свой срок)
+RETENTION_DAYS = getattr(config, 'RETENTION_DAYS', None)
+ARCHIVE_BATCH_SIZE = getattr(config, 'ARCHIVE_BATCH_SIZE', 5000)
+ARCHIVE_TEXT_LIMIT = getattr(config, 'ARCHIVE_TEXT_LIMIT', 1000)
+
+metadata = MetaData()
+
+texts = Table(
+    'texts', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('hash', String, nullable=False, unique=True),
+    Column('body', LargeBinary, nullable=False),
+)
+
+archived_links = Table(
+    'archived_links', metadata,
+    Column('id', Integer, primary_key=True),  # id из links
+    Column('chat_id', String, nullable=False),
+    Column('user_id', String),
+    Column('username', String),
+    Column('url', Text),
+    Column('domain', String),
+    Column('title', Text),
+    Column('timestamp', DateTime),
+    Column('url_hash', String),
+    Column('repost_count', Integer),
+    Column('kind', String),
+    Column('video_id', String),
+    Column('text_id', Integer, ForeignKey('texts.id')),
+    Index('ix_archived_chat_ts', 'chat_id', 'timestamp', 'id'),
+    Index('ix_archived_chat_kind', 'chat_id', 'kind', 'timestamp', 'id'),
+)
+
+_engine = None
+_init_lock = threading.Lock()
+
+
+def archive_url():
+    """Адрес архива: ARCHIVE_DATABASE_URL или <файл БД>.archive.db рядом с основной"""
+    url = getattr(config, 'ARCHIVE_DATABASE_URL', None)
+    if url:
+        return url
+    hot = make_url(str(db.get_engine().url))
+    if hot.get_backend_name() != 'sqlite' or not hot.database or hot.database == ':memory:':
+        return None
+    root, _ = os.path.splitext(hot.database)
+    return str(hot.set(database=f'{root}.archive.db'))
+
+
+def _archive_path():
+    url = archive_url()
+    return make_url(url).database if url else None
+
+
+def exists():
+    """Есть ли что читать из архива (файл создается первым переносом)"""
+    path = _archive_path()
+    return bool(path) and os.path.exists(path)
+
+
+def get_engine():
+    """Движок архива; схема создается при первом обращении"""
+    global _engine
+    if _engine is None:
+        with _init_lock:
+            if _engine is None:
+                url = archive_url()
+                if not url:
+                    raise RuntimeError("archive is not configured: set ARCHIVE_DATABASE_URL")
+                engine = create_engine(url)
+                metrics.instrument_engine(engine)
+                metadata.create_all(engine)
+                _add_kind_columns(engine)
+                _engine = engine
+    return _engine
+
+
+def _add_kind_columns(engine):
+    """Колонки kind и video_id для архивов, созданных до их появления.
+
+    Старые строки заполняются в той же транзакции: иначе YouTube выборки
+    архива их не видели бы.
+    """
+    with engine.begin() as conn:
+        columns = {col['name'] for col in inspect(conn).get_columns('archived_links')}
+        missing = [name for name in ('kind', 'video_id') if name not in columns]
+        for name in missing:
+            conn.execute(text(f"ALTER TABLE archived_links ADD COLUMN {name} VARCHAR"))
+        for index in archived_links.indexes:
+            index.create(conn, checkfirst=True)
+        if missing:
+            _classify(conn)
+
+
+# ===== ПЕРЕНОС В АРХИВ =====
+
+def _text_ids(conn, links):
+    """Сохраняет тексты сообщений (без повторов). Возвращает {текст: id}"""
+    bodies = {}
+    for link in links:
+        message_text = (link.message_text or '')[:ARCHIVE_TEXT_LIMIT]
+        if message_text and message_text not in bodies:
+            bodies[message_text] = hashlib.sha1(message_text.encode('utf-8')).hexdigest()
+    if not bodies:
+        return {}
+    conn.execute(
+        insert(texts).prefix_with('OR IGNORE'),
+        [{'hash': digest, 'body': zlib.compress(message_text.encode('utf-8'))}
+         for message_text, digest in bodies.items()]
+    )
+    ids = dict(conn.execute(select(texts.c.hash, texts.c.id).where(texts.c.hash.in_(bodies.values()))).all())
+    return {message_text: ids[digest] for message_text, digest in bodies.items()}
+
+
+def archive_links(links):
+    """Записывает ссылки в архив (повторный перенос тех же id ничего не меняет)"""
+    with get_engine().begin() as conn:
+        text_ids = _text_ids(conn, links)
+        conn.execute(insert(archived_links).prefix_with('OR IGNORE'), [
+            {
+                'id': link.id, 'chat_id': link.chat_id, 'user_id': link.user_id,
+                'username': link.username, 'url': link.url, 'domain': link.domain,
+                'title': link.title, 'timestamp': link.timestamp, 'url_hash': link.url_hash,
+                'repost_count': link.repost_count, 'kind': link.kind, 'video_id': link.video_id,
+                'text_id': text_ids.get((link.message_text or '')[:ARCHIVE_TEXT_LIMIT]),
+            }
+            for link in links
+        ])
+
+
+def compact_chat(chat_id, days, batch_size=ARCHIVE_BATCH_SIZE):
+    """Переносит ссылки чата старше days дней в архив. Возвращает их число"""
+    cutoff = datetime.now() - timedelta(days=days)
+    moved = 0
+    while True:
+        # Архив записывается до того, как удаление из основной БД зафиксировано:
+        # при сбое между ними ссылка окажется в обеих частях, а не потеряется
+        # (при чтении повторы по id отбрасываются)
+        count = db.move_links_before(chat_id, cutoff, batch_size, archive_links)
+        if not count:
+            return moved
+        moved += count
+
+
+def compact(default_days=RETENTION_DAYS):
+    """Применяет сроки хранения ко всем чатам и освобождает место в основной БД.
+
+    Возвращает {chat_id: перенесено ссылок}.
+    """
+    overrides = db.get_retention_settings()
+    chats = db.get_chat_ids() if default_days else list(overrides)
+    result = {}
+    for chat_id in chats:
+        days = overrides.get(chat_id, default_days)
+        if not days:
+            continue
+        moved = compact_chat(chat_id, days)
+        if moved:
+            result[chat_id] = moved
+            logger.info("[ARCHIVE] chat_id=%s days=%s moved=%d", chat_id, days, moved)
+    if result:
+        db.incremental_vacuum()
+    return result
+
+
+# ===== ЧТЕНИЕ =====
+
+_COLUMNS = ('id', 'chat_id', 'user_id', 'username', 'url', 'domain', 'title',
+            'timestamp', 'url_hash', 'repost_count', 'kind', 'video_id')
+
+
+def _query_all():
+    return (
+        select(*(archived_links.c[name] for name in _COLUMNS), texts.c.body)
+        .select_from(archived_links.outerjoin(texts, texts.c.id == archived_links.c.text_id))
+    )
+
+
+def _query(chat_id):
+    return _query_all().where(archived_links.c.chat_id == str(chat_id))
+
+
+def _link(row):
+    """Строка архива как (несохраненный) объект Link"""
+    values = dict(zip(_COLUMNS, row))
+    values['message_text'] = zlib.decompress(row.body).decode('utf-8') if row.body else None
+    return db.Link(**values)
+
+
+def get_page(chat_id, cursor=None, backward=False, limit=50, youtube=False):
+    """Страница архива с той же keyset-пагинацией, что и в database._keyset_page.
+
+    youtube - только YouTube ссылки. Страницы пресетов идут через preset_links
+    (см. resolve_links).
+    """
+    if not exists():
+        return [], False
+    a = archived_links.c
+    query = _query(chat_id)
+    if youtube:
+        query = query.where(a.kind.in_(YOUTUBE_KINDS))
+
+    key = tuple_(a.timestamp, a.id)
+    if backward:
+        query = query.where(key > tuple_(*cursor)).order_by(a.timestamp.asc(), a.id.asc())
+    else:
+        if cursor:
+            query = query.where(key < tuple_(*cursor))
+        query = query.order_by(a.timestamp.desc(), a.id.desc())
+
+    with get_engine().connect() as conn:
+        links = [_link(row) for row in conn.execute(query.limit(limit + 1))]
+    has_more = len(links) > limit
+    links = links[:limit]
+    if backward:
+        links.reverse()
+    return links, has_more
+
+
+def resolve_links(link_ids):
+    """Ссылки по id в том же порядке: из основной БД, недостающие - из архива"""
+    found = db.get_links_by_ids(link_ids)
+    missing = [link_id for link_id in link_ids if link_id not in found]
+    if missing and exists():
+        with get_engine().connect() as conn:
+            rows = conn.execute(_query_all().where(archived_links.c.id.in_(missing)))
+            found.update((row.id, _link(row)) for row in rows)
+    return [found[link_id] for link_id in link_ids if link_id in found]
+
+
+def backfill_preset(preset):
+    """Сверяет новый пресет с архивом чата (основную БД сверяет database.create_preset)"""
+    needle = preset.search_term.casefold()
+    batch = []
+    for link in iter_chat_links(preset.chat_id):
+        if needle in preset_index.link_text(link.url, link.title, link.message_text):
+            batch.append((link.id, link.timestamp))
+    db.add_preset_links(preset.id, batch)
+    return len(batch)
+
+
+def _classify(conn, batch_size=ARCHIVE_BATCH_SIZE):
+    """Заполняет kind и video_id у архивных ссылок без них (как миграция 15)"""
+    a = archived_links.c
+    filled = 0
+    after_id = 0
+    while True:
+        rows = conn.execute(
+            select(a.id, a.url).where(a.id > after_id, a.kind.is_(None)).order_by(a.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        updates = []
+        for link_id, url in rows:
+            kind, video_id = link_kind(url or '')
+            updates.append({'link_id': link_id, 'new_kind': kind, 'new_video_id': video_id})
+        conn.execute(
+            archived_links.update().where(a.id == bindparam('link_id'))
+            .values(kind=bindparam('new_kind'), video_id=bindparam('new_video_id')),
+            updates
+        )
+        filled += len(rows)
+        after_id = rows[-1].id
+
+
+def backfill_kinds():
+    """Дозаполняет kind в архиве, колонки которого добавлены без заполнения
+    (run.py migrate). Возвращает число заполненных строк."""
+    if not exists():
+        return 0
+    with get_engine().begin() as conn:
+        return _classify(conn)
+
+
+def reserve_ids():
+    """Сдвигает id новых ссылок основной БД за последний id архива (run.py migrate)"""
+    if not exists():
+        return
+    with get_engine().connect() as conn:
+        db.reserve_link_ids(conn.execute(select(func.max(archived_links.c.id))).scalar())
+
+
+def stats_counts():
+    """Счетчики /stats по ссылкам архива (для database.rebuild_stats)"""
+    if not exists():
+        return None
+    with get_engine().connect() as conn:
+        return chat_stats.count_table(conn, 'archived_links')
+
+
+def merge_pages(hot, hot_more, cold, cold_more, backward, limit):
+    """Сливает страницы основной БД и архива (обе - по убыванию даты)"""
+    if not cold:
+        return hot, hot_more
+    seen = {link.id for link in hot}
+    links = sorted(hot + [link for link in cold if link.id not in seen],
+                   key=lambda link: (link.timestamp, link.id), reverse=True)
+    has_more = hot_more or cold_more or len(links) > limit
+    # Каждая часть вернула limit ссылок, ближайших к курсору: при листании
+    # к новым ближайшие - самые старые из них
+    links = links[-limit:] if backward else links[:limit]
+    return links, has_more
+
+
+def iter_chat_links(chat_id, batch_size=1000, chunk_size=20000):
+    """Все ссылки чата из архива от старых к новым (как database.iter_chat_links)"""
+    if not exists():
+        return
+    a = archived_links.c
+    cursor = None
+    while True:
+        query = _query(chat_id)
+        if cursor:
+            query = query.where(tuple_(a.timestamp, a.id) > tuple_(*cursor))
+        query = query.order_by(a.timestamp.asc(), a.id.asc()).limit(chunk_size)
+        count = 0
+        with get_engine().connect() as conn:
+            for row in conn.execution_options(yield_per=batch_size).execute(query):
+                count += 1
+                cursor = (row.timestamp, row.id)
+                yield _link(row)
+        if count < chunk_size:
+            return
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator and benchmark for Archivist Bot.
+
+Drives the real handlers (handle_message, all_links, handle_preset,
+handle_inline_button) through Application.process_update against SQLite
+databases seeded with synthetic links. Telegram is replaced by a stub
+transport (telegram_stub.py) and yt_dlp by a fake resolver, so only the bot's own work is
+measured.
+
+    python bench.py --sizes 10000,1000000,10000000 --output bench_results.json
+
+Seeded databases are kept in --data-dir and reused by later runs.
+Each size runs in its own process so module-level state does not leak.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+DOMAINS = [
+    ('habr.com', '/articles/{n}/'),
+    ('github.com', '/user{n}/repo'),
+    ('x.com', '/someone/status/{n}'),
+    ('reddit.com', '/r/python/comments/{n}'),
+    ('i.imgur.com', '/{n}.jpg'),
+    ('en.wikipedia.org', '/wiki/Page_{n}'),
+]
+YOUTUBE_FORMATS = [
+    'https://youtu.be/{id}',
+    'https://www.youtube.com/watch?v={id}',
+    'https://youtube.com/shorts/{id}',
+    'https://m.youtube.com/watch?v={id}&si=share',
+]
+WORDS = "смотри какая статья про python видео бот ссылка интересно новости релиз обзор".split()
+PRESETS = [('habr', 'habr'), ('gh', 'github'), ('wiki', 'wikipedia')]
+
+
+# ===== СИНТЕТИЧЕСКИЕ ДАННЫЕ =====
+
+class Generator:
+    """Реалистичная смесь ссылок по многим чатам"""
+
+    def __init__(self, chats, youtube_ratio, seed=1):
+        self.random = random.Random(seed)
+        self.chats = [-1000000000000 - i for i in range(chats)]
+        self.youtube_ratio = youtube_ratio
+        # Популярные видео повторяются между чатами
+        self.videos = [self._video_id() for _ in range(5000)]
+
+    def _video_id(self):
+        return ''.join(self.random.choice(string.ascii_letters + string.digits + '-_') for _ in range(11))
+
+    def url(self):
+        if self.random.random() < self.youtube_ratio:
+            video_id = self.random.choice(self.videos) if self.random.random() < 0.5 else self._video_id()
+            return self.random.choice(YOUTUBE_FORMATS).format(id=video_id)
+        domain, path = self.random.choice(DOMAINS)
+        return f'https://{domain}' + path.format(n=self.random.randrange(10 ** 9))
+
+    def text(self, urls):
+        words = ' '.join(self.random.choice(WORDS) for _ in range(self.random.randrange(0, 12)))
+        return (words + '\n' if words else '') + '\n'.join(urls)
+
+    def chat(self):
+        # Небольшая часть чатов дает большую часть трафика
+        return self.chats[min(int(self.random.paretovariate(1.2)) - 1, len(self.chats) - 1)]
+
+    def user(self):
+        return self.random.randrange(1, 200)
+
+    def rows(self, count, start):
+        """Строки для прямого заполнения БД, по возрастанию времени"""
+        import database as db
+        step = timedelta(days=730) / max(count, 1)
+        for i in range(count):
+            url = self.url()
+            user = self.user()
+            yield db.link_row(
+                self.chat(), user, f'user{user}', url, self.text([url]),
+                title=None, timestamp=start + step * i
+            )
+
+
+class Updates:
+    """Собирает JSON обновлений Telegram"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+        self.message_id = 0
+
+    def _message(self, chat_id, user_id, text, entities):
+        self.message_id += 1
+        return {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'bench'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+            'text': text,
+            'entities': entities,
+        }
+
+    def _update(self, **payload):
+        from telegram import Update
+        self.update_id += 1
+        return Update.de_json({'update_id': self.update_id, **payload}, self.bot)
+
+    def message(self, chat_id, user_id, urls, text):
+        entities = []
+        for url in urls:
+            offset = text.index(url)
+            # Смещения сущностей Telegram считаются в UTF-16
+            entities.append({
+                'type': 'url',
+                'offset': len(text[:offset].encode('utf-16-le')) // 2,
+                'length': len(url.encode('utf-16-le')) // 2,
+            })
+        return self._update(message=self._message(chat_id, user_id, text, entities))
+
+    def command(self, chat_id, user_id, command):
+        text = '/' + command
+        entity = {'type': 'bot_command', 'offset': 0, 'length': len(text)}
+        return self._update(message=self._message(chat_id, user_id, text, [entity]))
+
+    def callback(self, chat_id, user_id, data):
+        message = self._message(chat_id, 1, 'page', [])
+        message['from']['is_bot'] = True
+        return self._update(callback_query={
+            'id': str(self.update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': message,
+        })
+
+
+# ===== ЗАМЕРЫ =====
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+    }
+
+
+def seed_database(gen, size, batch=10000):
+    """Заполняет БД до size ссылок. Возвращает (добавлено, секунд)"""
+    import database as db
+    from sqlalchemy import func
+
+    with db.Session() as session:
+        existing = session.query(func.count(db.Link.id)).scalar()
+    missing = size - existing
+    if missing <= 0:
+        return 0, 0.0
+
+    start = datetime.now() - timedelta(days=730)
+    rows = gen.rows(missing, start)
+    started = time.perf_counter()
+    added = 0
+    while added < missing:
+        chunk = [next(rows) for _ in range(min(batch, missing - added))]
+        db.save_links(chunk)
+        added += len(chunk)
+        if added % (batch * 20) == 0:
+            print(f"  seeded {existing + added}/{size}", file=sys.stderr)
+    return added, time.perf_counter() - started
+
+
+async def drive(args, size):
+    import logging
+    import config
+
+    # Бенчмарк измеряет обработчики, а не лимиты Telegram и не лог
+    config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = config.SEND_GROUP_RATE = 1e9
+    config.SEND_CHAT_BURST = 1e9
+    config.REFRESH_WINDOW = 0
+
+    import database as db
+    import bot
+    from telegram.ext import Application
+    from telegram_stub import StubRequest
+    logging.getLogger().setLevel(logging.WARNING)
+
+    db.migrate()
+    gen = Generator(args.chats, args.youtube_ratio, seed=args.seed)
+    seeded, seed_seconds = seed_database(gen, size)
+
+    for chat_id in gen.chats:
+        for name, term in PRESETS:
+            if db.get_preset(chat_id, name) is None:
+                db.create_preset(chat_id, name, term)
+
+    def fake_youtube_title(url):
+        time.sleep(args.fetch_delay)
+        return f'Video {url[-11:]}'
+
+    async def fake_page_title(url):
+        await asyncio.sleep(args.fetch_delay)
+        return f'Page {url[-8:]}'
+
+    bot.title_enricher.resolver = bot.title_cache.cached(fake_youtube_title)
+    bot.page_enricher.resolver = fake_page_title
+
+    builder = Application.builder().token('1:bench').request(StubRequest()).get_updates_request(StubRequest())
+    application = bot.build_application(builder)
+    await application.initialize()
+    await bot.post_init(application)
+    updates = Updates(application.bot)
+
+    samples = {'handle_message': [], 'all_links': [], 'handle_preset': [], 'handle_inline_button': []}
+
+    async def timed(name, update):
+        started = time.perf_counter()
+        await application.process_update(update)
+        samples[name].append(time.perf_counter() - started)
+
+    # Поток сообщений со ссылками (обновления собираются заранее, вне замера)
+    links_sent = 0
+    messages = []
+    for _ in range(args.messages):
+        urls = [gen.url() for _ in range(gen.random.choice([1, 1, 1, 2, 3]))]
+        links_sent += len(urls)
+        messages.append(updates.message(gen.chat(), gen.user(), urls, gen.text(urls)))
+    ingest_started = time.perf_counter()
+    for update in messages:
+        await timed('handle_message', update)
+    await bot.link_buffer.flush()
+    ingest_seconds = time.perf_counter() - ingest_started
+
+    # Просмотр: команды и кнопки страниц
+    for _ in range(args.queries):
+        chat_id = gen.chat()
+        user_id = gen.user()
+        await timed('all_links', updates.command(chat_id, user_id, 'all_links'))
+        await timed('handle_preset', updates.command(chat_id, user_id, gen.random.choice(PRESETS)[0]))
+
+        links, _ = db.get_links_page(chat_id, limit=bot.PAGE_SIZE)
+        data = bot.encode_page('all', 'n', links[-1]) if links else bot.encode_page('all')
+        await timed('handle_inline_button', updates.callback(chat_id, user_id, data))
+
+    await bot.post_shutdown(application)
+    await application.shutdown()
+
+    return {
+        'size': size,
+        'seed': {'rows': seeded, 'seconds': round(seed_seconds, 3),
+                 'rows_per_second': round(seeded / seed_seconds) if seed_seconds else None},
+        'ingest': {'messages': args.messages, 'links': links_sent, 'seconds': round(ingest_seconds, 3),
+                   'rows_per_second': round(links_sent / ingest_seconds)},
+        'handlers': {name: summarize(values) for name, values in samples.items() if values},
+    }
+
+
+def run_size(args, size):
+    """Один размер БД в отдельном процессе"""
+    import database as db
+    os.makedirs(args.data_dir, exist_ok=True)
+    db.configure(f"sqlite:///{os.path.abspath(os.path.join(args.data_dir, f'links_{size}.db'))}")
+    return asyncio.run(drive(args, size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivist Bot benchmark")
+    parser.add_argument('--sizes', default='10000',
+                        help="comma-separated seeded DB sizes, e.g. 10000,1000000,10000000")
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--youtube-ratio', type=float, default=0.35)
+    parser.add_argument('--messages', type=int, default=2000, help="link messages to ingest per size")
+    parser.add_argument('--queries', type=int, default=500, help="browse rounds per size")
+    parser.add_argument('--fetch-delay', type=float, default=0.0, help="fake yt_dlp latency, seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', default='bench_data')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f"[BENCH] size={size}", file=sys.stderr)
+        with context.Pool(1) as pool:
+            result = pool.apply(run_size, (args, size))
+        results.append(result)
+        for name, stats in result['handlers'].items():
+            print(f"  {name:22} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms", file=sys.stderr)
+        print(f"  ingest: {result['ingest']['rows_per_second']} rows/s", file=sys.stderr)
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[BENCH] Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
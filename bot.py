@@ -1,114 +1,331 @@
+import asyncio
 import logging
-import re
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import os
+import threading
+import time
+from datetime import datetime
+from html import escape
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity
+from telegram.constants import ChatMemberStatus, ChatType
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 
+import archive
+import config
 from config import BOT_TOKEN, BOT_USERNAME
 import database as db
+import export
+import metrics
+import render
+from chat_processor import ChatOrderedUpdateProcessor
+from outbox import RefreshCoalescer, SendRateLimiter
+from enrichment import TitleEnricher
+from ingest import LinkBuffer
+from preset_registry import PresetRegistry
+from links import extract_links, extract_youtube_title, is_youtube_url, unique_links, youtube_video_id
+from metadata_cache import MetadataCache
+from page_titles import PAGE_WORKERS, PageTitleFetcher
+from recent_links import RecentLinks
 
 # Логирование
+# Уровень задается LOG_LEVEL в config.py (DEBUG - подробный лог каждой ссылки)
+LOG_LEVEL = getattr(config, 'LOG_LEVEL', 'INFO')
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Сколько ссылок показывать на одной странице
+PAGE_SIZE = getattr(config, 'PAGE_SIZE', 10)
+
+# Режим webhook: включается, если задан публичный адрес WEBHOOK_URL
+# (или флагом run.py --webhook). Локальный адрес и путь - для балансировщика/TLS-прокси.
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', None)
+WEBHOOK_LISTEN = getattr(config, 'WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = getattr(config, 'WEBHOOK_SECRET', None)
+WEBHOOK_MAX_CONNECTIONS = getattr(config, 'WEBHOOK_MAX_CONNECTIONS', 40)
+
 # Утилиты
-def extract_links(text):
-    """Извлекает ссылки из текста"""
-    return re.findall(r'https?://[^\s]+', text) if text else []
-
-def extract_youtube_title(text):
-    """Пытается извлечь название видео из текста сообщения"""
-    lines = text.split('\n')
-    for i, line in enumerate(lines):
-        if 'youtube.com' in line or 'youtu.be' in line:
-            if i > 0 and not lines[i-1].startswith('http'):
-                title = lines[i-1].strip()
-                if title and len(title) > 0 and len(title) < 300:
-                    return title[:200]
-    
-    text_without_urls = re.sub(r'https?://[^\s]+', '', text).strip()
-    if text_without_urls and len(text_without_urls) < 300:
-        return text_without_urls[:200]
-    
-    return None
+def message_links(message):
+    """Ссылки сообщения: из сущностей url/text_link, иначе регуляркой по тексту.
+
+    Повторы внутри одного сообщения (по канонической форме) отбрасываются.
+    """
+    types = [MessageEntity.URL, MessageEntity.TEXT_LINK]
+    entities = message.parse_entities(types) or message.parse_caption_entities(types)
+    if entities:
+        urls = [
+            entity.url if entity.type == MessageEntity.TEXT_LINK else text
+            for entity, text in entities.items()
+        ]
+    else:
+        urls = extract_links(message.text or message.caption)
+    return unique_links(urls)
+
+# Таймаут сокета yt_dlp: asyncio.wait_for в TitleEnricher не останавливает поток,
+# зависший запрос освобождает его только по этому таймауту. Повторы делает
+# TitleEnricher, поэтому собственные повторы yt_dlp выключены.
+YDL_SOCKET_TIMEOUT = getattr(config, 'YDL_SOCKET_TIMEOUT', 10)
+
+YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'socket_timeout': YDL_SOCKET_TIMEOUT,
+    'extractor_retries': 0,
+}
+
+# yt_dlp импортируется при первом запросе названия; YoutubeDL не потокобезопасен,
+# поэтому у каждого потока TitleEnricher свой экземпляр, который переиспользуется
+_ydl = threading.local()
+
+def _youtube_dl():
+    ydl = getattr(_ydl, 'instance', None)
+    if ydl is None:
+        import yt_dlp
+        ydl = _ydl.instance = yt_dlp.YoutubeDL(YDL_OPTS)
+    return ydl
 
 def get_youtube_video_title(url):
-    """Получает название видео с YouTube по URL"""
+    """Получает название видео с YouTube по URL (блокирующий вызов).
+
+    Ошибки не подавляются: их обрабатывает TitleEnricher с повторами.
+    """
+    started = time.perf_counter()
+    result = 'error'
     try:
-        import yt_dlp
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title = info.get('title', None)
-            if title:
-                logger.info(f"[YOUTUBE_FETCH] Got title: {title[:50]}")
-                return title[:200]
-    except Exception as e:
-        logger.debug(f"[YOUTUBE_FETCH] Error: {e}")
+        info = _youtube_dl().extract_info(url, download=False)
+        title = info.get('title', None)
+        result = 'ok' if title else 'empty'
+    finally:
+        metrics.FETCH_SECONDS.observe(time.perf_counter() - started, source='youtube', result=result)
+    if title:
+        logger.debug("[YOUTUBE_FETCH] title=%.50s", title)
+        return title[:200]
     return None
 
-async def send_long_message(update, text, reply_markup=None):
-    """Отправляет длинное сообщение"""
-    if len(text) > 4000:
-        await update.message.reply_text(text[:4000], reply_markup=reply_markup)
-        for i in range(4000, len(text), 4000):
-            await update.message.reply_text(text[i:i+4000])
-    else:
-        await update.message.reply_text(text, reply_markup=reply_markup)
-
-async def send_long_query_message(query, text, reply_markup=None):
-    """Отправляет длинное сообщение через callback query"""
-    if len(text) > 4000:
-        await query.message.reply_text(text[:4000], reply_markup=reply_markup)
-        for i in range(4000, len(text), 4000):
-            await query.message.reply_text(text[i:i+4000])
+# Названия YouTube видео получаются в фоне, не задерживая сохранение ссылки.
+# Повторные видео берутся из кэша без обращения к YouTube.
+title_cache = MetadataCache()
+title_enricher = TitleEnricher(title_cache.cached(get_youtube_video_title))
+
+# Названия остальных страниц (og:title / <title>) - отдельная очередь, чтобы
+# медленные сайты не задерживали YouTube
+page_titles = PageTitleFetcher()
+page_enricher = TitleEnricher(page_titles.fetch, workers=PAGE_WORKERS)
+
+# Ссылки пишутся в БД пачками (write-behind), а не отдельной транзакцией на каждую
+link_buffer = LinkBuffer()
+
+def queue_missing_titles(rows, ids):
+    """После записи пачки ставит ссылки без названия в очередь"""
+    for row, link_id in zip(rows, ids):
+        # link_id is None - повтор уже сохраненной ссылки
+        if link_id is None or row['title'] is not None:
+            continue
+        if row['video_id']:
+            logger.debug("[YOUTUBE_FETCH] queued url=%.50s", row['url'])
+            title_enricher.submit(link_id, row['url'])
+        else:
+            # Каналы и плейлисты YouTube тоже: og:title дешевле, чем yt_dlp
+            page_enricher.submit(link_id, row['url'])
+
+link_buffer.on_saved.append(queue_missing_titles)
+
+async def sweep_untitled_links(batch_size=500):
+    """Ставит в очередь ссылки без названия, добавленные в обход бота (run.py
+    import). Пройденный id запоминается только после того, как пачка
+    обработана, - после перезапуска проход продолжится с необработанной пачки."""
+    after_id = int(await db.run(db.get_state, 'title_sweep_id', 0))
+    while True:
+        links = await db.run(db.get_untitled_links, after_id, batch_size)
+        if not links:
+            return
+        done = []
+        for link_id, url, video_id in links:
+            enricher = title_enricher if video_id else page_enricher
+            done.append(await enricher.put(link_id, url))
+        await asyncio.gather(*done)
+        after_id = links[-1].id
+        await db.run(db.set_state, 'title_sweep_id', after_id)
+        logger.info("[TITLE_SWEEP] done up to id=%s", after_id)
+
+# Пресеты чатов в памяти: неизвестные команды отсекаются без запроса к БД
+preset_registry = PresetRegistry()
+
+# Обновления разных чатов обрабатываются параллельно, одного чата - по очереди
+update_processor = ChatOrderedUpdateProcessor()
+
+# Частые одинаковые нажатия кнопок страниц сливаются в одну перерисовку;
+# отложенная перерисовка встает в очередь своего чата
+page_refresher = RefreshCoalescer(ordered=update_processor.run_in_chat)
+
+# Общая очередь исходящих запросов (одна на процесс)
+send_limiter = SendRateLimiter()
+
+# Состояние фоновых очередей и кэшей - считается при запросе /metrics
+metrics.Gauge('archivist_enrich_queue_depth', 'Links waiting for a title', lambda: title_enricher.depth)
+metrics.Gauge('archivist_page_enrich_queue_depth', 'Non-YouTube links waiting for a title',
+              lambda: page_enricher.depth)
+metrics.Gauge('archivist_ingest_buffer_depth', 'Rows waiting to be written', lambda: link_buffer.depth)
+metrics.Gauge('archivist_title_cache_size', 'Titles held in memory', lambda: title_cache.stats()['size'])
+metrics.Gauge(
+    'archivist_title_cache_lookups_total', 'Title cache lookups by result',
+    lambda: {(key,): title_cache.stats()[key] for key in ('memory_hits', 'db_hits', 'misses')},
+    labels=('result',), kind='counter'
+)
+metrics.Gauge('archivist_send_waiting_chats', 'Chats with queued or paused sends', lambda: send_limiter.waiting_chats)
+metrics.Gauge('archivist_refresh_merged_total', 'Page refreshes merged', lambda: page_refresher.merged, kind='counter')
+
+async def send_links(message, header, links, show_title=False, reply_markup=None):
+    """Отправляет список ссылок, при необходимости несколькими сообщениями.
+
+    Сообщения режутся только между записями, кнопки - у первого сообщения.
+    """
+    for text in render.pack_messages(header, render.iter_link_entries(links, show_title)):
+        await message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
+        reply_markup = None
+
+# ===== ПАГИНАЦИЯ =====
+#
+# callback_data страницы: "pg:<вид>[:<n|p>:<дата>:<id>]", где вид - all, yt
+# или p<id пресета>, n - листать к старым, p - к новым от ссылки с этой датой/id.
+# Без курсора - первая страница (кнопка "Обновить").
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+VIEW_TITLES = {
+    'all': "Все ссылки:",
+    'yt': "YouTube ссылки:",
+}
+
+def encode_page(view, direction=None, link=None):
+    """Собирает callback_data для страницы"""
+    if link is None:
+        return f"pg:{view}"
+    return f"pg:{view}:{direction}:{link.timestamp.strftime(CURSOR_FORMAT)}:{link.id}"
+
+def decode_page(data):
+    """Разбирает callback_data страницы в (вид, курсор, назад).
+
+    Для испорченных данных (старые кнопки, подделанный callback) - None.
+    """
+    parts = data.split(':')
+    if len(parts) not in (2, 5) or parts[0] != 'pg':
+        return None
+    view = parts[1]
+    if view not in VIEW_TITLES and not (view[:1] == 'p' and view[1:].isdecimal()):
+        return None
+    if len(parts) == 2:
+        return view, None, False
+    if parts[2] not in ('n', 'p'):
+        return None
+    try:
+        cursor = (datetime.strptime(parts[3], CURSOR_FORMAT), int(parts[4]))
+    except ValueError:
+        return None
+    return view, cursor, parts[2] == 'p'
+
+async def fetch_page(chat_id, view, cursor=None, backward=False):
+    """Загружает страницу ссылок. Возвращает (заголовок, ссылки, есть_ли_еще)"""
+    if view.startswith('p'):
+        # Совпадения с пресетом посчитаны при записи (preset_links),
+        # в том числе для ссылок, которые потом ушли в архив
+        preset, link_ids, has_more = await db.run(
+            db.get_preset_links_page, chat_id, int(view[1:]), cursor, backward, PAGE_SIZE
+        )
+        if preset is None:
+            return None, [], False
+        links = await db.run(archive.resolve_links, link_ids)
+        return f"Результаты по '{escape(preset.search_term)}':", links, has_more
+    
+    if cursor is None:
+        links, has_more = await recent_links.first_page(chat_id, view)
     else:
-        await query.message.reply_text(text, reply_markup=reply_markup)
+        links, has_more = await load_links_page(chat_id, view, PAGE_SIZE, cursor, backward)
+    return VIEW_TITLES[view], links, has_more
 
-def format_links_response(links, title, show_title=False):
-    """Форматирует ответ со ссылками"""
-    response = f"{title}\n\n" if title else ""
-    
+async def load_links_page(chat_id, view, limit, cursor=None, backward=False):
+    """Страница вида all или yt из БД и архива: (ссылки, есть_ли_еще)"""
+    youtube = view == 'yt'
+    page = db.get_youtube_links_page if youtube else db.get_links_page
+    links, has_more = await db.run(page, chat_id, cursor, backward, limit)
+    # Старые ссылки могут быть перенесены в архив (run.py retention)
+    if archive.exists():
+        cold, cold_more = await db.run(archive.get_page, chat_id, cursor, backward, limit, youtube)
+        links, has_more = archive.merge_pages(links, has_more, cold, cold_more, backward, limit)
+    return links, has_more
+
+# Первые страницы all/yt отдаются из памяти, без запроса к БД
+recent_links = RecentLinks(load_links_page, PAGE_SIZE)
+link_buffer.on_saved.append(recent_links.add_saved)
+title_enricher.on_titled.append(recent_links.set_title)
+page_enricher.on_titled.append(recent_links.set_title)
+metrics.Gauge('archivist_recent_links_bytes', 'Memory held by cached first pages', lambda: recent_links.size)
+metrics.Gauge('archivist_recent_links_chats', 'Chats with cached first pages', lambda: recent_links.chats)
+metrics.Gauge(
+    'archivist_recent_links_lookups_total', 'First page lookups by result',
+    lambda: {('hit',): recent_links.hits, ('miss',): recent_links.misses},
+    labels=('result',), kind='counter'
+)
+
+def render_page(view, title, links, has_more, cursor=None, backward=False):
+    """Формирует текст и кнопки страницы"""
+    text, shown = render.fit_page(title + "\n\n", links, show_title=True)
+    
+    # Назад (к новым) есть, если мы пришли со следующей страницы или там еще что-то есть
+    has_newer = has_more if backward else cursor is not None
+    has_older = cursor is not None if backward else has_more
+    if shown < len(links):
+        # Не все ссылки влезли в сообщение - остальные будут на следующей странице
+        links = links[:shown]
+        has_older = True
+    
+    nav = []
+    if links and has_newer:
+        nav.append(InlineKeyboardButton("« Новее", callback_data=encode_page(view, 'p', links[0])))
+    if links and has_older:
+        nav.append(InlineKeyboardButton("Старее »", callback_data=encode_page(view, 'n', links[-1])))
+    keyboard = [nav] if nav else []
+    keyboard.append([InlineKeyboardButton("Обновить", callback_data=encode_page(view))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_page(query, view, cursor=None, backward=False):
+    """Редактирует сообщение с кнопками, показывая нужную страницу"""
+    title, links, has_more = await fetch_page(query.message.chat_id, view, cursor, backward)
+    if title is None:
+        await query.edit_message_text("Фильтр удален")
+        return
+    text, reply_markup = render_page(view, title, links, has_more, cursor, backward)
+    try:
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    except BadRequest as e:
+        # Повторное нажатие "Обновить" без новых ссылок
+        if 'not modified' not in str(e):
+            raise
+
+async def send_first_page(message, view, empty_text):
+    """Отправляет первую страницу новым сообщением"""
+    title, links, has_more = await fetch_page(message.chat_id, view)
     if not links:
-        return response + "Нет ссылок"
-    
-    for i, link in enumerate(links, 1):
-        try:
-            date = link.timestamp.strftime('%d.%m.%Y') if link.timestamp else "N/A"
-        except Exception:
-            date = "N/A"
-        
-        if show_title and link.title:
-            # YouTube с названием - жирное форматирование
-            response += f"{i}. <b>{link.title}</b>\n"
-            response += f"🔗 <code>{link.url}</code>\n"
-            response += f"👤 {link.username or 'Unknown'} | 📅 {date}\n"
-            response += "\n"  # Отступ между ссылками
-        else:
-            response += f"{i}. <code>{link.url}</code>\n"
-            response += f"👤 {link.username or 'Unknown'} | 📅 {date}\n"
-            
-            message_text = link.message_text or ""
-            preview = message_text[:50] + "..." if len(message_text) > 50 else message_text
-            if preview:
-                response += f"💬 <i>{preview}</i>\n"
-            
-            response += "\n"  # Отступ между ссылками
-    
-    return response
+        await message.reply_text(empty_text)
+        return
+    text, reply_markup = render_page(view, title, links, has_more)
+    await message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
 
 # ===== КОМАНДЫ БОТА =====
 
+# Действия inline кнопок (метка метрики; остальное считается как other)
+BUTTON_ACTIONS = {'pg', 'all_links', 'youtube', 'my_presets', 'add_preset_help', 'start'}
+
+@metrics.timed('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start"""
     chat_type = update.message.chat.type
-    logger.info(f"[START] Chat ID: {update.message.chat_id}, Type: {chat_type}")
+    logger.info("[START] chat_id=%s type=%s", update.message.chat_id, chat_type)
     
     if chat_type in ['group', 'supergroup']:
         menu = f"""
@@ -119,6 +336,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /youtube@{BOT_USERNAME} - YouTube ссылки
 /add_preset@{BOT_USERNAME} - Создать фильтр
 /my_presets@{BOT_USERNAME} - Мои фильтры
+/search@{BOT_USERNAME} слово - Поиск
+/export@{BOT_USERNAME} - Архив ссылок файлом
+/stats@{BOT_USERNAME} - Статистика чата
 
 💡 <b>Просто кидай ссылки, я их сохраню!</b>
 """
@@ -132,6 +352,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /youtube - Только ютуб
 /add_preset - Создать фильтр
 /my_presets - Мои фильтры
+/search слово - Поиск
+/export - Архив ссылок файлом
+/stats - Статистика чата
 
 💡 <b>Просто кидай ссылки в чат</b>
 """
@@ -144,6 +367,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(menu, parse_mode='HTML', reply_markup=reply_markup)
 
+@metrics.timed('help')
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /help"""
     help_text = f"""
@@ -154,6 +378,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /youtube или /youtube@{BOT_USERNAME} - Ютуб ссылки  
 /add_preset или /add_preset@{BOT_USERNAME} - Создать фильтр
 /my_presets или /my_presets@{BOT_USERNAME} - Мои фильтры
+/search слово или /search@{BOT_USERNAME} слово - Поиск по ссылкам
+/export или /export csv - Весь архив ссылок файлом (.gz)
+/retention дни - Через сколько дней переносить ссылки в архив (администраторы)
+/stats - Топ доменов и авторов, ссылки по дням
 
 📝 <b>Как создать фильтр:</b>
 /add_preset habr habr
@@ -161,43 +389,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 """
     await update.message.reply_text(help_text, parse_mode='HTML')
 
+@metrics.timed('all_links')
 async def all_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /all_links"""
-    logger.info(f"[ALL_LINKS] Chat ID: {update.message.chat_id}")
-    chat_id = update.message.chat_id
-    links = db.get_all_links(chat_id, limit=50)
-    
-    if not links:
-        await update.message.reply_text("Еще нет ссылок")
-        return
-    
-    response = "Все ссылки:\n\n"
-    response += format_links_response(links, "")
-    
-    keyboard = [[InlineKeyboardButton("Обновить", callback_data="all_links")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await send_long_message(update, response, reply_markup)
+    logger.info("[ALL_LINKS] chat_id=%s", update.message.chat_id)
+    await send_first_page(update.message, 'all', "Еще нет ссылок")
 
+@metrics.timed('youtube')
 async def youtube_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /youtube"""
-    logger.info(f"[YOUTUBE] Chat ID: {update.message.chat_id}")
-    chat_id = update.message.chat_id
-    links = db.get_youtube_links(chat_id, limit=50)
-    
-    if not links:
-        await update.message.reply_text("Ютуб ссылок нет")
-        return
-    
-    response = "YouTube ссылки:\n\n"
-    response += format_links_response(links, "", show_title=True)
-    
-    keyboard = [[InlineKeyboardButton("Обновить", callback_data="youtube")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await send_long_message(update, response, reply_markup)
+    logger.info("[YOUTUBE] chat_id=%s", update.message.chat_id)
+    await send_first_page(update.message, 'yt', "Ютуб ссылок нет")
 
+@metrics.timed('add_preset')
 async def add_preset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /add_preset"""
-    logger.info(f"[ADD_PRESET] Chat ID: {update.message.chat_id}")
+    logger.info("[ADD_PRESET] chat_id=%s", update.message.chat_id)
     
     if not context.args or len(context.args) < 2:
         await update.message.reply_text("Использование: /add_preset <команда> <слово>")
@@ -207,19 +414,19 @@ async def add_preset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     search_term = ' '.join(context.args[1:])
     chat_id = update.message.chat_id
     
-    if db.preset_exists(chat_id, command_name):
+    if not await preset_registry.create(chat_id, command_name, search_term):
         await update.message.reply_text(f"Пресет '{command_name}' уже есть")
         return
     
-    db.create_preset(chat_id, command_name, search_term)
-    logger.info(f"[PRESET_CREATED] Name: {command_name}")
+    logger.info("[PRESET_CREATED] chat_id=%s name=%s", chat_id, command_name)
     await update.message.reply_text(f"Пресет '{command_name}' создан!")
 
+@metrics.timed('my_presets')
 async def my_presets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /my_presets"""
-    logger.info(f"[MY_PRESETS] Chat ID: {update.message.chat_id}")
+    logger.info("[MY_PRESETS] chat_id=%s", update.message.chat_id)
     chat_id = update.message.chat_id
-    presets = db.get_presets(chat_id)
+    presets = (await preset_registry.presets(chat_id)).values()
     
     if not presets:
         keyboard = [[InlineKeyboardButton("Создать фильтр", callback_data="add_preset_help")]]
@@ -235,6 +442,119 @@ async def my_presets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(response, reply_markup=reply_markup)
 
+@metrics.timed('search')
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /search"""
+    logger.info("[SEARCH] chat_id=%s", update.message.chat_id)
+    
+    if not context.args:
+        await update.message.reply_text("Использование: /search <слово>")
+        return
+    
+    search_term = ' '.join(context.args)
+    chat_id = update.message.chat_id
+    links = await db.run(db.search_links, chat_id, search_term, limit=50)
+    
+    if not links:
+        await update.message.reply_text(f"По '{search_term}' нет ссылок")
+        return
+    
+    await send_links(update.message, f"Поиск '{escape(search_term)}':\n\n", links, show_title=True)
+
+@metrics.timed('export')
+async def export_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /export [csv] - весь архив ссылок чата файлом"""
+    logger.info("[EXPORT] chat_id=%s", update.message.chat_id)
+    
+    fmt = context.args[0].lower() if context.args else 'jsonl'
+    if fmt not in export.FORMATS:
+        await update.message.reply_text("Использование: /export [jsonl|csv]")
+        return
+    
+    chat_id = update.message.chat_id
+    await update.message.reply_text("Собираю архив...")
+    try:
+        path, count = await export.export_chat(chat_id, fmt)
+    except export.ExportTooLarge:
+        await update.message.reply_text("Архив слишком большой для отправки в Telegram")
+        return
+    try:
+        if not count:
+            await update.message.reply_text("Еще нет ссылок")
+            return
+        with open(path, 'rb') as document:
+            await update.message.reply_document(
+                document, filename=f"links_{chat_id}.{fmt}.gz",
+                caption=f"Ссылок: {count}"
+            )
+    finally:
+        os.remove(path)
+
+async def is_chat_admin(update, context):
+    """Автор сообщения - администратор чата (в личном чате - всегда да)"""
+    chat = update.effective_chat
+    if chat.type == ChatType.PRIVATE:
+        return True
+    # Анонимный администратор пишет от имени самой группы
+    sender_chat = update.message.sender_chat
+    if sender_chat is not None and sender_chat.id == chat.id:
+        return True
+    member = await context.bot.get_chat_member(chat.id, update.effective_user.id)
+    return member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+@metrics.timed('retention')
+async def retention(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /retention [дни|off|default] - срок хранения ссылок в быстрой части архива"""
+    logger.info("[RETENTION] chat_id=%s", update.message.chat_id)
+    chat_id = update.message.chat_id
+    
+    if context.args:
+        # Срок хранения - настройка всего чата, менять ее могут только администраторы
+        if not await is_chat_admin(update, context):
+            await update.message.reply_text("Менять срок хранения могут только администраторы чата")
+            return
+        value = context.args[0].lower()
+        if value == 'off':
+            days = 0
+        elif value == 'default':
+            days = None
+        elif value.isdigit() and int(value) > 0:
+            days = int(value)
+        else:
+            await update.message.reply_text("Использование: /retention <дни|off|default>")
+            return
+        await db.run(db.set_retention, chat_id, days)
+    else:
+        days = await db.run(db.get_retention, chat_id)
+    
+    if days is None:
+        days = archive.RETENTION_DAYS
+    if days:
+        text = f"Ссылки старше {days} дн. переносятся в архив (они по-прежнему видны в списках и /export)"
+    else:
+        text = "Ссылки не переносятся в архив"
+    await update.message.reply_text(text)
+
+@metrics.timed('stats')
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /stats - домены, авторы и ссылки по дням"""
+    logger.info("[STATS] chat_id=%s", update.message.chat_id)
+    
+    summary = await db.run(db.get_chat_stats, update.message.chat_id)
+    if not summary['total']:
+        await update.message.reply_text("Еще нет ссылок")
+        return
+    
+    lines = [f"📊 <b>Всего ссылок:</b> {summary['total']}", "", "🌐 <b>Домены:</b>"]
+    lines += [f"{count} - {escape(domain or '?')}" for domain, count in summary['domains']]
+    lines += ["", "👤 <b>Авторы:</b>"]
+    lines += [f"{count} - {escape(name or '?')}" for name, count in summary['users']]
+    if summary['days']:
+        lines += ["", "📅 <b>По дням:</b>"]
+        lines += [f"{day:%d.%m} - {count}" for day, count in summary['days']]
+    await update.message.reply_text('\n'.join(lines), parse_mode='HTML')
+
+@metrics.timed('handle_preset')
 async def handle_preset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик пользовательских команд"""
     text = update.message.text
@@ -242,24 +562,20 @@ async def handle_preset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not text or not text.startswith('/'):
         return
     
-    command = text[1:].split('@')[0].split(' ')[0]
+    command, _, mention = text[1:].split(' ')[0].partition('@')
+    if mention and mention.lower() != BOT_USERNAME.lower():
+        # Команда для другого бота
+        return
     chat_id = update.message.chat_id
     
-    preset = db.get_preset(chat_id, command)
+    preset = await preset_registry.get(chat_id, command)
     if not preset:
         return
     
-    logger.info(f"[HANDLE_PRESET] Command: {command}")
-    links = db.search_links_by_preset(chat_id, preset.search_term, limit=50)
-    
-    if not links:
-        await update.message.reply_text(f"По '{preset.search_term}' нет ссылок")
-        return
-    
-    response = f"Результаты по '{preset.search_term}':\n\n"
-    response += format_links_response(links, "")
-    await send_long_message(update, response)
+    logger.info("[HANDLE_PRESET] chat_id=%s command=%s", chat_id, command)
+    await send_first_page(update.message, f"p{preset.id}", f"По '{preset.search_term}' нет ссылок")
 
+@metrics.timed('handle_message')
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик сообщений"""
     if update.message.text and update.message.text.startswith('/'):
@@ -273,27 +589,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     username = update.message.from_user.username or update.message.from_user.first_name
     
-    links = extract_links(text)
-    logger.debug(f"[HANDLE_MESSAGE] Found {len(links)} links")
+    links = message_links(update.message)
+    logger.debug("[HANDLE_MESSAGE] chat_id=%s links=%d", chat_id, len(links))
+    
+    # Название из текста одинаково для всех ссылок сообщения - считаем один раз
+    text_title = None
+    if any(is_youtube_url(link) for link in links):
+        text_title = extract_youtube_title(text)
     
     for link in links:
         title = None
         
-        if 'youtube.com' in link or 'youtu.be' in link:
-            title = extract_youtube_title(text)
-            if not title:
-                logger.debug(f"[YOUTUBE_FETCH] Fetching: {link[:50]}")
-                title = get_youtube_video_title(link)
+        if is_youtube_url(link):
+            title = text_title or title_cache.peek(youtube_video_id(link))
         
-        db.save_link(chat_id, user_id, username, link, text, title=title)
-        logger.info(f"[SAVED_LINK] URL: {link[:50]}, Title: {title[:30] if title else 'None'}")
+        link_buffer.add(db.link_row(chat_id, user_id, username, link, text, title=title))
+        logger.debug("[SAVED_LINK] chat_id=%s url=%.50s title=%.30s", chat_id, link, title)
 
+@metrics.timed('new_chat_members')
 async def new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик новых членов"""
     for member in update.message.new_chat_members:
         if member.id == context.bot.id:
             await update.message.reply_text("Привет! Я здесь для сохранения ссылок")
 
+@metrics.timed('inline_button')
 async def handle_inline_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик inline кнопок"""
     query = update.callback_query
@@ -302,32 +622,32 @@ async def handle_inline_button(update: Update, context: ContextTypes.DEFAULT_TYP
     chat_id = query.message.chat_id
     callback_data = query.data
     
-    logger.info(f"[INLINE] Button: {callback_data}, Chat: {chat_id}, User: {query.from_user.id}")
+    logger.info("[INLINE] chat_id=%s user_id=%s data=%s", chat_id, query.from_user.id, callback_data)
     
     # Кнопки работают для всех пользователей в чате
-    
-    if callback_data == "all_links":
-        links = db.get_all_links(chat_id)
-        if not links:
-            await query.message.reply_text("Нет ссылок")
+    action = callback_data.split(':', 1)[0]
+    with metrics.CALLBACK_SECONDS.time(action=action if action in BUTTON_ACTIONS else 'other'):
+        await _button_action(query, chat_id, callback_data)
+
+async def _button_action(query, chat_id, callback_data):
+    """Выполняет действие нажатой кнопки"""
+    if callback_data.startswith("pg:"):
+        page = decode_page(callback_data)
+        if page is None:
+            logger.warning("[INLINE] Malformed page data=%.64s", callback_data)
             return
-        response = "Все ссылки:\n\n" + format_links_response(links, "")
-        keyboard = [[InlineKeyboardButton("Обновить", callback_data="all_links")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await send_long_query_message(query, response, reply_markup)
+        view, cursor, backward = page
+        key = (chat_id, query.message.message_id, callback_data)
+        await page_refresher.request(key, lambda: show_page(query, view, cursor, backward), chat_id)
+    
+    elif callback_data == "all_links":
+        await send_first_page(query.message, 'all', "Нет ссылок")
     
     elif callback_data == "youtube":
-        links = db.get_youtube_links(chat_id)
-        if not links:
-            await query.message.reply_text("Нет YouTube ссылок")
-            return
-        response = "YouTube ссылки:\n\n" + format_links_response(links, "", show_title=True)
-        keyboard = [[InlineKeyboardButton("Обновить", callback_data="youtube")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await send_long_query_message(query, response, reply_markup)
+        await send_first_page(query.message, 'yt', "Нет YouTube ссылок")
     
     elif callback_data == "my_presets":
-        presets = db.get_presets(chat_id)
+        presets = (await preset_registry.presets(chat_id)).values()
         if not presets:
             await query.message.reply_text("Нет фильтров")
             return
@@ -353,9 +673,42 @@ async def handle_inline_button(update: Update, context: ContextTypes.DEFAULT_TYP
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.message.reply_text(menu, reply_markup=reply_markup)
 
-def main():
-    """Запуск бота"""
-    application = Application.builder().token(BOT_TOKEN).build()
+async def post_init(application):
+    """Запуск фоновых задач"""
+    await title_enricher.start()
+    await page_enricher.start()
+    await link_buffer.start()
+    application.bot_data['title_sweep'] = asyncio.create_task(sweep_untitled_links())
+    if metrics.METRICS_PORT:
+        application.bot_data['metrics_server'] = await metrics.start_server()
+
+async def post_shutdown(application):
+    """Остановка фоновых задач"""
+    sweep = application.bot_data.pop('title_sweep', None)
+    if sweep:
+        sweep.cancel()
+        await asyncio.gather(sweep, return_exceptions=True)
+    # Сначала дописываем буфер, затем останавливаем очередь названий
+    await link_buffer.stop()
+    await title_enricher.stop()
+    await page_enricher.stop()
+    await page_titles.close()
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+
+def build_application(builder=None):
+    """Создает Application со всеми обработчиками (общее для polling и webhook)"""
+    builder = builder or Application.builder().token(BOT_TOKEN)
+    application = (
+        builder
+        .concurrent_updates(update_processor)
+        .rate_limiter(send_limiter)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     handlers = [
         CommandHandler("start", start),
@@ -364,6 +717,10 @@ def main():
         CommandHandler("youtube", youtube_links),
         CommandHandler("add_preset", add_preset),
         CommandHandler("my_presets", my_presets),
+        CommandHandler("search", search),
+        CommandHandler("export", export_links),
+        CommandHandler("retention", retention),
+        CommandHandler("stats", stats),
         CallbackQueryHandler(handle_inline_button),
         MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat_members),
         MessageHandler(filters.COMMAND, handle_preset),
@@ -373,10 +730,40 @@ def main():
     
     for handler in handlers:
         application.add_handler(handler)
+    return application
+
+def main(webhook=None):
+    """Запуск бота. webhook=None - режим берется из конфига (WEBHOOK_URL)"""
+    db.require_schema()
+    
+    if webhook is None:
+        webhook = bool(WEBHOOK_URL)
+    if webhook and not WEBHOOK_URL:
+        # Без адреса PTB зарегистрировал бы у Telegram http://<WEBHOOK_LISTEN>:...,
+        # который Telegram отклоняет (а рабочий webhook был бы сброшен)
+        raise SystemExit(
+            "Для режима webhook нужен WEBHOOK_URL в config.py - "
+            "публичный https адрес, на который Telegram будет слать обновления"
+        )
+    
+    application = build_application()
     
     print(f"Bot started: @{BOT_USERNAME}")
-    logger.info(f"Bot started with token: {BOT_TOKEN[:20]}...")
-    application.run_polling()
+    logger.info("Bot started with token: %.20s...", BOT_TOKEN)
+    
+    if webhook:
+        # Нужен пакет python-telegram-bot[webhooks]
+        logger.info("[WEBHOOK] Listening on %s:%s/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,122 @@
+# chat_processor.py - Параллельная обработка обновлений с сохранением порядка внутри чата
+
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import config
+
+CONCURRENT_UPDATES = getattr(config, 'CONCURRENT_UPDATES', 16)
+
+# Сколько обновлений может ждать своей очереди (ограничение семафора PTB).
+# Реальный параллелизм ограничивает concurrency ниже.
+MAX_PENDING_UPDATES = getattr(config, 'MAX_PENDING_UPDATES', 4096)
+
+
+class _Slot:
+    """Место в общем семафоре, занятое одной задачей"""
+
+    __slots__ = ('semaphore', 'task', 'held')
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.task = asyncio.current_task()
+        self.held = False
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+
+# Слот обработчика, который выполняется в текущей задаче
+_current_slot = contextvars.ContextVar('update_slot', default=None)
+
+
+@asynccontextmanager
+async def released_slot():
+    """Отдает слот обработчика другим чатам на время ожидания (пауза лимита
+    отправки и т.п.). Блокировка чата остается за обработчиком, поэтому
+    порядок обновлений чата не меняется. Вне обработчика ничего не делает.
+    """
+    slot = _current_slot.get()
+    # Задачи, созданные обработчиком, наследуют контекст, но не его слот
+    if slot is None or not slot.held or slot.task is not asyncio.current_task():
+        yield
+        return
+    slot.release()
+    try:
+        yield
+    finally:
+        await slot.acquire()
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных чатов параллельно, а одного чата - строго
+    по очереди.
+
+    Сначала берется блокировка чата (asyncio.Lock отдает ее в порядке запроса),
+    затем общий семафор на concurrency обработчиков. Поэтому очередь одного
+    шумного чата не занимает слоты остальных, а обработчик, который ждет
+    лимита отправки (outbox.SendRateLimiter), на это время отдает свой слот.
+    """
+
+    __slots__ = ('concurrency', '_active', '_chats')
+
+    def __init__(self, concurrency=CONCURRENT_UPDATES, max_pending=MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._active = asyncio.Semaphore(concurrency)
+        # chat_id -> [блокировка, сколько обновлений ее ждет или держит]
+        self._chats = {}
+
+    @property
+    def active_chats(self):
+        """Количество чатов, у которых есть обновления в работе"""
+        return len(self._chats)
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await self._run(coroutine)
+        else:
+            await self.run_in_chat(chat.id, coroutine)
+
+    async def run_in_chat(self, chat_id, coroutine):
+        """Выполняет корутину в очереди чата, как еще одно обновление этого чата"""
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat_id]
+
+    async def _run(self, coroutine):
+        slot = _Slot(self._active)
+        try:
+            await slot.acquire()
+            token = _current_slot.set(slot)
+            try:
+                await coroutine
+            finally:
+                _current_slot.reset(token)
+        finally:
+            slot.release()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
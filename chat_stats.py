@@ -0,0 +1,145 @@
+# chat_stats.py - Счетчики для /stats: ссылки по доменам, авторам и дням
+#
+# Счетчики растут в той же транзакции, что и запись ссылок (database.save_links,
+# import_links), поэтому /stats читает несколько строк по первичному ключу
+# вместо GROUP BY по всей истории чата. Считаются сохраненные ссылки: повтор
+# ссылки увеличивает repost_count, но не счетчики. Перенос в архив счетчики
+# не меняет; пересчет с нуля - rebuild (run.py rebuild-stats).
+
+from collections import Counter
+
+from sqlalchemy import Date, Integer, bindparam, text
+
+_ADD_DOMAINS = text("""
+    INSERT INTO chat_domain_stats (chat_id, domain, link_count)
+    VALUES (:chat_id, :domain, :n)
+    ON CONFLICT (chat_id, domain) DO UPDATE SET link_count = chat_domain_stats.link_count + excluded.link_count
+""")
+
+_ADD_USERS = text("""
+    INSERT INTO chat_user_stats (chat_id, user_id, username, link_count)
+    VALUES (:chat_id, :user_id, :username, :n)
+    ON CONFLICT (chat_id, user_id) DO UPDATE SET
+        link_count = chat_user_stats.link_count + excluded.link_count,
+        username = COALESCE(excluded.username, chat_user_stats.username)
+""")
+
+_ADD_TOTALS = text("""
+    INSERT INTO chat_total_stats (chat_id, link_count)
+    VALUES (:chat_id, :n)
+    ON CONFLICT (chat_id) DO UPDATE SET link_count = chat_total_stats.link_count + excluded.link_count
+""")
+
+_ADD_DAYS = text("""
+    INSERT INTO chat_day_stats (chat_id, day, link_count)
+    VALUES (:chat_id, :day, :n)
+    ON CONFLICT (chat_id, day) DO UPDATE SET link_count = chat_day_stats.link_count + excluded.link_count
+""").bindparams(bindparam('day', type_=Date))
+
+
+class Counts:
+    """Приращения счетчиков, собранные до записи в БД"""
+
+    def __init__(self):
+        self.totals = Counter()   # chat_id -> n
+        self.domains = Counter()  # (chat_id, domain) -> n
+        self.users = Counter()    # (chat_id, user_id) -> n
+        self.usernames = {}       # (chat_id, user_id) -> последнее имя
+        self.days = Counter()     # (chat_id, date) -> n
+
+    def add(self, chat_id, user_id, username, domain, timestamp, n=1):
+        self.totals[chat_id] += n
+        self.domains[(chat_id, domain or '')] += n
+        self.users[(chat_id, user_id or '')] += n
+        if username:
+            self.usernames[(chat_id, user_id or '')] = username
+        if timestamp:
+            self.days[(chat_id, timestamp.date())] += n
+
+    def update(self, other):
+        self.totals.update(other.totals)
+        self.domains.update(other.domains)
+        self.users.update(other.users)
+        self.usernames.update(other.usernames)
+        self.days.update(other.days)
+
+    def __bool__(self):
+        return bool(self.domains)
+
+
+def count_rows(rows):
+    """Counts для строк links (словари database.link_row)"""
+    counts = Counts()
+    for row in rows:
+        counts.add(row['chat_id'], row['user_id'], row['username'], row['domain'], row['timestamp'])
+    return counts
+
+
+def apply(conn, counts):
+    """Прибавляет Counts к таблицам счетчиков"""
+    if not counts:
+        return
+    conn.execute(_ADD_TOTALS, [{'chat_id': chat_id, 'n': n} for chat_id, n in counts.totals.items()])
+    conn.execute(_ADD_DOMAINS, [
+        {'chat_id': chat_id, 'domain': domain, 'n': n}
+        for (chat_id, domain), n in counts.domains.items()
+    ])
+    conn.execute(_ADD_USERS, [
+        {'chat_id': chat_id, 'user_id': user_id, 'username': counts.usernames.get((chat_id, user_id)), 'n': n}
+        for (chat_id, user_id), n in counts.users.items()
+    ])
+    conn.execute(_ADD_DAYS, [
+        {'chat_id': chat_id, 'day': day, 'n': n}
+        for (chat_id, day), n in counts.days.items()
+    ])
+
+
+def count_table(conn, table):
+    """Counts по всей таблице ссылок (links или archived_links) через GROUP BY"""
+    counts = Counts()
+    for chat_id, domain, n in conn.execute(text(
+        f"SELECT chat_id, domain, COUNT(*) FROM {table} GROUP BY chat_id, domain"
+    )):
+        counts.totals[chat_id] += n
+        counts.domains[(chat_id, domain or '')] += n
+    for chat_id, user_id, n in conn.execute(text(
+        f"SELECT chat_id, user_id, COUNT(*) FROM {table} GROUP BY chat_id, user_id"
+    )):
+        counts.users[(chat_id, user_id or '')] += n
+    # Имя из последней сохраненной ссылки автора (наибольший id), как при записи:
+    # apply берет имя последней строки пачки и не затирает его пустым
+    for chat_id, user_id, username in conn.execute(text(f"""
+        SELECT chat_id, user_id, username FROM (
+            SELECT chat_id, user_id, username,
+                   ROW_NUMBER() OVER (PARTITION BY chat_id, user_id ORDER BY id DESC) AS n
+            FROM {table} WHERE username IS NOT NULL AND username != ''
+        ) AS latest WHERE n = 1
+    """)):
+        counts.usernames[(chat_id, user_id or '')] = username
+    for chat_id, day, n in conn.execute(text(
+        f"SELECT chat_id, date(timestamp) AS day, COUNT(*) AS n FROM {table} GROUP BY chat_id, date(timestamp)"
+    ).columns(day=Date, n=Integer)):
+        if day is not None:
+            counts.days[(chat_id, day)] += n
+    return counts
+
+
+def rebuild(conn, extra=None):
+    """Пересчитывает счетчики по таблице links.
+
+    extra - функция, которая возвращает Counts архива (или None). Она
+    вызывается уже под блокировкой записи основной БД - перенос в архив
+    (database.move_links_before) не может пройти между подсчетом двух частей.
+    """
+    # Сначала DELETE: транзакция сразу берет блокировку записи, и ссылки,
+    # сохраненные ботом во время пересчета, не потеряются и не задвоятся
+    for table in ('chat_total_stats', 'chat_domain_stats', 'chat_user_stats', 'chat_day_stats'):
+        conn.execute(text(f"DELETE FROM {table}"))
+    counts = Counts()
+    archived = extra() if extra else None
+    if archived:
+        counts.update(archived)
+    # Имена авторов из основной БД новее архивных
+    counts.update(count_table(conn, 'links'))
+    apply(conn, counts)
+    return counts
@@ -0,0 +1,15 @@
+"""Shared pytest fixtures: tests use a temporary database, not DATABASE_URL from config.py"""
+
+import pytest
+
+# test_bot.py - отдельный скрипт проверки настроенного бота (python test_bot.py)
+collect_ignore = ['test_bot.py']
+
+
+@pytest.fixture(scope='session')
+def database(tmp_path_factory):
+    """Временная БД со всеми миграциями (одна на весь прогон)"""
+    import database as db
+    db.configure(f"sqlite:///{tmp_path_factory.mktemp('db') / 'links.db'}")
+    db.migrate()
+    return db
@@ -1,18 +1,37 @@
 # database.py - Работа с базой данных
 
-from datetime import datetime
-from urllib.parse import urlparse
+import asyncio
+import functools
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from sqlalchemy import (create_engine, Column, Integer, String, Date, DateTime, Text, Index, bindparam, delete, select,
+                        text, tuple_, union_all)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import declarative_base, sessionmaker
-from config import DATABASE_URL
+import chat_stats
+import config
+import metrics
+import migrations
+import preset_index
+from links import YOUTUBE_KINDS, link_kind, url_hash
 
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Индексы описаны здесь для справки, создаются они миграциями (migrations.py)
 class Link(Base):
     __tablename__ = 'links'
+    __table_args__ = (
+        Index('ix_links_chat_domain', 'chat_id', 'domain'),
+        Index('ux_links_chat_hash', 'chat_id', 'url_hash', unique=True),
+        # id ушедших в архив ссылок не выдаются снова (миграция 16)
+        {'sqlite_autoincrement': True},
+    )
     id = Column(Integer, primary_key=True)
     chat_id = Column(String)
     user_id = Column(String)
@@ -22,45 +41,146 @@ class Link(Base):
     title = Column(Text, nullable=True)  # ИЗМЕНЕНО: nullable=True для совместимости со старыми БД
     timestamp = Column(DateTime, default=datetime.now)
     message_text = Column(Text)
+    url_hash = Column(String, nullable=True)  # хэш канонической ссылки (links.url_hash)
+    repost_count = Column(Integer, nullable=False, default=1)
+    kind = Column(String, nullable=True)  # вид ссылки (links.link_kind)
+    video_id = Column(String, nullable=True)  # ID YouTube видео
 
 class Preset(Base):
     __tablename__ = 'presets'
+    __table_args__ = (
+        Index('ux_presets_chat_name', 'chat_id', 'preset_name', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     chat_id = Column(String)
     preset_name = Column(String)
     search_term = Column(String)
     created_at = Column(DateTime, default=datetime.now)
 
-# Инициализация БД
-engine = create_engine(DATABASE_URL)
-
-# Пытаемся создать таблицы, если их еще нет
-try:
-    Base.metadata.create_all(engine)
-    logger.info("Database initialized")
-    
-    # Миграция: добавляем колонку title если её еще нет
-    from sqlalchemy import inspect, text
-    inspector = inspect(engine)
-    
-    # Проверяем есть ли колонка title в таблице links
-    if 'links' in inspector.get_table_names():
-        columns = [col['name'] for col in inspector.get_columns('links')]
-        if 'title' not in columns:
-            logger.info("Adding title column to links table...")
-            try:
-                with engine.begin() as conn:
-                    conn.execute(text("ALTER TABLE links ADD COLUMN title TEXT"))
-                logger.info("Migration completed: title column added")
-            except Exception as migrate_err:
-                logger.warning(f"Could not add title column (may already exist): {migrate_err}")
-    
-except Exception as e:
-    print(f"Ошибка при инициализации БД: {e}")
-    logger.error(f"Database error: {e}")
-
-Session = sessionmaker(bind=engine)
-session = Session()
+class VideoMeta(Base):
+    __tablename__ = 'video_meta'
+    video_id = Column(String, primary_key=True)
+    title = Column(Text)
+    fetched_at = Column(DateTime, default=datetime.now)
+
+class BotState(Base):
+    """Служебные значения бота (ключ -> строка)"""
+    __tablename__ = 'bot_state'
+    key = Column(String, primary_key=True)
+    value = Column(Text)
+
+class PresetLink(Base):
+    """Ссылка, подходящая под пресет (заполняется при записи, см. preset_index)"""
+    __tablename__ = 'preset_links'
+    __table_args__ = (
+        Index('ix_preset_links_page', 'preset_id', 'timestamp', 'link_id'),
+    )
+    preset_id = Column(Integer, primary_key=True)
+    link_id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime)  # копия links.timestamp для keyset-пагинации
+
+class ChatSettings(Base):
+    """Настройки чата. retention_days: None - по умолчанию, 0 - хранить всё"""
+    __tablename__ = 'chat_settings'
+    chat_id = Column(String, primary_key=True)
+    retention_days = Column(Integer, nullable=True)
+
+class ChatTotalStat(Base):
+    """Счетчики /stats (ведет chat_stats): всего ссылок чата"""
+    __tablename__ = 'chat_total_stats'
+    chat_id = Column(String, primary_key=True)
+    link_count = Column(Integer, nullable=False, default=0)
+
+class ChatDomainStat(Base):
+    """Ссылок чата по домену"""
+    __tablename__ = 'chat_domain_stats'
+    chat_id = Column(String, primary_key=True)
+    domain = Column(String, primary_key=True)
+    link_count = Column(Integer, nullable=False, default=0)
+
+class ChatUserStat(Base):
+    """Ссылок чата от автора"""
+    __tablename__ = 'chat_user_stats'
+    chat_id = Column(String, primary_key=True)
+    user_id = Column(String, primary_key=True)
+    username = Column(String)
+    link_count = Column(Integer, nullable=False, default=0)
+
+class ChatDayStat(Base):
+    """Ссылок чата за день"""
+    __tablename__ = 'chat_day_stats'
+    chat_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    link_count = Column(Integer, nullable=False, default=0)
+
+# Страницы читаются от новых к старым (как создают миграции 4 и 11)
+Index('ix_links_chat_ts', Link.chat_id, Link.timestamp.desc(), Link.id.desc())
+Index('ix_links_chat_kind', Link.chat_id, Link.kind, Link.timestamp.desc(), Link.id.desc())
+
+# Топ доменов и авторов - по индексу в порядке запроса get_chat_stats
+Index('ix_chat_domain_stats_top', ChatDomainStat.chat_id, ChatDomainStat.link_count.desc(), ChatDomainStat.domain)
+Index('ix_chat_user_stats_top', ChatUserStat.chat_id, ChatUserStat.link_count.desc(), ChatUserStat.user_id)
+
+# Движок и фабрика сессий создаются при первом обращении: импорт модуля
+# ничего не открывает, схему меняет только явный migrate() (run.py migrate)
+_database_url = None
+_engine = None
+_session_factory = None
+_init_lock = threading.Lock()
+
+def configure(url):
+    """Задает адрес БД вместо config.DATABASE_URL (до первого обращения к БД)"""
+    global _database_url
+    if _engine is not None:
+        raise RuntimeError("database is already initialized")
+    _database_url = url
+
+def get_engine():
+    """Движок SQLAlchemy (создается один раз)"""
+    global _engine, _session_factory
+    if _engine is None:
+        with _init_lock:
+            if _engine is None:
+                engine = create_engine(_database_url or config.DATABASE_URL)
+                metrics.instrument_engine(engine)
+                # Сессия на каждый вызов: объекты остаются читаемыми после закрытия сессии
+                _session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+                _engine = engine
+    return _engine
+
+def Session():
+    """Новая сессия"""
+    if _session_factory is None:
+        get_engine()
+    return _session_factory()
+
+def migrate():
+    """Применяет недостающие миграции. Возвращает версию схемы"""
+    version = migrations.migrate(get_engine())
+    logger.info("Database initialized, schema version %s", version)
+    return version
+
+def check_schema():
+    """Дешевая проверка при запуске: (текущая версия схемы, нужная версия)"""
+    return migrations.applied_version(get_engine()), migrations.LATEST_VERSION
+
+def require_schema():
+    """Останавливает процесс, если схема БД старее кода (перед запуском бота или импортом)"""
+    current, latest = check_schema()
+    if current < latest:
+        raise SystemExit(
+            f"Схема БД устарела (версия {current}, нужна {latest}). "
+            "Выполните: python run.py migrate"
+        )
+
+# Пул потоков для запросов из асинхронных обработчиков
+DB_THREADS = getattr(config, 'DB_THREADS', 4)
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+
+async def run(func, *args, **kwargs):
+    """Выполняет функцию БД в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
 
 # Функции для работы с ссылками
 def get_domain(url):
@@ -70,56 +190,500 @@ def get_domain(url):
     except:
         return 'unknown'
 
+def link_row(chat_id, user_id, username, url, message_text, title=None, timestamp=None):
+    """Готовит строку таблицы links для пакетной вставки"""
+    kind, video_id = link_kind(url)
+    return {
+        'chat_id': str(chat_id),
+        'user_id': str(user_id),
+        'username': username,
+        'url': url,
+        'domain': get_domain(url),
+        'title': title,
+        'timestamp': timestamp or datetime.now(),
+        'message_text': message_text,
+        'url_hash': url_hash(url),
+        'repost_count': 1,
+        'kind': kind,
+        'video_id': video_id,
+    }
+
+def _upsert():
+    """INSERT ... ON CONFLICT для текущей СУБД"""
+    return postgresql.insert(Link) if get_engine().dialect.name == 'postgresql' else sqlite.insert(Link)
+
+def save_links(rows):
+    """Сохраняет пачку ссылок одним INSERT.
+
+    Повтор уже сохраненной в чате ссылки (по канонической форме) не создает
+    новую строку, а увеличивает repost_count. Возвращает id в порядке rows,
+    None - для повторов.
+    """
+    if not rows:
+        return []
+    # Одна ссылка дважды в пачке: PostgreSQL не дает ON CONFLICT DO UPDATE
+    # изменить строку дважды за команду. Пишется последняя из повторов с их
+    # числом в repost_count, остальным позициям достается None
+    groups = {}
+    for position, row in enumerate(rows):
+        groups.setdefault((row['chat_id'], row['url_hash']), []).append(position)
+    positions = [group[-1] for group in groups.values()]
+    if len(positions) < len(rows):
+        unique = [dict(rows[group[-1]], repost_count=len(group)) for group in groups.values()]
+    else:
+        unique = rows
+    stmt = _upsert()
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['chat_id', 'url_hash'],
+        set_={'repost_count': Link.repost_count + stmt.excluded.repost_count},
+    ).returning(Link.id, Link.repost_count, sort_by_parameter_order=True)
+    with Session() as session:
+        # Core-уровень: ORM бьет executemany на группы по набору заполненных
+        # колонок (title есть/нет) и склеивает RETURNING квадратично
+        conn = session.connection()
+        result = conn.execute(stmt, unique).all()
+        # Новая строка вернет ровно то число повторов, с которым вставлена
+        ids = [None] * len(rows)
+        new_rows = []
+        for position, row, (link_id, repost_count) in zip(positions, unique, result):
+            if repost_count == row['repost_count']:
+                ids[position] = link_id
+                new_rows.append((link_id, row))
+        preset_index.index_links(conn, [_index_key(link_id, row) for link_id, row in new_rows])
+        chat_stats.apply(conn, chat_stats.count_rows(row for _, row in new_rows))
+        session.commit()
+        return ids
+
+def _index_key(link_id, row):
+    return link_id, row['chat_id'], row['timestamp'], row['url'], row['title'], row['message_text']
+
 def save_link(chat_id, user_id, username, url, message_text, title=None):
-    """Сохраняет ссылку в БД"""
-    link = Link(
-        chat_id=str(chat_id),
-        user_id=str(user_id),
-        username=username,
-        url=url,
-        domain=get_domain(url),
-        title=title,
-        message_text=message_text
-    )
-    session.add(link)
-    session.commit()
+    """Сохраняет ссылку в БД. Возвращает id или None, если это повтор"""
+    return save_links([link_row(chat_id, user_id, username, url, message_text, title=title)])[0]
+
+def import_links(rows):
+    """Вставляет пачку ссылок из истории чата одной транзакцией.
+
+    Уже сохраненные в чате ссылки пропускаются (repost_count не меняется,
+    чтобы повторный импорт того же файла ничего не портил). Возвращает
+    число добавленных строк.
+    """
+    if not rows:
+        return 0
+    stmt = _upsert().on_conflict_do_nothing(index_elements=['chat_id', 'url_hash'])
+    stmt = stmt.returning(Link.id, Link.chat_id, Link.url_hash)
+    with Session() as session:
+        conn = session.connection()
+        inserted = conn.execute(stmt, rows).all()
+        # Вставлена первая из строк с одинаковым (chat_id, url_hash)
+        by_key = {}
+        for row in rows:
+            by_key.setdefault((row['chat_id'], row['url_hash']), row)
+        new_rows = [(link_id, by_key[(chat_id, link_hash)]) for link_id, chat_id, link_hash in inserted]
+        preset_index.index_links(conn, [_index_key(link_id, row) for link_id, row in new_rows])
+        chat_stats.apply(conn, chat_stats.count_rows(row for _, row in new_rows))
+        session.commit()
+        return len(inserted)
+
+def get_untitled_links(after_id=0, limit=500):
+    """Ссылки без названия с id > after_id, по возрастанию id: (id, url, video_id)"""
+    with Session() as session:
+        return session.query(Link.id, Link.url, Link.video_id).filter(
+            Link.id > after_id,
+            Link.title.is_(None)
+        ).order_by(Link.id).limit(limit).all()
+
+def get_state(key, default=None):
+    """Служебное значение из bot_state"""
+    with Session() as session:
+        state = session.get(BotState, key)
+        return state.value if state else default
+
+def set_state(key, value):
+    """Записывает служебное значение в bot_state"""
+    with Session() as session:
+        session.merge(BotState(key=key, value=str(value)))
+        session.commit()
+
+def get_retention(chat_id):
+    """Срок хранения чата в днях из chat_settings (None - не задан)"""
+    with Session() as session:
+        settings = session.get(ChatSettings, str(chat_id))
+        return settings.retention_days if settings else None
+
+def set_retention(chat_id, days):
+    """Задает срок хранения чата (None - вернуть значение по умолчанию)"""
+    with Session() as session:
+        session.merge(ChatSettings(chat_id=str(chat_id), retention_days=days))
+        session.commit()
 
-def get_all_links(chat_id, limit=50):
-    """Получает все ссылки для чата"""
-    return session.query(Link).filter_by(chat_id=str(chat_id)).order_by(Link.timestamp.desc()).limit(limit).all()
+def get_retention_settings():
+    """Все заданные сроки хранения: {chat_id: дни}"""
+    with Session() as session:
+        return dict(session.query(ChatSettings.chat_id, ChatSettings.retention_days).filter(
+            ChatSettings.retention_days.isnot(None)
+        ).all())
 
-def get_youtube_links(chat_id, limit=50):
-    """Получает YouTube ссылки для чата"""
-    return session.query(Link).filter(
-        Link.chat_id == str(chat_id),
-        (Link.domain.like('%youtube.com%') | Link.domain.like('%youtu.be%'))
-    ).order_by(Link.timestamp.desc()).limit(limit).all()
+def get_chat_ids():
+    """Все чаты, у которых есть ссылки"""
+    with Session() as session:
+        return [chat_id for (chat_id,) in session.query(Link.chat_id).distinct()]
+
+def move_links_before(chat_id, cutoff, limit, sink):
+    """Удаляет до limit самых старых ссылок чата с датой раньше cutoff, сначала
+    передав их sink (archive.archive_links). Возвращает число перенесенных.
+
+    Удаление идет первым и держит блокировку записи, пока sink пишет в архив:
+    пересчет счетчиков под той же блокировкой (rebuild_stats) видит пачку либо
+    до переноса, либо после. Если sink упал, ссылки остаются на месте.
+    """
+    oldest = select(Link.id).where(
+        Link.chat_id == str(chat_id), Link.timestamp < cutoff
+    ).order_by(Link.timestamp.asc(), Link.id.asc()).limit(limit)
+    with Session() as session:
+        links = session.scalars(
+            delete(Link).where(Link.id.in_(oldest)).returning(Link),
+            execution_options={'synchronize_session': False},
+        ).all()
+        if links:
+            sink(links)
+        session.commit()
+        return len(links)
+
+def reserve_link_ids(last_id):
+    """Новые ссылки получат id больше last_id (последнего id в архиве).
+
+    Нужно только SQLite: архив, заполненный до миграции 16, мог получить id
+    больше оставшихся в links. Последовательность PostgreSQL id не повторяет.
+    """
+    with Session() as session:
+        conn = session.connection()
+        if conn.dialect.name != 'sqlite' or not last_id:
+            return
+        # В sqlite_sequence нет строки, пока в таблицу ничего не вставляли
+        conn.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'links', 0 "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'links')"
+        ))
+        conn.execute(text(
+            "UPDATE sqlite_sequence SET seq = :last_id WHERE name = 'links' AND seq < :last_id"
+        ), {'last_id': last_id})
+        session.commit()
+
+# Страниц за шаг incremental_vacuum: каждый шаг - короткая транзакция записи,
+# между шагами бот успевает записать свои пачки
+VACUUM_STEP_PAGES = getattr(config, 'VACUUM_STEP_PAGES', 1000)
+VACUUM_STEP_PAUSE = getattr(config, 'VACUUM_STEP_PAUSE', 0.05)
+
+def incremental_vacuum(step_pages=VACUUM_STEP_PAGES):
+    """Возвращает ОС освободившееся место (только SQLite). Возвращает число страниц.
+
+    Нужен режим auto_vacuum=INCREMENTAL (миграция 13); без него ничего не делает.
+    """
+    engine = get_engine()
+    if engine.dialect.name != 'sqlite':
+        return 0
+    freed = 0
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logger.warning("[VACUUM] auto_vacuum is not INCREMENTAL, run: python run.py migrate")
+            return 0
+        while True:
+            pages = min(conn.exec_driver_sql("PRAGMA freelist_count").scalar(), step_pages)
+            if not pages:
+                return freed
+            # sqlite3 выполняет один шаг прагмы за execute, а каждый шаг
+            # освобождает одну страницу - поэтому pages вызовов в одной транзакции
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                for _ in range(pages):
+                    conn.exec_driver_sql("PRAGMA incremental_vacuum(1)")
+                conn.exec_driver_sql("COMMIT")
+            except Exception:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+            freed += pages
+            time.sleep(VACUUM_STEP_PAUSE)
+
+def update_link_titles(link_ids, title):
+    """Записывает название для списка ссылок"""
+    with Session() as session:
+        session.query(Link).filter(Link.id.in_(link_ids)).update(
+            {Link.title: title}, synchronize_session=False
+        )
+        # Название могло добавить совпадения с пресетами
+        links = session.query(
+            Link.id, Link.chat_id, Link.timestamp, Link.url, Link.title, Link.message_text
+        ).filter(Link.id.in_(link_ids)).all()
+        preset_index.index_links(session.connection(), links)
+        session.commit()
+
+def get_video_meta(video_id):
+    """Получает сохраненные метаданные видео"""
+    with Session() as session:
+        return session.get(VideoMeta, video_id)
+
+def save_video_meta(video_id, title):
+    """Сохраняет (или обновляет) метаданные видео"""
+    with Session() as session:
+        session.merge(VideoMeta(video_id=video_id, title=title, fetched_at=datetime.now()))
+        session.commit()
+
+def _keyset_query(query, cursor, backward):
+    """Условие и порядок keyset-пагинации (см. _keyset_page)"""
+    key = tuple_(Link.timestamp, Link.id)
+    if backward:
+        return query.filter(key > tuple_(*cursor)).order_by(Link.timestamp.asc(), Link.id.asc())
+    if cursor:
+        query = query.filter(key < tuple_(*cursor))
+    return query.order_by(Link.timestamp.desc(), Link.id.desc())
+
+def _keyset_page(query, cursor, backward, limit):
+    """Keyset-пагинация по (timestamp, id), от новых к старым.
+
+    cursor - (timestamp, id) крайней ссылки предыдущей страницы; backward=True
+    листает к более новым. Возвращает (ссылки по убыванию даты, есть_ли_еще).
+    """
+    return _page_result(_keyset_query(query, cursor, backward).limit(limit + 1).all(), backward, limit)
+
+def _page_result(links, backward, limit):
+    """Обрезает limit + 1 строк до страницы: (ссылки по убыванию даты, есть_ли_еще)"""
+    has_more = len(links) > limit
+    links = links[:limit]
+    if backward:
+        links.reverse()
+    return links, has_more
+
+def get_links_page(chat_id, cursor=None, backward=False, limit=50):
+    """Страница всех ссылок чата"""
+    with Session() as session:
+        query = session.query(Link).filter(Link.chat_id == str(chat_id))
+        return _keyset_page(query, cursor, backward, limit)
+
+# Запросы страниц YouTube по виду курсора: (есть курсор, назад) -> select
+_youtube_pages = {}
+
+def _youtube_page_statement(has_cursor, backward):
+    """Кандидаты - подзапрос на каждый вид из YOUTUBE_KINDS: с равенством по
+    kind индекс ix_links_chat_kind сразу отдает строки в нужном порядке (при
+    kind IN (...) SQLite берет ix_links_chat_ts и в чате с редкими YouTube
+    ссылками просматривает его почти целиком). Запрос собирается один раз:
+    построение такого select в SQLAlchemy дороже самого запроса.
+    """
+    statement = _youtube_pages.get((has_cursor, backward))
+    if statement is None:
+        cursor = (bindparam('cursor_ts', type_=DateTime), bindparam('cursor_id')) if has_cursor else None
+
+        def page(query):
+            return _keyset_query(query, cursor, backward).limit(bindparam('limit'))
+
+        candidates = [
+            select(page(select(Link.id).where(Link.chat_id == bindparam('chat_id'), Link.kind == kind)).subquery().c.id)
+            for kind in YOUTUBE_KINDS
+        ]
+        statement = page(select(Link).where(Link.id.in_(union_all(*candidates))))
+        _youtube_pages[(has_cursor, backward)] = statement
+    return statement
+
+def get_youtube_links_page(chat_id, cursor=None, backward=False, limit=50):
+    """Страница YouTube ссылок чата (по индексу ix_links_chat_kind)"""
+    params = {'chat_id': str(chat_id), 'limit': limit + 1}
+    if cursor:
+        params.update(cursor_ts=cursor[0], cursor_id=cursor[1])
+    with Session() as session:
+        links = session.scalars(_youtube_page_statement(bool(cursor), backward), params).all()
+        return _page_result(links, backward, limit)
+
+def get_preset_links_page(chat_id, preset_id, cursor=None, backward=False, limit=50):
+    """Страница пресета по preset_links. Возвращает (пресет, id ссылок, есть_ли_еще).
+
+    Ссылки могут быть и в основной БД, и в архиве - см. archive.resolve_links.
+    """
+    with Session() as session:
+        preset = session.get(Preset, preset_id)
+        if preset is None or preset.chat_id != str(chat_id):
+            return None, [], False
+        query = session.query(PresetLink.link_id).filter(PresetLink.preset_id == preset_id)
+        key = tuple_(PresetLink.timestamp, PresetLink.link_id)
+        if backward:
+            query = query.filter(key > tuple_(*cursor)).order_by(
+                PresetLink.timestamp.asc(), PresetLink.link_id.asc()
+            )
+        else:
+            if cursor:
+                query = query.filter(key < tuple_(*cursor))
+            query = query.order_by(PresetLink.timestamp.desc(), PresetLink.link_id.desc())
+        
+        link_ids = [link_id for (link_id,) in query.limit(limit + 1)]
+        has_more = len(link_ids) > limit
+        link_ids = link_ids[:limit]
+        if backward:
+            link_ids.reverse()
+        return preset, link_ids, has_more
+
+def add_preset_links(preset_id, links):
+    """Добавляет членство в пресете: links - пары (id ссылки, timestamp)"""
+    with Session() as session:
+        preset_index.add_memberships(session.connection(), [
+            {'preset_id': preset_id, 'link_id': link_id, 'timestamp': timestamp}
+            for link_id, timestamp in links
+        ])
+        session.commit()
+
+def get_links_by_ids(link_ids):
+    """Ссылки по id (словарь id -> Link)"""
+    with Session() as session:
+        return {link.id: link for link in session.query(Link).filter(Link.id.in_(link_ids))}
+
+def iter_chat_links(chat_id, batch_size=1000, chunk_size=20000):
+    """Все ссылки чата от старых к новым, без загрузки архива в память.
+
+    Строки читаются пачками по batch_size (yield_per). Каждые chunk_size строк
+    читаются в отдельной короткой транзакции (keyset по (timestamp, id)), чтобы
+    долгая выгрузка не держала блокировку чтения SQLite и не мешала записи.
+    """
+    cursor = None
+    while True:
+        with Session() as session:
+            query = session.query(Link).filter(Link.chat_id == str(chat_id))
+            if cursor:
+                query = query.filter(tuple_(Link.timestamp, Link.id) > tuple_(*cursor))
+            query = query.order_by(Link.timestamp.asc(), Link.id.asc()).limit(chunk_size)
+            count = 0
+            for link in query.yield_per(batch_size):
+                count += 1
+                cursor = (link.timestamp, link.id)
+                yield link
+        if count < chunk_size:
+            return
+
+def get_chat_stats(chat_id, top=10, days=14):
+    """Статистика чата из счетчиков chat_stats (без обхода links).
+
+    Возвращает словарь: total, domains и users - top пар (имя, ссылок),
+    days - пары (дата, ссылок) за последние days дней.
+    """
+    chat_id = str(chat_id)
+    since = datetime.now().date() - timedelta(days=days - 1)
+    with Session() as session:
+        total = session.get(ChatTotalStat, chat_id)
+        domains = session.query(ChatDomainStat.domain, ChatDomainStat.link_count).filter(
+            ChatDomainStat.chat_id == chat_id
+        ).order_by(ChatDomainStat.link_count.desc(), ChatDomainStat.domain).limit(top).all()
+        users = session.query(ChatUserStat.username, ChatUserStat.user_id, ChatUserStat.link_count).filter(
+            ChatUserStat.chat_id == chat_id
+        ).order_by(ChatUserStat.link_count.desc(), ChatUserStat.user_id).limit(top).all()
+        per_day = session.query(ChatDayStat.day, ChatDayStat.link_count).filter(
+            ChatDayStat.chat_id == chat_id, ChatDayStat.day >= since
+        ).order_by(ChatDayStat.day).all()
+    return {
+        'total': total.link_count if total else 0,
+        'domains': [tuple(row) for row in domains],
+        'users': [(username or user_id, count) for username, user_id, count in users],
+        'days': [tuple(row) for row in per_day],
+    }
+
+def rebuild_stats(extra=None):
+    """Пересчитывает счетчики /stats по links.
+
+    extra - функция, возвращающая chat_stats.Counts архива (archive.stats_counts);
+    она вызывается внутри транзакции пересчета, см. chat_stats.rebuild.
+    """
+    with Session() as session:
+        conn = session.connection()
+        if conn.dialect.name == 'postgresql':
+            # В SQLite блокировку записи берет первый DELETE пересчета
+            conn.execute(text("LOCK TABLE links IN EXCLUSIVE MODE"))
+        counts = chat_stats.rebuild(conn, extra)
+        session.commit()
+    return counts
 
 def create_preset(chat_id, preset_name, search_term):
-    """Создает пресет (фильтр)"""
+    """Создает пресет (фильтр) и сверяет его с уже сохраненными ссылками чата.
+
+    Пресет фиксируется первым: новые ссылки с этого момента сверяет запись,
+    а старые досверяются короткими транзакциями (preset_index.backfill).
+    Если досверка упала, пресет удаляется - наполовину заполненным он не остается.
+    """
     preset = Preset(
         chat_id=str(chat_id),
         preset_name=preset_name,
         search_term=search_term
     )
-    session.add(preset)
-    session.commit()
+    with Session() as session:
+        session.add(preset)
+        session.commit()
+    preset_index.invalidate(chat_id)
+    try:
+        preset_index.backfill(get_engine().begin, preset.id, preset.chat_id, search_term)
+    except BaseException:
+        with Session() as session:
+            session.execute(delete(PresetLink).where(PresetLink.preset_id == preset.id))
+            session.execute(delete(Preset).where(Preset.id == preset.id))
+            session.commit()
+        preset_index.invalidate(chat_id)
+        raise
+    return preset
 
 def get_presets(chat_id):
     """Получает все пресеты для чата"""
-    return session.query(Preset).filter_by(chat_id=str(chat_id)).order_by(Preset.created_at.desc()).all()
+    with Session() as session:
+        return session.query(Preset).filter_by(chat_id=str(chat_id)).order_by(Preset.created_at.desc()).all()
 
 def get_preset(chat_id, preset_name):
     """Получает конкретный пресет"""
-    return session.query(Preset).filter_by(chat_id=str(chat_id), preset_name=preset_name).first()
+    with Session() as session:
+        return session.query(Preset).filter_by(chat_id=str(chat_id), preset_name=preset_name).first()
 
 def preset_exists(chat_id, preset_name):
     """Проверяет, существует ли пресет"""
-    return session.query(Preset).filter_by(chat_id=str(chat_id), preset_name=preset_name).first() is not None
-
-def search_links_by_preset(chat_id, search_term, limit=50):
-    """Ищет ссылки по пресету"""
-    return session.query(Link).filter(
-        Link.chat_id == str(chat_id),
-        (Link.url.like(f'%{search_term}%') | Link.message_text.like(f'%{search_term}%'))
-    ).order_by(Link.timestamp.desc()).limit(limit).all()
+    with Session() as session:
+        return session.query(Preset).filter_by(chat_id=str(chat_id), preset_name=preset_name).first() is not None
+
+# Триграммный индекс не находит строки короче 3 символов
+FTS_MIN_TERM = 3
+# links_fts - один индекс на все чаты: MATCH перебирает совпадения всей БД.
+# Чат не больше SEARCH_SCAN_LINKS ссылок дешевле просмотреть по ix_links_chat_ts,
+# в большом чате по релевантности сортируются только SEARCH_CANDIDATES
+# самых новых совпадений
+SEARCH_SCAN_LINKS = getattr(config, 'SEARCH_SCAN_LINKS', 20000)
+SEARCH_CANDIDATES = getattr(config, 'SEARCH_CANDIDATES', 1000)
+
+_FTS_SEARCH = text("""
+    SELECT links.* FROM (
+        SELECT links_fts.rowid AS id, bm25(links_fts) AS rank FROM links_fts
+        JOIN links ON links.id = links_fts.rowid
+        WHERE links_fts MATCH :query AND links.chat_id = :chat_id
+        ORDER BY links_fts.rowid DESC
+        LIMIT :candidates
+    ) AS hits
+    JOIN links ON links.id = hits.id
+    ORDER BY hits.rank, links.timestamp DESC
+    LIMIT :limit
+""")
+
+def search_links(chat_id, search_term, limit=50):
+    """Ищет ссылки по URL, названию и тексту сообщения.
+
+    В большом чате - через FTS-индекс, по релевантности; в небольшом, для
+    коротких слов и не на SQLite - просмотром ссылок чата (LIKE), от новых.
+    """
+    chat_id = str(chat_id)
+    with Session() as session:
+        if get_engine().dialect.name == 'sqlite' and len(search_term) >= FTS_MIN_TERM:
+            total = session.get(ChatTotalStat, chat_id)
+            if total is not None and total.link_count > SEARCH_SCAN_LINKS:
+                return session.query(Link).from_statement(_FTS_SEARCH).params(
+                    query=_fts_query(search_term), chat_id=chat_id,
+                    candidates=SEARCH_CANDIDATES, limit=limit
+                ).all()
+
+        pattern = f'%{search_term}%'
+        return session.query(Link).filter(
+            Link.chat_id == chat_id,
+            Link.url.like(pattern) | Link.title.like(pattern) | Link.message_text.like(pattern)
+        ).order_by(Link.timestamp.desc(), Link.id.desc()).limit(limit).all()
+
+def _fts_query(search_term):
+    """Экранирует слово как фразу FTS5"""
+    return '"' + search_term.replace('"', '""') + '"'
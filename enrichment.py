@@ -0,0 +1,145 @@
+# enrichment.py - Фоновое получение названий для сохраненных ссылок
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+ENRICH_WORKERS = getattr(config, 'ENRICH_WORKERS', 4)
+ENRICH_QUEUE_SIZE = getattr(config, 'ENRICH_QUEUE_SIZE', 1000)
+ENRICH_TIMEOUT = getattr(config, 'ENRICH_TIMEOUT', 30)
+ENRICH_RETRIES = getattr(config, 'ENRICH_RETRIES', 2)
+ENRICH_BACKOFF = getattr(config, 'ENRICH_BACKOFF', 2.0)
+
+
+class TitleEnricher:
+    """Пул воркеров, который получает названия ссылок в фоне и записывает их в БД.
+
+    resolver - функция url -> title (или None): синхронная выполняется в пуле
+    потоков, async - прямо в event loop. Исключения из неё считаются временными
+    ошибками и приводят к повтору с экспоненциальной паузой. После записи
+    названия вызываются обработчики on_titled(link_ids, title).
+    """
+
+    def __init__(self, resolver, workers=ENRICH_WORKERS, queue_size=ENRICH_QUEUE_SIZE,
+                 timeout=ENRICH_TIMEOUT, retries=ENRICH_RETRIES, backoff=ENRICH_BACKOFF):
+        self.resolver = resolver
+        self._async = asyncio.iscoroutinefunction(resolver)
+        self.on_titled = []
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+        # url -> id ссылок, ожидающих это название (дедупликация запросов)
+        self._pending = {}
+        # url -> future, которые ждут окончания обработки (см. put)
+        self._done = {}
+
+    @property
+    def depth(self):
+        """Текущая длина очереди"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Запускает воркеры"""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if not self._async:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='enrich')
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("[ENRICH] Started %d workers", self.workers)
+
+    async def stop(self):
+        """Останавливает воркеры, необработанные задачи отбрасываются"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._pending:
+            logger.info("[ENRICH] Stopped, %d urls left without title", len(self._pending))
+        self._pending.clear()
+        for future in self._done.values():
+            future.cancel()
+        self._done.clear()
+
+    def submit(self, link_id, url):
+        """Ставит ссылку в очередь. Возвращает False, если очередь переполнена"""
+        if url in self._pending:
+            self._pending[url].append(link_id)
+            return True
+        if self._queue is None or self._queue.full():
+            logger.warning("[ENRICH] Queue full, skipping url=%.50s", url)
+            return False
+        self._pending[url] = [link_id]
+        self._queue.put_nowait(url)
+        return True
+
+    async def put(self, link_id, url):
+        """Как submit, но ждет места в очереди (для фоновых проходов по БД).
+
+        Возвращает future, который завершается, когда url обработан: название
+        записано или от него отказались после всех повторов.
+        """
+        future = self._done.get(url)
+        if future is None:
+            future = self._done[url] = asyncio.get_running_loop().create_future()
+        if url in self._pending:
+            self._pending[url].append(link_id)
+            return future
+        self._pending[url] = [link_id]
+        await self._queue.put(url)
+        return future
+
+    async def _worker(self):
+        while True:
+            url = await self._queue.get()
+            try:
+                title = await self._resolve(url)
+                link_ids = self._pending.pop(url, [])
+                if title and link_ids:
+                    await db.run(db.update_link_titles, link_ids, title)
+                    logger.debug("[ENRICH] links=%d title=%.30s", len(link_ids), title)
+                    for callback in self.on_titled:
+                        callback(link_ids, title)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._pending.pop(url, None)
+                logger.error("[ENRICH] Failed to store title: %s", e)
+            finally:
+                self._queue.task_done()
+                future = self._done.pop(url, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+    def _call(self, url):
+        if self._async:
+            return self.resolver(url)
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(self.resolver, url))
+
+    async def _resolve(self, url):
+        """Вызывает resolver с таймаутом и повторами"""
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.wait_for(self._call(url), self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.debug("[ENRICH] Giving up url=%.50s error=%r", url, e)
+                    return None
+                delay = self.backoff * (2 ** attempt)
+                logger.debug("[ENRICH] Retry %d in %ss url=%.50s error=%r", attempt + 1, delay, url, e)
+                await asyncio.sleep(delay)
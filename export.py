@@ -0,0 +1,87 @@
+# export.py - Выгрузка архива ссылок чата в файл (gzip JSONL или CSV)
+
+import asyncio
+import csv
+import gzip
+import heapq
+import json
+import logging
+import os
+import tempfile
+
+import archive
+import config
+import database as db
+from links import UNKNOWN_TIMESTAMP
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = getattr(config, 'EXPORT_BATCH_SIZE', 1000)
+# Одновременных выгрузок: каждая занимает поток БД на все время чтения
+EXPORT_CONCURRENCY = getattr(config, 'EXPORT_CONCURRENCY', 1)
+# Лимит Telegram на отправку файла ботом
+EXPORT_MAX_BYTES = getattr(config, 'EXPORT_MAX_BYTES', 50 * 1024 * 1024)
+
+FORMATS = ('jsonl', 'csv')
+FIELDS = ('id', 'timestamp', 'user_id', 'username', 'url', 'domain', 'title',
+          'message_text', 'repost_count')
+
+_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+# Размер файла проверяется каждые _SIZE_CHECK_EVERY записей
+_SIZE_CHECK_EVERY = 100
+
+
+class ExportTooLarge(Exception):
+    """Сжатый файл выгрузки превысил max_bytes (файл уже удален)"""
+
+
+def _record(link):
+    record = {field: getattr(link, field) for field in FIELDS}
+    known = link.timestamp and link.timestamp != UNKNOWN_TIMESTAMP
+    record['timestamp'] = link.timestamp.isoformat() if known else None
+    return record
+
+
+def write_export(chat_id, fmt='jsonl', batch_size=EXPORT_BATCH_SIZE, max_bytes=EXPORT_MAX_BYTES):
+    """Пишет все ссылки чата во временный .gz файл (блокирующий вызов).
+
+    Возвращает (путь, количество ссылок). Файл удаляет вызывающий. Как только
+    файл превышает max_bytes, запись прекращается с ExportTooLarge - большой
+    чат не заполняет диск ради файла, который все равно не отправить.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    fd, path = tempfile.mkstemp(prefix=f'links_{chat_id}_', suffix=f'.{fmt}.gz')
+    count = 0
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8', newline='') as out:
+            if fmt == 'csv':
+                writer = csv.DictWriter(out, fieldnames=FIELDS)
+                writer.writeheader()
+                write = writer.writerow
+            else:
+                write = lambda record: out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            links = heapq.merge(
+                archive.iter_chat_links(chat_id, batch_size), db.iter_chat_links(chat_id, batch_size),
+                key=lambda link: (link.timestamp, link.id)
+            )
+            for link in links:
+                write(_record(link))
+                count += 1
+                if count % _SIZE_CHECK_EVERY == 0 and raw.tell() > max_bytes:
+                    raise ExportTooLarge(f"export of chat {chat_id} exceeds {max_bytes} bytes")
+        # Остаток сжатого буфера дописывается при закрытии
+        if os.path.getsize(path) > max_bytes:
+            raise ExportTooLarge(f"export of chat {chat_id} exceeds {max_bytes} bytes")
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
+
+
+async def export_chat(chat_id, fmt='jsonl'):
+    """Выгрузка в пуле потоков БД; параллельных выгрузок не больше EXPORT_CONCURRENCY"""
+    async with _slots:
+        path, count = await db.run(write_export, chat_id, fmt)
+    logger.info("[EXPORT] chat_id=%s format=%s links=%d bytes=%d", chat_id, fmt, count, os.path.getsize(path))
+    return path, count
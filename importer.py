@@ -0,0 +1,189 @@
+# importer.py - Импорт истории чата из экспорта Telegram Desktop (result.json)
+#
+# Файл разбирается потоком: верхний уровень читается по ключам, а каждое
+# сообщение из "messages" декодируется отдельно, так что в памяти одновременно
+# только буфер чтения и текущая пачка строк.
+
+import json
+import logging
+import re
+import sys
+import time
+from datetime import datetime
+
+import config
+import database as db
+from links import extract_links, extract_youtube_title, is_youtube_url, unique_links
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = getattr(config, 'IMPORT_BATCH_SIZE', 10000)
+READ_CHUNK = 1 << 20
+
+_WS = re.compile(r'\s*')
+# Символы, которые в JSON могут идти сразу после значения
+_AFTER_VALUE = frozenset(' \t\r\n,:]}')
+_decoder = json.JSONDecoder()
+
+# Типы чатов экспорта, у которых в Bot API id вида -100<id>
+_CHANNEL_TYPES = {'private_supergroup', 'public_supergroup', 'private_channel', 'public_channel'}
+
+
+class _JsonStream:
+    """Чтение JSON-значений по одному из текстового файла"""
+
+    def __init__(self, file):
+        self.file = file
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.file.read(READ_CHUNK)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Следующий значимый символ ('' в конце файла)"""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r}, got {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        """Декодирует следующее значение целиком"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # Число на границе буфера может продолжаться в следующем куске
+                # ("1." + "5"), поэтому значение принимается, только если за ним
+                # уже виден разделитель
+                if self.eof or (end < len(self.buf) and self.buf[end] in _AFTER_VALUE):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+class ExportReader:
+    """Потоковый разбор result.json одного чата.
+
+    chat заполняется полями верхнего уровня (name, type, id), прочитанными
+    до списка сообщений - в экспортах Telegram Desktop они идут первыми.
+    """
+
+    def __init__(self, file):
+        self._stream = _JsonStream(file)
+        self.chat = {}
+
+    def messages(self):
+        stream = self._stream
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.value()
+            stream.expect(':')
+            if key == 'messages':
+                stream.expect('[')
+                while stream.peek() != ']':
+                    yield stream.value()
+                    if stream.peek() == ',':
+                        stream.pos += 1
+                stream.expect(']')
+            else:
+                self.chat[key] = stream.value()
+            if stream.peek() == ',':
+                stream.pos += 1
+
+
+def bot_chat_id(chat):
+    """chat_id в Bot API по полям экспорта (id и type)"""
+    chat_id = int(chat['id'])
+    if chat.get('type') in _CHANNEL_TYPES:
+        return int(f'-100{chat_id}')
+    if chat.get('type') == 'private_group':
+        return -chat_id
+    return chat_id
+
+
+def _plain_text(parts):
+    if isinstance(parts, str):
+        return parts
+    return ''.join(part if isinstance(part, str) else part.get('text', '') for part in parts)
+
+
+def message_rows(chat_id, message):
+    """Строки links для одного сообщения экспорта (та же логика, что у бота)"""
+    if message.get('type') != 'message':
+        return []
+    text = _plain_text(message.get('text', ''))
+    if not text:
+        return []
+
+    entities = message.get('text_entities')
+    if entities is None:
+        entities = [part for part in message.get('text', []) if isinstance(part, dict)]
+    urls = [
+        entity['href'] if entity.get('type') == 'text_link' else entity.get('text', '')
+        for entity in entities if entity.get('type') in ('link', 'text_link')
+    ]
+    links = unique_links(urls or extract_links(text))
+    if not links:
+        return []
+
+    from_id = str(message.get('from_id') or '')
+    user_id = from_id[4:] if from_id.startswith('user') else from_id
+    username = message.get('from') or user_id
+    timestamp = datetime.fromisoformat(message['date'])
+    text_title = extract_youtube_title(text) if any(map(is_youtube_url, links)) else None
+    return [
+        db.link_row(chat_id, user_id, username, link, text,
+                    title=text_title if is_youtube_url(link) else None, timestamp=timestamp)
+        for link in links
+    ]
+
+
+def import_export(path, chat_id=None, batch_size=IMPORT_BATCH_SIZE, progress=sys.stderr):
+    """Импортирует result.json. Возвращает словарь со счетчиками.
+
+    Названия ссылок здесь не запрашиваются: бот при запуске ставит ссылки
+    без названия в очереди TitleEnricher (bot.sweep_untitled_links).
+    """
+    counts = {'messages': 0, 'links': 0, 'inserted': 0}
+    started = time.perf_counter()
+    batch = []
+
+    def flush():
+        counts['inserted'] += db.import_links(batch)
+        counts['links'] += len(batch)
+        batch.clear()
+        if progress:
+            print(f"  {counts['messages']} messages, {counts['links']} links, "
+                  f"{counts['inserted']} new", file=progress)
+
+    with open(path, encoding='utf-8') as file:
+        reader = ExportReader(file)
+        for message in reader.messages():
+            if chat_id is None:
+                chat_id = bot_chat_id(reader.chat)
+            counts['messages'] += 1
+            batch.extend(message_rows(chat_id, message))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+    counts['chat_id'] = chat_id
+    counts['seconds'] = round(time.perf_counter() - started, 3)
+    logger.info("[IMPORT] chat_id=%s messages=%d links=%d inserted=%d seconds=%s",
+                chat_id, counts['messages'], counts['links'], counts['inserted'], counts['seconds'])
+    return counts
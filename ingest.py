@@ -0,0 +1,92 @@
+# ingest.py - Пакетная (write-behind) запись ссылок в БД
+
+import asyncio
+import logging
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = getattr(config, 'INGEST_BATCH_SIZE', 500)
+INGEST_FLUSH_INTERVAL = getattr(config, 'INGEST_FLUSH_INTERVAL', 1.0)
+INGEST_MAX_PENDING = getattr(config, 'INGEST_MAX_PENDING', 50000)
+
+
+class LinkBuffer:
+    """Собирает строки links из всех чатов и сбрасывает их в БД пачками.
+
+    Сброс происходит, когда набралось batch_size строк или прошло interval
+    секунд, и принудительно при остановке. После записи вызываются
+    обработчики on_saved(rows, ids) - например, постановка в очередь названий.
+    """
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, interval=INGEST_FLUSH_INTERVAL,
+                 max_pending=INGEST_MAX_PENDING):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.on_saved = []
+        self._rows = []
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def depth(self):
+        """Сколько строк ждет записи"""
+        return len(self._rows)
+
+    def add(self, row):
+        """Добавляет строку (см. database.link_row) в буфер"""
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._full.set()
+
+    async def start(self):
+        """Запускает периодический сброс"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает сброс и записывает все, что осталось"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные строки"""
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    ids = await db.run(db.save_links, batch)
+                except Exception as e:
+                    logger.error("[INGEST] Flush of %d rows failed: %s", len(batch), e)
+                    self._requeue(rows[start:])
+                    return
+                logger.debug("[INGEST] Flushed %d rows", len(batch))
+                for callback in self.on_saved:
+                    try:
+                        callback(batch, ids)
+                    except Exception as e:
+                        logger.error("[INGEST] on_saved callback failed: %s", e)
+
+    def _requeue(self, rows):
+        """Возвращает незаписанные строки в начало буфера (с ограничением размера)"""
+        self._rows[:0] = rows
+        overflow = len(self._rows) - self.max_pending
+        if overflow > 0:
+            del self._rows[:overflow]
+            logger.error("[INGEST] Buffer overflow, dropped %d oldest rows", overflow)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
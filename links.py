@@ -0,0 +1,192 @@
+# links.py - Разбор и нормализация ссылок (без зависимостей от telegram и БД)
+
+import hashlib
+import re
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Ссылка до пробела или символов, которые не бывают частью URL в тексте
+URL_RE = re.compile(r'https?://[^\s<>"\']+')
+
+# Знаки препинания, которые обычно стоят после ссылки, а не внутри нее
+_TRAILING = '.,;:!?…»"\''
+_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+# Параметры, которые не меняют содержимое страницы
+_TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'yclid', 'dclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'si', 'feature', 'ref_src', 'ref_url',
+}
+_TRACKING_PREFIXES = ('utm_',)
+
+# Дата ссылок, которые старые версии бота сохранили без даты (миграция 12):
+# такие ссылки считаются самыми старыми в чате и показываются как "N/A"
+UNKNOWN_TIMESTAMP = datetime(1970, 1, 1)
+
+_VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_VIDEO_PATH_PREFIXES = ('/shorts/', '/embed/', '/live/', '/v/')
+
+
+def _strip_trailing(url):
+    """Отрезает пунктуацию и непарные скобки в конце ссылки"""
+    while url:
+        last = url[-1]
+        if last in _TRAILING:
+            url = url[:-1]
+        elif last in _BRACKETS and url.count(last) > url.count(_BRACKETS[last]):
+            url = url[:-1]
+        else:
+            break
+    return url
+
+
+def extract_links(text):
+    """Извлекает ссылки из текста"""
+    if not text:
+        return []
+    return [url for url in (_strip_trailing(m) for m in URL_RE.findall(text)) if url]
+
+
+def unique_links(urls):
+    """Дополняет ссылки без схемы и убирает повторы по канонической форме"""
+    unique = {}
+    for url in urls:
+        if '://' not in url:
+            url = 'http://' + url
+        unique.setdefault(url_hash(url), url)
+    return list(unique.values())
+
+
+def is_youtube_url(url):
+    """Проверяет, ведет ли ссылка на YouTube"""
+    return 'youtube.com' in url or 'youtu.be' in url
+
+
+def extract_youtube_title(text):
+    """Пытается извлечь название видео из текста сообщения"""
+    lines = text.split('\n')
+    for i, line in enumerate(lines):
+        if 'youtube.com' in line or 'youtu.be' in line:
+            if i > 0 and not lines[i-1].startswith('http'):
+                title = lines[i-1].strip()
+                if title and len(title) > 0 and len(title) < 300:
+                    return title[:200]
+
+    text_without_urls = URL_RE.sub('', text).strip()
+    if text_without_urls and len(text_without_urls) < 300:
+        return text_without_urls[:200]
+
+    return None
+
+
+def _host(parsed):
+    host = (parsed.hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def _is_youtube_host(host):
+    return host == 'youtu.be' or host == 'youtube.com' or host.endswith('.youtube.com')
+
+
+def youtube_video_id(url):
+    """Возвращает ID видео для youtu.be/X, watch?v=X, shorts/X и т.п. или None"""
+    try:
+        parsed = urlsplit(url)
+        host = _host(parsed)
+    except ValueError:
+        return None
+
+    video_id = None
+    if host == 'youtu.be':
+        video_id = parsed.path.lstrip('/').split('/')[0]
+    elif _is_youtube_host(host):
+        if parsed.path == '/watch':
+            video_id = dict(parse_qsl(parsed.query)).get('v')
+        else:
+            for prefix in _VIDEO_PATH_PREFIXES:
+                if parsed.path.startswith(prefix):
+                    video_id = parsed.path[len(prefix):].split('/')[0]
+                    break
+
+    if video_id and _VIDEO_ID_RE.match(video_id):
+        return video_id
+    return None
+
+
+# Виды ссылок (links.kind). Ссылки на YouTube - видео, shorts, плейлист,
+# канал или любая другая страница YouTube
+YOUTUBE_KINDS = ('youtube', 'short', 'playlist', 'channel')
+
+_EXTENSION_KINDS = {
+    'image': ('jpg', 'jpeg', 'png', 'gif', 'webp', 'svg', 'bmp', 'avif', 'heic'),
+    'video': ('mp4', 'webm', 'mov', 'mkv', 'avi', 'm4v'),
+    'audio': ('mp3', 'ogg', 'oga', 'opus', 'm4a', 'flac', 'wav'),
+    'document': ('pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'odt', 'epub', 'djvu'),
+    'archive': ('zip', 'rar', '7z', 'tar', 'gz', 'tgz'),
+}
+_KIND_BY_EXTENSION = {ext: kind for kind, exts in _EXTENSION_KINDS.items() for ext in exts}
+_CHANNEL_PATH_PREFIXES = ('/@', '/c/', '/channel/', '/user/')
+
+
+def link_kind(url):
+    """Вид ссылки и ID YouTube видео: ('youtube', id), ('short', id),
+    ('playlist', None), ('image', None), ... Все прочее - ('article', None)
+    """
+    if '://' not in url:
+        url = 'http://' + url
+    try:
+        parsed = urlsplit(url)
+        host = _host(parsed)
+    except ValueError:
+        return 'article', None
+
+    if _is_youtube_host(host):
+        video_id = youtube_video_id(url)
+        if video_id:
+            return ('short' if parsed.path.startswith('/shorts/') else 'youtube'), video_id
+        if parsed.path == '/playlist':
+            return 'playlist', None
+        if parsed.path.startswith(_CHANNEL_PATH_PREFIXES):
+            return 'channel', None
+        return 'youtube', None
+    if host in ('t.me', 'telegram.me'):
+        return 'telegram', None
+
+    _, dot, extension = parsed.path.rpartition('.')
+    kind = _KIND_BY_EXTENSION.get(extension.lower()) if dot else None
+    return kind or 'article', None
+
+
+def canonicalize_url(url):
+    """Приводит ссылку к каноническому виду для поиска повторов.
+
+    Схема всегда https, хост в нижнем регистре и без www., без фрагмента,
+    трекинговых параметров и завершающего '/'. Любая ссылка на YouTube видео
+    превращается в https://youtube.com/watch?v=<id>.
+    """
+    if '://' not in url:
+        url = 'http://' + url
+    try:
+        parsed = urlsplit(url.strip())
+        host = _host(parsed)
+        port = parsed.port
+    except ValueError:
+        return url
+
+    video_id = youtube_video_id(url) if _is_youtube_host(host) else None
+    if video_id:
+        return f'https://youtube.com/watch?v={video_id}'
+
+    if port and port not in (80, 443):
+        host = f'{host}:{port}'
+    params = sorted(
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in _TRACKING_PARAMS and not key.startswith(_TRACKING_PREFIXES)
+    )
+    path = parsed.path.rstrip('/') if parsed.path != '/' else ''
+    return urlunsplit(('https', host, path, urlencode(params), ''))
+
+
+def url_hash(url):
+    """Короткий хэш канонической ссылки для уникального индекса"""
+    return hashlib.sha1(canonicalize_url(url).encode('utf-8')).hexdigest()[:16]
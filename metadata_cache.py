@@ -0,0 +1,103 @@
+# metadata_cache.py - Кэш названий YouTube видео (память + таблица video_meta)
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import config
+import database as db
+from links import youtube_video_id
+
+logger = logging.getLogger(__name__)
+
+META_CACHE_SIZE = getattr(config, 'META_CACHE_SIZE', 10000)
+META_CACHE_TTL = getattr(config, 'META_CACHE_TTL', 7 * 24 * 3600)
+
+
+class MetadataCache:
+    """LRU в памяти перед постоянной таблицей, с истечением по TTL.
+
+    Методы get/put обращаются к БД и должны вызываться из потока,
+    peek - только память, его можно вызывать прямо в обработчике.
+    """
+
+    def __init__(self, max_size=META_CACHE_SIZE, ttl=META_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()  # video_id -> (title, expires_at)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def peek(self, video_id):
+        """Ищет название только в памяти"""
+        if not video_id:
+            return None
+        with self._lock:
+            item = self._items.get(video_id)
+            if item is None:
+                return None
+            title, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[video_id]
+                return None
+            self._items.move_to_end(video_id)
+            self.memory_hits += 1
+            return title
+
+    def get(self, video_id):
+        """Ищет название в памяти, затем в БД"""
+        title = self.peek(video_id)
+        if title is not None:
+            return title
+
+        meta = db.get_video_meta(video_id)
+        if meta and meta.title and meta.fetched_at > datetime.now() - timedelta(seconds=self.ttl):
+            age = (datetime.now() - meta.fetched_at).total_seconds()
+            self._remember(video_id, meta.title, self.ttl - age)
+            with self._lock:
+                self.db_hits += 1
+            return meta.title
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, video_id, title):
+        """Сохраняет название в память и в БД"""
+        self._remember(video_id, title, self.ttl)
+        db.save_video_meta(video_id, title)
+
+    def cached(self, resolver):
+        """Оборачивает resolver(url) так, чтобы повторные видео не ходили в сеть"""
+        def resolve(url):
+            video_id = youtube_video_id(url)
+            if not video_id:
+                return resolver(url)
+            title = self.get(video_id)
+            if title is None:
+                title = resolver(url)
+                if title:
+                    self.put(video_id, title)
+            return title
+        return resolve
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+            }
+
+    def _remember(self, video_id, title, ttl):
+        with self._lock:
+            self._items[video_id] = (title, time.monotonic() + ttl)
+            self._items.move_to_end(video_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
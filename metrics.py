@@ -0,0 +1,243 @@
+# metrics.py - Метрики в формате Prometheus и HTTP-эндпоинт /metrics
+#
+# Без внешних зависимостей: счетчики, значения и гистограммы с метками,
+# плюс метрики, которые вычисляются при каждом запросе (длины очередей и т.п.).
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+import config
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', None)  # None - эндпоинт выключен
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def collect(self):
+        """Строки экспозиции без HELP/TYPE"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.collect())
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}' for key, value in items]
+
+
+class Gauge(_Metric):
+    """Текущее значение; fn() вызывается при каждом запросе /metrics.
+
+    fn может вернуть число или dict {значения меток (tuple): число}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, description, fn, labels=(), kind='gauge'):
+        super().__init__(name, description, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def collect(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f'{self.name}{_format_labels(self.label_names, key)} {v}' for key, v in value.items()]
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей"""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # key -> [счетчики по бакетам, сумма, количество]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._series.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names + ('le',), key + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names + ('le',), key + ('+Inf',))
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+# ===== МЕТРИКИ БОТА =====
+
+HANDLER_SECONDS = Histogram(
+    'archivist_handler_seconds', 'Handler latency', labels=('handler',)
+)
+HANDLER_ERRORS = Counter(
+    'archivist_handler_errors_total', 'Handler exceptions', labels=('handler',)
+)
+CALLBACK_SECONDS = Histogram(
+    'archivist_callback_seconds', 'Inline button latency by action', labels=('action',)
+)
+DB_QUERY_SECONDS = Histogram(
+    'archivist_db_query_seconds', 'SQL statement latency', labels=('statement',)
+)
+FETCH_SECONDS = Histogram(
+    'archivist_fetch_seconds', 'External metadata fetch latency', labels=('source', 'result')
+)
+
+
+def timed(handler_name):
+    """Декоратор: гистограмма длительности и счетчик ошибок асинхронного обработчика"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=handler_name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, handler=handler_name)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(engine):
+    """Замеряет каждый SQL-запрос через события SQLAlchemy.
+
+    Время начала хранится в контексте выполнения, а не в стеке соединения:
+    запрос с ошибкой не доходит до after_cursor_execute и не должен сбивать
+    замеры следующих запросов на том же соединении из пула.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_started', None)
+        if started is None:
+            return
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=verb)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.error("[METRICS] Failed to collect %s: %s", metric.name, e)
+    return '\n'.join(lines) + '\n'
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render().encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\n'
+            'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает HTTP-эндпоинт /metrics в текущем event loop"""
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("[METRICS] Serving on http://%s:%s/metrics", host, port)
+    return server
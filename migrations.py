@@ -0,0 +1,374 @@
+# migrations.py - Версионированные миграции схемы БД
+#
+# Каждая миграция выполняется один раз в своей транзакции, номер последней
+# примененной хранится в таблице schema_version. Новые миграции добавляются
+# в конец с очередным номером; уже выпущенные миграции не редактируются.
+#
+# Схема должна создаваться и на SQLite, и на PostgreSQL: таблицы и новые
+# колонки описываются типами SQLAlchemy (_create_table, _add_column), а не
+# DDL одной СУБД. Возможности только SQLite (FTS5, auto_vacuum) проверяют
+# conn.dialect.name.
+
+import contextlib
+import functools
+import logging
+from sqlalchemy import (Column, Date, DateTime, Integer, MetaData, String, Table, Text,
+                        bindparam, inspect, text)
+
+import chat_stats
+import preset_index
+from links import UNKNOWN_TIMESTAMP, link_kind, url_hash
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """Регистрирует функцию миграции"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+def _columns(conn, table):
+    return {col['name'] for col in inspect(conn).get_columns(table)}
+
+def _create_table(conn, name, *columns):
+    """CREATE TABLE с типами нужной СУБД (INTEGER PRIMARY KEY - автоинкремент)"""
+    Table(name, MetaData(), *columns).create(conn, checkfirst=True)
+
+def _add_column(conn, table, column):
+    """ALTER TABLE ... ADD COLUMN, если такой колонки еще нет"""
+    if column.name in _columns(conn, table):
+        return
+    ddl = f"ALTER TABLE {table} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    conn.execute(text(ddl))
+
+@migration(1, "base tables")
+def _base_tables(conn):
+    _create_table(
+        conn, 'links',
+        Column('id', Integer, primary_key=True),
+        Column('chat_id', String),
+        Column('user_id', String),
+        Column('username', String),
+        Column('url', Text),
+        Column('domain', String),
+        Column('timestamp', DateTime),
+        Column('message_text', Text),
+    )
+    _create_table(
+        conn, 'presets',
+        Column('id', Integer, primary_key=True),
+        Column('chat_id', String),
+        Column('preset_name', String),
+        Column('search_term', String),
+        Column('created_at', DateTime),
+    )
+
+@migration(2, "links.title column")
+def _links_title(conn):
+    _add_column(conn, 'links', Column('title', Text))
+
+@migration(3, "video_meta table")
+def _video_meta(conn):
+    _create_table(
+        conn, 'video_meta',
+        Column('video_id', String, primary_key=True),
+        Column('title', Text),
+        Column('fetched_at', DateTime),
+    )
+
+@migration(4, "indexes for chat queries")
+def _chat_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_links_chat_ts ON links (chat_id, timestamp DESC, id DESC)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_links_chat_domain ON links (chat_id, domain)"
+    ))
+    # Старые БД могли накопить дубли пресетов - оставляем самый ранний
+    conn.execute(text("""
+        DELETE FROM presets WHERE id NOT IN (
+            SELECT MIN(id) FROM presets GROUP BY chat_id, preset_name
+        )
+    """))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_presets_chat_name ON presets (chat_id, preset_name)"
+    ))
+
+@migration(5, "full-text index over links")
+def _links_fts(conn):
+    # FTS5 с триграммами есть только в SQLite; на других СУБД поиск идет через LIKE
+    if conn.dialect.name != 'sqlite':
+        return
+    conn.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS links_fts USING fts5(
+            url, title, message_text,
+            content='links', content_rowid='id', tokenize='trigram'
+        )
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS links_fts_ai AFTER INSERT ON links BEGIN
+            INSERT INTO links_fts (rowid, url, title, message_text)
+            VALUES (new.id, new.url, new.title, new.message_text);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS links_fts_ad AFTER DELETE ON links BEGIN
+            INSERT INTO links_fts (links_fts, rowid, url, title, message_text)
+            VALUES ('delete', old.id, old.url, old.title, old.message_text);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS links_fts_au AFTER UPDATE OF url, title, message_text ON links BEGIN
+            INSERT INTO links_fts (links_fts, rowid, url, title, message_text)
+            VALUES ('delete', old.id, old.url, old.title, old.message_text);
+            INSERT INTO links_fts (rowid, url, title, message_text)
+            VALUES (new.id, new.url, new.title, new.message_text);
+        END
+    """))
+    conn.execute(text("INSERT INTO links_fts (links_fts) VALUES ('rebuild')"))
+
+@migration(6, "canonical url hash and repost counter")
+def _links_url_hash(conn):
+    _add_column(conn, 'links', Column('url_hash', String))
+    _add_column(conn, 'links', Column('repost_count', Integer, nullable=False, server_default='1'))
+
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, url FROM links WHERE id > :last ORDER BY id LIMIT 5000"
+        ), {'last': last_id}).all()
+        if not rows:
+            break
+        conn.execute(
+            text("UPDATE links SET url_hash = :hash WHERE id = :id"),
+            [{'id': row.id, 'hash': url_hash(row.url or '')} for row in rows]
+        )
+        last_id = rows[-1].id
+
+    # Старые повторы не удаляем: у первой ссылки считаем повторы, у остальных
+    # хэш обнуляем, чтобы они не мешали уникальному индексу
+    conn.execute(text("""
+        UPDATE links SET repost_count = (
+            SELECT COUNT(*) FROM links AS d
+            WHERE d.chat_id = links.chat_id AND d.url_hash = links.url_hash
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM links GROUP BY chat_id, url_hash HAVING COUNT(*) > 1
+        )
+    """))
+    conn.execute(text("""
+        UPDATE links SET url_hash = NULL
+        WHERE id NOT IN (SELECT MIN(id) FROM links GROUP BY chat_id, url_hash)
+    """))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_links_chat_hash ON links (chat_id, url_hash)"
+    ))
+
+@migration(7, "bot_state table")
+def _bot_state(conn):
+    _create_table(
+        conn, 'bot_state',
+        Column('key', String, primary_key=True),
+        Column('value', Text),
+    )
+
+@migration(8, "chat_settings table")
+def _chat_settings(conn):
+    _create_table(
+        conn, 'chat_settings',
+        Column('chat_id', String, primary_key=True),
+        Column('retention_days', Integer),
+    )
+
+@migration(9, "preset_links membership")
+def _preset_links(conn):
+    _create_table(
+        conn, 'preset_links',
+        Column('preset_id', Integer, primary_key=True, autoincrement=False),
+        Column('link_id', Integer, primary_key=True, autoincrement=False),
+        Column('timestamp', DateTime),
+    )
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_preset_links_page "
+        "ON preset_links (preset_id, timestamp DESC, link_id DESC)"
+    ))
+    presets = conn.execute(text("SELECT id, chat_id, search_term FROM presets")).all()
+    # Вся миграция - одна транзакция: окна досверки идут в том же соединении
+    begin = functools.partial(contextlib.nullcontext, conn)
+    for preset_id, chat_id, search_term in presets:
+        preset_index.backfill(begin, preset_id, chat_id, search_term)
+
+@migration(10, "chat statistics counters")
+def _chat_stats(conn):
+    _create_table(
+        conn, 'chat_domain_stats',
+        Column('chat_id', String, primary_key=True),
+        Column('domain', String, primary_key=True),
+        Column('link_count', Integer, nullable=False, server_default='0'),
+    )
+    _create_table(
+        conn, 'chat_user_stats',
+        Column('chat_id', String, primary_key=True),
+        Column('user_id', String, primary_key=True),
+        Column('username', String),
+        Column('link_count', Integer, nullable=False, server_default='0'),
+    )
+    _create_table(
+        conn, 'chat_day_stats',
+        Column('chat_id', String, primary_key=True),
+        Column('day', Date, primary_key=True),
+        Column('link_count', Integer, nullable=False, server_default='0'),
+    )
+    # chat_stats.rebuild пишет и в таблицу миграции 14 - на новой БД она
+    # создается здесь (миграция 14 ее только дозаполнит)
+    _create_chat_totals(conn)
+    # Ссылки из архива добавит run.py rebuild-stats
+    chat_stats.rebuild(conn)
+
+@migration(11, "links.kind and links.video_id columns")
+def _links_kind(conn):
+    _add_column(conn, 'links', Column('kind', String))
+    _add_column(conn, 'links', Column('video_id', String))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_links_chat_kind ON links (chat_id, kind, timestamp DESC, id DESC)"
+    ))
+    # Старые строки заполняет миграция 15
+
+@migration(12, "timestamp for legacy links without one")
+def _links_timestamp(conn):
+    # Строки без даты ломали курсоры страниц и слияние с архивом (NULL не
+    # сравнивается с датой, а SQLite и PostgreSQL ставят его в разные концы
+    # сортировки). Им дается дата UNKNOWN_TIMESTAMP - они становятся самыми
+    # старыми в чате, а счетчик по дням учитывает их под этой датой.
+    conn.execute(text("""
+        INSERT INTO chat_day_stats (chat_id, day, link_count)
+        SELECT chat_id, :day, COUNT(*) FROM links WHERE timestamp IS NULL GROUP BY chat_id
+        ON CONFLICT (chat_id, day) DO UPDATE SET link_count = chat_day_stats.link_count + excluded.link_count
+    """).bindparams(bindparam('day', type_=Date)), {'day': UNKNOWN_TIMESTAMP.date()})
+    for table in ('links', 'preset_links'):
+        conn.execute(text(
+            f"UPDATE {table} SET timestamp = :ts WHERE timestamp IS NULL"
+        ).bindparams(bindparam('ts', type_=DateTime)), {'ts': UNKNOWN_TIMESTAMP})
+
+@migration(13, "incremental auto_vacuum (SQLite)")
+def _auto_vacuum(conn):
+    # Смена режима требует полного VACUUM: он переписывает весь файл и держит
+    # монопольную блокировку, поэтому выполняется здесь, при остановленном боте,
+    # а run.py retention только возвращает место короткими шагами.
+    # VACUUM не работает внутри транзакции - он должен идти до любых записей.
+    if conn.dialect.name != 'sqlite' or conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+        return
+    logger.info("[MIGRATE] VACUUM to enable incremental auto_vacuum, this can take a while")
+    conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.exec_driver_sql("VACUUM")
+
+def _create_chat_totals(conn):
+    _create_table(
+        conn, 'chat_total_stats',
+        Column('chat_id', String, primary_key=True),
+        Column('link_count', Integer, nullable=False, server_default='0'),
+    )
+
+@migration(14, "per-chat link totals and top-N indexes for /stats")
+def _chat_totals(conn):
+    _create_chat_totals(conn)
+    conn.execute(text("""
+        INSERT INTO chat_total_stats (chat_id, link_count)
+        SELECT chat_id, SUM(link_count) FROM chat_domain_stats GROUP BY chat_id
+        ON CONFLICT (chat_id) DO NOTHING
+    """))
+    # Топ доменов и авторов читается по индексу, а не сортировкой всех строк чата
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_domain_stats_top "
+        "ON chat_domain_stats (chat_id, link_count DESC, domain)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_user_stats_top "
+        "ON chat_user_stats (chat_id, link_count DESC, user_id)"
+    ))
+
+@migration(15, "kind and video_id for links saved before migration 11")
+def _links_kind_backfill(conn):
+    # Пока kind пустой, /youtube и выборки по виду эти ссылки не видят, поэтому
+    # заполнение - часть миграции: бот не запустится, пока она не пройдет
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, url FROM links WHERE id > :last AND kind IS NULL ORDER BY id LIMIT 5000"
+        ), {'last': last_id}).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            kind, video_id = link_kind(row.url or '')
+            updates.append({'id': row.id, 'kind': kind, 'video_id': video_id})
+        conn.execute(text("UPDATE links SET kind = :kind, video_id = :video_id WHERE id = :id"), updates)
+        last_id = rows[-1].id
+
+@migration(16, "links ids are never reused (SQLite AUTOINCREMENT)")
+def _links_autoincrement(conn):
+    # Без AUTOINCREMENT SQLite выдает max(id)+1: если самые новые ссылки ушли
+    # в архив, их id достались бы новым ссылкам, и архив (INSERT OR IGNORE по
+    # id) и preset_links перепутали бы их. AUTOINCREMENT добавляется только
+    # пересозданием таблицы; id сохраняются, поэтому links_fts остается верным.
+    # На PostgreSQL последовательность SERIAL id не повторяет.
+    if conn.dialect.name != 'sqlite':
+        return
+    table_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'links'")).scalar()
+    if 'AUTOINCREMENT' in table_sql.upper():
+        return
+    # Индексы и триггеры удаляются вместе с таблицей - пересоздаются как были
+    dependents = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'links' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    )).scalars().all()
+    columns = inspect(conn).get_columns('links')
+    names = ', '.join(col['name'] for col in columns)
+    conn.execute(text("DROP TABLE IF EXISTS links_new"))
+    Table('links_new', MetaData(), *(
+        Column(col['name'], col['type'], primary_key=col['name'] == 'id', nullable=col['nullable'],
+               server_default=text(col['default']) if col['default'] is not None else None)
+        for col in columns
+    ), sqlite_autoincrement=True).create(conn)
+    conn.execute(text(f"INSERT INTO links_new ({names}) SELECT {names} FROM links"))
+    conn.execute(text("DROP TABLE links"))
+    conn.execute(text("ALTER TABLE links_new RENAME TO links"))
+    for sql in dependents:
+        conn.exec_driver_sql(sql)
+
+LATEST_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+def current_version(conn):
+    """Возвращает номер примененной версии схемы (0 для пустой БД)"""
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+def applied_version(engine):
+    """Версия схемы без изменений в БД (0 - схема еще не создана)"""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table('schema_version'):
+            return 0
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+def migrate(engine):
+    """Применяет все недостающие миграции"""
+    with engine.begin() as conn:
+        version = current_version(conn)
+
+    for number, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if number <= version:
+            continue
+        logger.info("[MIGRATE] %s: %s", number, description)
+        with engine.begin() as conn:
+            func(conn)
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {'v': number})
+        version = number
+
+    return version
@@ -0,0 +1,199 @@
+# outbox.py - Ограничение частоты исходящих запросов и склейка повторных перерисовок
+
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import config
+from chat_processor import released_slot
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+SEND_GLOBAL_RATE = getattr(config, 'SEND_GLOBAL_RATE', 30)
+SEND_CHAT_RATE = getattr(config, 'SEND_CHAT_RATE', 1)
+SEND_GROUP_RATE = getattr(config, 'SEND_GROUP_RATE', 20 / 60)
+SEND_CHAT_BURST = getattr(config, 'SEND_CHAT_BURST', 3)
+# Редактирование (листание страниц) под лимит новых сообщений группы не попадает
+SEND_EDIT_RATE = getattr(config, 'SEND_EDIT_RATE', 1)
+SEND_MAX_RETRIES = getattr(config, 'SEND_MAX_RETRIES', 3)
+
+# Новые сообщения в чате - под чатовый лимит; edit* - под свой, более мягкий
+_SEND_ENDPOINTS = frozenset({
+    'sendMessage', 'sendDocument', 'sendPhoto', 'sendVideo', 'sendAudio', 'sendVoice',
+    'sendAnimation', 'sendMediaGroup', 'sendSticker', 'forwardMessage', 'copyMessage',
+})
+
+# Одинаковые нажатия кнопки чаще, чем раз в REFRESH_WINDOW секунд, склеиваются
+REFRESH_WINDOW = getattr(config, 'REFRESH_WINDOW', 2.0)
+
+
+class _Bucket:
+    """Токен-бакет с резервированием: reserve() возвращает, сколько ждать"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst and now >= self.paused_until
+
+
+class SendRateLimiter(BaseRateLimiter):
+    """Общая очередь исходящих запросов бота (подключается через
+    ApplicationBuilder.rate_limiter).
+
+    Запросы с chat_id проходят через общий токен-бакет, новые сообщения - еще
+    и через чатовый (1/с в личке, group_rate в группе), редактирование - через
+    отдельный чатовый бакет edit_rate. Запросы ждут своей очереди. На 429
+    (RetryAfter) бакет ставится на паузу на retry_after секунд, и запрос
+    повторяется до max_retries раз.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 group_rate=SEND_GROUP_RATE, chat_burst=SEND_CHAT_BURST,
+                 edit_rate=SEND_EDIT_RATE, max_retries=SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.edit_rate = edit_rate
+        self.max_retries = max_retries
+        self._global = _Bucket(global_rate, global_rate)
+        self._chats = {}
+
+    @property
+    def waiting_chats(self):
+        """Количество чатов с непустой очередью или паузой"""
+        now = time.monotonic()
+        return len({chat_id for (chat_id, _), bucket in self._chats.items() if not bucket.idle(now)})
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        bucket = self._chat_bucket(chat_id, endpoint)
+        max_retries = rate_limit_args or self.max_retries
+        for attempt in range(max_retries + 1):
+            now = time.monotonic()
+            wait = max(self._global.reserve(now), bucket.reserve(now))
+            if wait > 0:
+                # Пока чат ждет, его слот обработчика достается другим чатам
+                async with released_slot():
+                    await asyncio.sleep(wait)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                if attempt == max_retries:
+                    logger.error("[OUTBOX] %s chat_id=%s: flood limit after %d retries", endpoint, chat_id, attempt)
+                    raise
+                logger.warning("[OUTBOX] %s chat_id=%s: retry after %ss", endpoint, chat_id, retry_after)
+                bucket.paused_until = time.monotonic() + retry_after + 0.1
+
+    def _chat_bucket(self, chat_id, endpoint):
+        """Бакет чата для вида запроса; прочие запросы (getChatMember и т.п.)
+        ограничиваются только общим бакетом"""
+        if endpoint in _SEND_ENDPOINTS:
+            kind = 'send'
+        elif endpoint.startswith('edit'):
+            kind = 'edit'
+        else:
+            kind = 'other'
+        bucket = self._chats.get((chat_id, kind))
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._prune()
+            rate, burst = self._global.rate, self._global.burst  # только для паузы на 429
+            if kind == 'send':
+                try:
+                    is_group = int(chat_id) < 0
+                except (TypeError, ValueError):
+                    is_group = True  # @username каналов и супергрупп
+                rate, burst = (self.group_rate if is_group else self.chat_rate), self.chat_burst
+            elif kind == 'edit':
+                rate, burst = self.edit_rate, self.chat_burst
+            bucket = self._chats[(chat_id, kind)] = _Bucket(rate, burst)
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+
+
+class RefreshCoalescer:
+    """Склеивает повторные одинаковые перерисовки (например, нажатия "Обновить").
+
+    По ключу выполняется не больше одной перерисовки за window секунд. Если за
+    это время пришли еще запросы, после окна выполняется ровно одна итоговая
+    перерисовка - остальные запросы в нее сливаются.
+
+    ordered(chat_id, coroutine) ставит отложенную перерисовку в очередь чата
+    (ChatOrderedUpdateProcessor.run_in_chat), чтобы она не шла параллельно с
+    обновлениями этого чата.
+    """
+
+    def __init__(self, window=REFRESH_WINDOW, ordered=None):
+        self.window = window
+        self.ordered = ordered
+        self.merged = 0
+        self._next_allowed = {}
+        self._scheduled = {}
+
+    async def request(self, key, render, chat_id=None):
+        """render - функция без аргументов, возвращающая корутину перерисовки"""
+        now = time.monotonic()
+        if key in self._scheduled:
+            self.merged += 1
+            return
+        next_allowed = self._next_allowed.get(key, 0.0)
+        if now >= next_allowed:
+            self._next_allowed[key] = now + self.window
+            await render()
+            return
+        self.merged += 1
+        self._scheduled[key] = asyncio.create_task(self._deferred(key, render, chat_id, next_allowed - now))
+
+    async def _deferred(self, key, render, chat_id, delay):
+        try:
+            await asyncio.sleep(delay)
+            self._next_allowed[key] = time.monotonic() + self.window
+            if self.ordered is not None and chat_id is not None:
+                await self.ordered(chat_id, render())
+            else:
+                await render()
+        except Exception as e:
+            logger.error("[REFRESH] Deferred render failed: %s", e)
+        finally:
+            del self._scheduled[key]
+            self._prune()
+
+    def _prune(self):
+        if len(self._next_allowed) > 1000:
+            now = time.monotonic()
+            for key in [k for k, t in self._next_allowed.items() if t < now]:
+                del self._next_allowed[key]
@@ -0,0 +1,185 @@
+# page_titles.py - Названия обычных страниц (og:title или <title>) для ссылок не с YouTube
+#
+# Все запросы идут через один httpx.AsyncClient с пулом keep-alive соединений,
+# к одному хосту - не больше PAGE_PER_HOST запросов одновременно. Ответ читается
+# только до </head> (не дальше PAGE_HEAD_BYTES), страница целиком не скачивается.
+
+import asyncio
+import codecs
+import ipaddress
+import logging
+import re
+import socket
+import time
+from contextlib import asynccontextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+import httpx
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PAGE_WORKERS = getattr(config, 'PAGE_WORKERS', 8)
+PAGE_TIMEOUT = getattr(config, 'PAGE_TIMEOUT', 10)
+PAGE_HEAD_BYTES = getattr(config, 'PAGE_HEAD_BYTES', 16 * 1024)
+PAGE_MAX_CONNECTIONS = getattr(config, 'PAGE_MAX_CONNECTIONS', 20)
+PAGE_PER_HOST = getattr(config, 'PAGE_PER_HOST', 2)
+PAGE_MAX_REDIRECTS = getattr(config, 'PAGE_MAX_REDIRECTS', 5)
+# Ссылки на адреса локальной сети не запрашиваются (их присылают пользователи)
+PAGE_ALLOW_PRIVATE = getattr(config, 'PAGE_ALLOW_PRIVATE', False)
+
+TITLE_LIMIT = 200
+USER_AGENT = 'Mozilla/5.0 (compatible; ArchivistBot/1.0)'
+
+_HEAD_END = re.compile(rb'</head\s*>|<body[\s>]', re.IGNORECASE)
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+_HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+
+class _HeadParser(HTMLParser):
+    """Достает og:title и <title> из начала документа"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.og_title = None
+        self.title = None
+        self._title_parts = None
+        self._done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self._done:
+            return
+        if tag == 'body':
+            self._done = True
+        elif tag == 'title' and self.title is None:
+            self._title_parts = []
+        elif tag == 'meta' and self.og_title is None:
+            attrs = dict(attrs)
+            if (attrs.get('property') or attrs.get('name') or '').lower() == 'og:title':
+                self.og_title = attrs.get('content') or None
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._title_parts is not None:
+            self.title = ''.join(self._title_parts)
+            self._title_parts = None
+        elif tag == 'head':
+            self._done = True
+
+
+def parse_title(head, charset=None):
+    """Название из начала HTML (bytes): og:title, иначе <title>"""
+    if not charset:
+        match = _META_CHARSET.search(head)
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    parser = _HeadParser()
+    parser.feed(head.decode(charset, errors='replace'))
+    title = ' '.join((parser.og_title or parser.title or '').split())
+    return title[:TITLE_LIMIT] or None
+
+
+async def _is_public(host):
+    """Все адреса хоста публичные (не локальная сеть и не loopback)"""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        return all(ipaddress.ip_address(info[4][0]).is_global for info in infos)
+    except (OSError, ValueError):
+        return False
+
+
+class PageTitleFetcher:
+    """Асинхронный resolver для TitleEnricher: url -> название страницы или None.
+
+    Сетевые ошибки и ответы 5xx пробрасываются (TitleEnricher повторит запрос),
+    4xx и не-HTML ответы дают None.
+    """
+
+    def __init__(self, timeout=PAGE_TIMEOUT, head_bytes=PAGE_HEAD_BYTES,
+                 max_connections=PAGE_MAX_CONNECTIONS, per_host=PAGE_PER_HOST,
+                 allow_private=PAGE_ALLOW_PRIVATE):
+        self.timeout = timeout
+        self.head_bytes = head_bytes
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.allow_private = allow_private
+        self._client = None
+        self._hosts = {}  # host -> [семафор, число ждущих и выполняющихся запросов]
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                headers={'User-Agent': USER_AGENT, 'Accept': 'text/html,application/xhtml+xml'},
+                follow_redirects=False,
+            )
+        return self._client
+
+    async def close(self):
+        """Закрывает соединения пула"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _host_slot(self, host):
+        slot = self._hosts.get(host)
+        if slot is None:
+            slot = self._hosts[host] = [asyncio.Semaphore(self.per_host), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._hosts[host]
+
+    async def fetch(self, url):
+        """Название страницы. Редиректы проходятся вручную, с проверкой каждого адреса"""
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            title = None
+            for _ in range(PAGE_MAX_REDIRECTS + 1):
+                host = urlsplit(url).hostname
+                if not host or (not self.allow_private and not await _is_public(host)):
+                    break
+                async with self._host_slot(host):
+                    async with self._get_client().stream('GET', url) as response:
+                        if response.is_redirect:
+                            url = str(response.url.join(response.headers['location']))
+                            continue
+                        title = await self._read_title(response)
+                        break
+            result = 'ok' if title else 'empty'
+        finally:
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - started, source='page', result=result)
+        if title:
+            logger.debug("[PAGE_FETCH] title=%.50s", title)
+        return title
+
+    async def _read_title(self, response):
+        if response.status_code >= 500:
+            response.raise_for_status()
+        content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        if response.status_code >= 400 or (content_type and content_type not in _HTML_TYPES):
+            return None
+        head = bytearray()
+        async for chunk in response.aiter_bytes():
+            start = max(0, len(head) - 16)
+            head += chunk
+            if len(head) >= self.head_bytes or _HEAD_END.search(head, start):
+                break
+        return parse_title(bytes(head[:self.head_bytes]), response.charset_encoding)
@@ -0,0 +1,178 @@
+# preset_index.py - Материализованное членство ссылок в пресетах (таблица preset_links)
+#
+# Новые ссылки сверяются со всеми пресетами своего чата один раз, при записи;
+# страница пресета после этого - один запрос по индексу preset_links.
+# Совпадение - подстрока без учета регистра в адресе, названии или тексте.
+
+import threading
+from collections import OrderedDict, deque
+
+from sqlalchemy import DateTime, Integer, bindparam, text
+
+import config
+
+# С этого числа пресетов в чате сверка идет автоматом Ахо-Корасик; при меньшем
+# числе быстрее проверить каждое слово через `in` (строковый поиск на C)
+AHO_CORASICK_MIN_TERMS = getattr(config, 'AHO_CORASICK_MIN_TERMS', 128)
+MATCHER_CACHE_CHATS = getattr(config, 'MATCHER_CACHE_CHATS', 5000)
+BACKFILL_CHUNK_SIZE = getattr(config, 'BACKFILL_CHUNK_SIZE', 5000)
+
+
+def link_text(url, title, message_text):
+    """Текст, по которому ищутся слова пресетов"""
+    return '\n'.join(part for part in (url, title, message_text) if part).casefold()
+
+
+class PresetMatcher:
+    """Находит все пресеты чата, слова которых встречаются в тексте.
+
+    terms - dict preset_id -> слово пресета.
+    """
+
+    def __init__(self, terms):
+        self.terms = [(preset_id, term.casefold()) for preset_id, term in terms.items() if term]
+        self._goto = None
+        if len(self.terms) >= AHO_CORASICK_MIN_TERMS:
+            self._build()
+
+    def _build(self):
+        goto, fail, out = [{}], [0], [set()]
+        for preset_id, term in self.terms:
+            node = 0
+            for char in term:
+                child = goto[node].get(char)
+                if child is None:
+                    child = goto[node][char] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    out.append(set())
+                node = child
+            out[node].add(preset_id)
+
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                out[child] |= out[fail[child]]
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def match(self, text):
+        """id пресетов, слова которых есть в тексте (text уже в casefold)"""
+        if self._goto is None:
+            return {preset_id for preset_id, term in self.terms if term in text}
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+_matchers = OrderedDict()  # chat_id -> (пресеты, PresetMatcher), LRU
+_lock = threading.Lock()
+
+
+def matcher_for(chat_id, terms):
+    """Автомат для пресетов чата; пересобирается, когда набор пресетов изменился"""
+    signature = tuple(sorted(terms.items()))
+    with _lock:
+        cached = _matchers.get(chat_id)
+        if cached and cached[0] == signature:
+            _matchers.move_to_end(chat_id)
+            return cached[1]
+    matcher = PresetMatcher(terms)
+    with _lock:
+        _matchers[chat_id] = (signature, matcher)
+        _matchers.move_to_end(chat_id)
+        while len(_matchers) > MATCHER_CACHE_CHATS:
+            _matchers.popitem(last=False)
+    return matcher
+
+
+def invalidate(chat_id):
+    """Сбрасывает автомат чата (после создания пресета)"""
+    with _lock:
+        _matchers.pop(str(chat_id), None)
+
+
+_CHAT_PRESETS = text(
+    "SELECT id, chat_id, search_term FROM presets WHERE chat_id IN :chat_ids"
+).bindparams(bindparam('chat_ids', expanding=True))
+
+_INSERT = text("""
+    INSERT INTO preset_links (preset_id, link_id, timestamp)
+    VALUES (:preset_id, :link_id, :timestamp)
+    ON CONFLICT DO NOTHING
+""").bindparams(bindparam('timestamp', type_=DateTime))
+
+
+def add_memberships(conn, memberships):
+    """Вставляет строки preset_links (уже существующие пропускаются)"""
+    if memberships:
+        conn.execute(_INSERT, memberships)
+    return len(memberships)
+
+
+def index_links(conn, links):
+    """Записывает членство ссылок в пресетах своих чатов.
+
+    links - последовательность (id, chat_id, timestamp, url, title, message_text).
+    Выполняется в транзакции записи самих ссылок. Возвращает число совпадений.
+    """
+    if not links:
+        return 0
+    terms = {}
+    for preset_id, chat_id, term in conn.execute(_CHAT_PRESETS, {'chat_ids': list({l[1] for l in links})}):
+        terms.setdefault(chat_id, {})[preset_id] = term
+    if not terms:
+        return 0
+
+    memberships = []
+    for link_id, chat_id, timestamp, url, title, message_text in links:
+        if chat_id not in terms:
+            continue
+        for preset_id in matcher_for(chat_id, terms[chat_id]).match(link_text(url, title, message_text)):
+            memberships.append({'preset_id': preset_id, 'link_id': link_id, 'timestamp': timestamp})
+    return add_memberships(conn, memberships)
+
+
+_CHAT_ID_RANGE = text("SELECT MIN(id), MAX(id) FROM links WHERE chat_id = :chat_id")
+_CHAT_LINKS = text("""
+    SELECT id, timestamp, url, title, message_text FROM links
+    WHERE id >= :low AND id < :high AND chat_id = :chat_id
+""").columns(id=Integer, timestamp=DateTime)
+
+
+def backfill(begin, preset_id, chat_id, term, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Однократно сверяет новый пресет со всеми ссылками чата. Возвращает число совпадений.
+
+    Пресет уже сохранен: ссылки, записанные после него, сверяет index_links.
+    Ссылки читаются окнами id по chunk_size, каждое окно - в своей транзакции
+    begin() (engine.begin), чтобы большой чат не держал блокировку записи
+    весь проход. Миграция передает begin, отдающий ее собственное соединение.
+    """
+    needle = term.casefold()
+    chat_id = str(chat_id)
+    with begin() as conn:
+        first_id, last_id = conn.execute(_CHAT_ID_RANGE, {'chat_id': chat_id}).one()
+    if first_id is None:
+        return 0
+    matched = 0
+    for low in range(first_id, last_id + 1, chunk_size):
+        with begin() as conn:
+            rows = conn.execute(_CHAT_LINKS, {'chat_id': chat_id, 'low': low, 'high': low + chunk_size})
+            matched += add_memberships(conn, [
+                {'preset_id': preset_id, 'link_id': row.id, 'timestamp': row.timestamp}
+                for row in rows if needle in link_text(row.url, row.title, row.message_text)
+            ])
+    return matched
@@ -0,0 +1,66 @@
+# preset_registry.py - Пресеты чатов в памяти, чтобы не ходить в БД на каждую команду
+
+import logging
+from collections import OrderedDict
+
+from sqlalchemy.exc import IntegrityError
+
+import archive
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+PRESET_CACHE_CHATS = getattr(config, 'PRESET_CACHE_CHATS', 5000)
+
+
+class PresetRegistry:
+    """Пресеты по чатам: загружаются при первом обращении, обновляются при
+    создании, чаты вытесняются по LRU.
+
+    Для каждого чата хранится dict preset_name -> Preset в порядке
+    "новые первыми", как в database.get_presets.
+    """
+
+    def __init__(self, max_chats=PRESET_CACHE_CHATS):
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    async def presets(self, chat_id):
+        """Все пресеты чата (dict имя -> Preset)"""
+        chat_id = str(chat_id)
+        presets = self._chats.get(chat_id)
+        if presets is None:
+            loaded = await db.run(db.get_presets, chat_id)
+            presets = {preset.preset_name: preset for preset in loaded}
+            self._store(chat_id, presets)
+        else:
+            self._chats.move_to_end(chat_id)
+        return presets
+
+    async def get(self, chat_id, preset_name):
+        """Пресет по имени или None"""
+        return (await self.presets(chat_id)).get(preset_name)
+
+    async def create(self, chat_id, preset_name, search_term):
+        """Создает пресет. Возвращает None, если такой уже есть"""
+        presets = await self.presets(chat_id)
+        if preset_name in presets:
+            return None
+        try:
+            preset = await db.run(db.create_preset, chat_id, preset_name, search_term)
+        except IntegrityError:
+            # Пресет успели создать параллельно - перечитаем чат при следующем обращении
+            self._chats.pop(str(chat_id), None)
+            return None
+        if archive.exists():
+            # Основную БД сверил create_preset, архив - отдельно
+            await db.run(archive.backfill_preset, preset)
+        self._store(str(chat_id), {preset_name: preset, **presets})
+        return preset
+
+    def _store(self, chat_id, presets):
+        self._chats[chat_id] = presets
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
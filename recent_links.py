@@ -0,0 +1,229 @@
+# recent_links.py - Последние ссылки чатов в памяти (первая страница /all_links и /youtube)
+#
+# Почти все запросы - первая страница "все" или "YouTube" и кнопка "Обновить".
+# Для них у чата хранится кольцо из последних limit ссылок каждого вида:
+# кольцо прогревается из БД при первом обращении, а дальше пополняется
+# записанными ссылками (LinkBuffer.on_saved) и названиями (TitleEnricher.on_titled).
+# Чаты вытесняются по LRU, когда суммарный размер превышает RECENT_MAX_BYTES.
+
+import logging
+import sys
+import time
+from collections import OrderedDict, deque
+
+import config
+import render
+from links import YOUTUBE_KINDS
+
+logger = logging.getLogger(__name__)
+
+RECENT_MAX_BYTES = getattr(config, 'RECENT_MAX_BYTES', 32 * 1024 * 1024)
+# Записи других процессов (run.py import, retention) бот не видит - кольцо чата
+# через RECENT_TTL секунд прогревается заново
+RECENT_TTL = getattr(config, 'RECENT_TTL', 600)
+
+
+def _key(link):
+    return link.timestamp, link.id
+
+
+class RecentLink:
+    """Компактная копия Link с полями, которые нужны для страницы.
+
+    Строки обрезаны до лимитов render: вид записи от этого не меняется.
+    """
+
+    __slots__ = ('id', 'chat_id', 'url', 'kind', 'title', 'username', 'timestamp',
+                 'message_text', 'refs', 'size')
+
+    def __init__(self, link_id, chat_id, url, kind, title, username, timestamp, message_text):
+        self.id = link_id
+        self.chat_id = chat_id
+        self.url = (url or '')[:render.URL_LIMIT + 1]
+        self.kind = kind
+        self.title = title[:render.TITLE_LIMIT + 1] if title else None
+        self.username = username
+        self.timestamp = timestamp
+        self.message_text = (message_text or '')[:render.PREVIEW_LIMIT + 1]
+        self.refs = 0  # в скольких кольцах чата лежит запись
+        self.size = self._measure()
+
+    @classmethod
+    def from_link(cls, link):
+        return cls(link.id, str(link.chat_id), link.url, link.kind, link.title,
+                   link.username, link.timestamp, link.message_text)
+
+    def _measure(self):
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(value) for value in (self.url, self.title, self.username, self.message_text)
+            if value is not None
+        )
+
+
+class _Ring:
+    """Последние ссылки одного вида, от новых к старым"""
+
+    __slots__ = ('entries', 'truncated')
+
+    def __init__(self, entries, truncated):
+        self.entries = deque(entries)
+        self.truncated = truncated  # в БД есть ссылки старше самой старой в кольце
+
+
+class _Chat:
+    __slots__ = ('rings', 'size', 'expires_at')
+
+    def __init__(self, ttl):
+        self.rings = {}
+        self.size = 0
+        self.expires_at = time.monotonic() + ttl
+
+
+class RecentLinks:
+    """Кэш первых страниц чатов.
+
+    loader(chat_id, view, limit) - async функция, которая возвращает первую
+    страницу из БД (и архива) как (ссылки, есть_ли_еще). Все методы вызываются
+    из event loop.
+    """
+
+    def __init__(self, loader, limit, max_bytes=RECENT_MAX_BYTES, ttl=RECENT_TTL):
+        self.loader = loader
+        self.limit = limit
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._chats = OrderedDict()  # chat_id -> _Chat, LRU
+        self._by_id = {}             # id -> RecentLink (для названий и повторов)
+        self._warming = {}           # chat_id -> были ли записи во время прогрева
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def chats(self):
+        return len(self._chats)
+
+    async def first_page(self, chat_id, view):
+        """Первая страница вида: (ссылки от новых к старым, есть_ли_еще)"""
+        chat_id = str(chat_id)
+        chat = self._chats.get(chat_id)
+        if chat is not None and chat.expires_at < time.monotonic():
+            self._drop(chat_id)
+            chat = None
+        ring = chat.rings.get(view) if chat else None
+        if ring is not None:
+            self._chats.move_to_end(chat_id)
+            self.hits += 1
+            return list(ring.entries), ring.truncated
+
+        self.misses += 1
+        if chat_id in self._warming:
+            # Чат уже прогревается другим запросом
+            return await self.loader(chat_id, view, self.limit)
+        self._warming[chat_id] = False
+        try:
+            links, has_more = await self.loader(chat_id, view, self.limit)
+        finally:
+            dirty = self._warming.pop(chat_id)
+        # Пока шел запрос, в чат могли записать ссылки: такой результат
+        # показываем, но не кэшируем - прогреемся при следующем обращении
+        if not dirty:
+            self._install(chat_id, view, links, has_more)
+        return links, has_more
+
+    def _install(self, chat_id, view, links, has_more):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.ttl)
+        self._chats.move_to_end(chat_id)
+        entries = []
+        for link in links[:self.limit]:
+            entry = self._by_id.get(link.id)
+            if entry is None:
+                entry = self._by_id[link.id] = RecentLink.from_link(link)
+            self._attach(chat, entry)
+            entries.append(entry)
+        chat.rings[view] = _Ring(entries, has_more or len(links) > self.limit)
+        self._evict()
+
+    def add_saved(self, rows, ids):
+        """Обработчик LinkBuffer.on_saved: новые ссылки в кольца своих чатов"""
+        for row, link_id in zip(rows, ids):
+            # link_id is None - повтор уже сохраненной ссылки
+            if link_id is None:
+                continue
+            chat_id = row['chat_id']
+            if chat_id in self._warming:
+                self._warming[chat_id] = True
+            chat = self._chats.get(chat_id)
+            if chat is None or link_id in self._by_id:
+                continue
+            entry = RecentLink(link_id, chat_id, row['url'], row['kind'], row['title'],
+                               row['username'], row['timestamp'], row['message_text'])
+            for view, ring in chat.rings.items():
+                # То же условие, что у database.get_youtube_links_page
+                if view == 'all' or entry.kind in YOUTUBE_KINDS:
+                    self._push(chat, ring, entry)
+            if entry.refs:
+                self._by_id[link_id] = entry
+        self._evict()
+
+    def _push(self, chat, ring, entry):
+        entries = ring.entries
+        position = 0
+        # Новые ссылки почти всегда новее всех в кольце; иначе ищем место по (дата, id)
+        while position < len(entries) and _key(entries[position]) > _key(entry):
+            position += 1
+        if position == len(entries) and ring.truncated:
+            return  # старше всего кольца, а перед ним в БД есть еще ссылки
+        entries.insert(position, entry)
+        self._attach(chat, entry)
+        if len(entries) > self.limit:
+            self._detach(chat, entries.pop())
+            ring.truncated = True
+
+    def set_title(self, link_ids, title):
+        """Обработчик TitleEnricher.on_titled: название у ссылок в кольцах"""
+        for link_id in link_ids:
+            entry = self._by_id.get(link_id)
+            if entry is None:
+                # Ссылка может быть в странице, которая сейчас прогревается
+                for chat_id in self._warming:
+                    self._warming[chat_id] = True
+                continue
+            chat = self._chats.get(entry.chat_id)
+            old_size = entry.size
+            entry.title = title[:render.TITLE_LIMIT + 1] if title else None
+            entry.size = entry._measure()
+            if chat is not None:
+                chat.size += entry.size - old_size
+                self.size += entry.size - old_size
+        self._evict()
+
+    def _attach(self, chat, entry):
+        if not entry.refs:
+            chat.size += entry.size
+            self.size += entry.size
+        entry.refs += 1
+
+    def _detach(self, chat, entry):
+        entry.refs -= 1
+        if not entry.refs:
+            chat.size -= entry.size
+            self.size -= entry.size
+            self._by_id.pop(entry.id, None)
+
+    def _drop(self, chat_id):
+        chat = self._chats.pop(chat_id)
+        for ring in chat.rings.values():
+            for entry in ring.entries:
+                entry.refs -= 1
+                if not entry.refs:
+                    self._by_id.pop(entry.id, None)
+        self.size -= chat.size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._chats:
+            chat_id = next(iter(self._chats))
+            self._drop(chat_id)
+            logger.debug("[RECENT] evicted chat_id=%s", chat_id)
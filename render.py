@@ -0,0 +1,84 @@
+# render.py - Форматирование списков ссылок в HTML-сообщения Telegram
+
+from html import escape
+
+from links import UNKNOWN_TIMESTAMP
+
+# Лимит Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+# Отдельные поля обрезаются, чтобы одна запись всегда помещалась в сообщение
+URL_LIMIT = 1000
+TITLE_LIMIT = 200
+PREVIEW_LIMIT = 50
+
+
+def _cut(text, limit):
+    return text[:limit] + "..." if len(text) > limit else text
+
+
+def render_link(index, link, show_title=False):
+    """Одна запись списка ссылок (HTML, пользовательский текст экранирован)"""
+    try:
+        known = link.timestamp and link.timestamp != UNKNOWN_TIMESTAMP
+        date = link.timestamp.strftime('%d.%m.%Y') if known else "N/A"
+    except Exception:
+        date = "N/A"
+
+    url = escape(_cut(link.url or "", URL_LIMIT), quote=False)
+    author = f"👤 {escape(link.username or 'Unknown', quote=False)} | 📅 {date}\n"
+
+    text = (link.message_text or "").strip()
+    if show_title and link.title:
+        # Ссылка с названием - жирное форматирование. Текст сообщения остается
+        # под названием (если это не одна только ссылка): это контекст от автора
+        title = escape(_cut(link.title, TITLE_LIMIT), quote=False)
+        entry = f"{index}. <b>{title}</b>\n🔗 <code>{url}</code>\n{author}"
+        if text == (link.url or "").strip():
+            text = ""
+    else:
+        entry = f"{index}. <code>{url}</code>\n{author}"
+    preview = _cut(text, PREVIEW_LIMIT)
+    if preview:
+        entry += f"💬 <i>{escape(preview, quote=False)}</i>\n"
+    return entry + "\n"
+
+
+def iter_link_entries(links, show_title=False):
+    """Генерирует записи по одной, не собирая весь ответ в строку"""
+    for index, link in enumerate(links, 1):
+        yield render_link(index, link, show_title)
+
+
+def pack_messages(header, entries, limit=MESSAGE_LIMIT):
+    """Раскладывает записи по сообщениям, разрывая только между записями.
+
+    header - уже экранированный HTML, идет в начало первого сообщения.
+    """
+    parts = [header] if header else []
+    size = len(header)
+    for entry in entries:
+        if parts and size + len(entry) > limit:
+            yield "".join(parts)
+            parts, size = [], 0
+        parts.append(entry)
+        size += len(entry)
+    if parts:
+        yield "".join(parts)
+
+
+def fit_page(header, links, show_title=False, limit=MESSAGE_LIMIT):
+    """Текст одной страницы: столько записей, сколько влезет в сообщение.
+
+    Возвращает (текст, количество показанных ссылок).
+    """
+    parts = [header]
+    size = len(header)
+    shown = 0
+    for entry in iter_link_entries(links, show_title):
+        if shown and size + len(entry) > limit:
+            break
+        parts.append(entry)
+        size += len(entry)
+        shown += 1
+    return "".join(parts), shown
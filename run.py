@@ -4,20 +4,77 @@
 Wrapper to run Archivist Bot
 """
 
+import argparse
 import sys
 import os
 
+parser = argparse.ArgumentParser(description="Archivist Bot")
+parser.add_argument('--webhook', action='store_true',
+                    help="receive updates via webhook instead of long polling")
+commands = parser.add_subparsers(dest='command', metavar='command')
+commands.add_parser('run', help="run the bot (default)")
+commands.add_parser('migrate', help="apply pending database migrations and exit")
+commands.add_parser('retention', help="move links past their retention period to the archive")
+commands.add_parser('rebuild-stats', help="recount /stats counters from links and the archive")
+import_parser = commands.add_parser('import', help="import links from a Telegram Desktop export")
+import_parser.add_argument('path', help="result.json from Telegram Desktop (Export chat history, JSON)")
+import_parser.add_argument('--chat-id', type=int,
+                           help="Bot API chat id (default: derived from the export)")
+args = parser.parse_args()
+
 # Fix encoding for Windows
 if sys.platform == 'win32':
     os.system('chcp 65001 > nul')
-    
+
+if args.command == 'migrate':
+    import logging
+    import database as db
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db.migrate()
+    import archive
+    archive.reserve_ids()
+    filled = archive.backfill_kinds()
+    if filled:
+        print(f"[KINDS] {filled} archived links classified")
+    sys.exit(0)
+
+if args.command == 'retention':
+    import logging
+    import archive
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    moved = archive.compact()
+    print(f"[RETENTION] {sum(moved.values())} links archived from {len(moved)} chats")
+    sys.exit(0)
+
+if args.command == 'rebuild-stats':
+    import logging
+    import archive
+    import database as db
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    counts = db.rebuild_stats(archive.stats_counts)
+    print(f"[STATS] {sum(counts.domains.values())} links counted "
+          f"in {len({chat_id for chat_id, _ in counts.domains})} chats")
+    sys.exit(0)
+
+if args.command == 'import':
+    import logging
+    import database as db
+    import importer
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db.require_schema()
+    counts = importer.import_export(args.path, chat_id=args.chat_id)
+    print(f"[IMPORT] {counts['inserted']} new links for chat {counts['chat_id']} "
+          f"({counts['messages']} messages, {counts['seconds']}s)")
+    print("[IMPORT] Titles will be fetched by the bot on its next start")
+    sys.exit(0)
+
 print("\n" + "="*60)
 print("[ARCHIVIST BOT] Starting...")
 print("="*60 + "\n")
 
 try:
     from bot import main
-    main()
+    main(webhook=True if args.webhook else None)
 except KeyboardInterrupt:
     print("\n\n[BOT] Bot stopped by user")
     sys.exit(0)
@@ -0,0 +1,40 @@
+# telegram_stub.py - Заглушка Bot API для тестов и бенчмарка (без сети)
+
+import json
+import time
+
+from telegram.request import BaseRequest
+
+
+class StubRequest(BaseRequest):
+    """Отвечает на вызовы Bot API без сети"""
+
+    def __init__(self):
+        self.calls = 0
+        self._message_id = 0
+
+    read_timeout = None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        self.calls += 1
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Archivist', 'username': 'bench_bot'}
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            result = {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id', 0), 'type': 'supergroup'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
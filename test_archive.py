@@ -0,0 +1,210 @@
+"""Tests for archive.py: moving old links to the archive and paging across both parts"""
+
+import asyncio
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+
+import archive
+import bot
+import migrations
+
+CHAT = 'archive'
+DAYS = 6
+LONG_TEXT = 'x' * (archive.ARCHIVE_TEXT_LIMIT + 500)
+
+
+def _text(i):
+    if i == 11:
+        return LONG_TEXT
+    return 'shared text' if i % 2 == 0 else f'text {i}'
+
+
+def _url(i):
+    return f'https://youtu.be/video{i:06d}' if i % 3 == 0 else f'https://example.com/a{i}'
+
+
+@pytest.fixture(scope='module')
+def chat(database):
+    """12 ссылок по одной в день; 6 старше срока хранения DAYS уходят в архив.
+
+    Возвращает id от новых к старым.
+    """
+    now = datetime.now()
+    ids = database.save_links([
+        database.link_row(CHAT, 'u1', 'anna', _url(i), _text(i), timestamp=now - timedelta(days=i + 0.5))
+        for i in range(12)
+    ])
+    database.set_retention(CHAT, DAYS)
+    assert archive.compact(default_days=None) == {CHAT: 6}
+    return ids
+
+
+def _load(chat_id, view, limit, cursor=None, backward=False):
+    return asyncio.run(bot.load_links_page(chat_id, view, limit, cursor, backward))
+
+
+def test_compact_moves_only_old_links(database, chat):
+    hot, _ = database.get_links_page(CHAT, limit=100)
+    cold, has_more = archive.get_page(CHAT, limit=100)
+    assert [link.id for link in hot] == chat[:6]
+    assert [link.id for link in cold] == chat[6:]
+    assert not has_more
+    # Повторный проход ничего не переносит
+    assert archive.compact(default_days=None) == {}
+
+
+def test_archived_links_keep_their_fields(chat):
+    cold, _ = archive.get_page(CHAT, limit=100)
+    for i, link in zip(range(6, 12), cold):
+        assert link.url == _url(i)
+        assert link.username == 'anna'
+        assert link.message_text == _text(i)[:archive.ARCHIVE_TEXT_LIMIT]
+        assert (link.kind == 'youtube') == (i % 3 == 0)
+
+
+def test_message_texts_are_stored_once_and_compressed(chat):
+    with archive.get_engine().connect() as conn:
+        rows = conn.execute(
+            select(archive.texts.c.id, archive.texts.c.body)
+            .where(archive.texts.c.id.in_(
+                select(archive.archived_links.c.text_id).where(archive.archived_links.c.chat_id == CHAT)
+            ))
+        ).all()
+        shared = conn.execute(
+            select(func.count(func.distinct(archive.archived_links.c.text_id)))
+            .where(archive.archived_links.c.chat_id == CHAT, archive.archived_links.c.id.in_(chat[6::2]))
+        ).scalar()
+    # 6, 8, 10 - один общий текст; 7, 9 - свои; 11 - длинный, обрезанный
+    assert shared == 1
+    assert len(rows) == 4
+    bodies = {zlib.decompress(body).decode('utf-8') for _, body in rows}
+    assert bodies == {'shared text', 'text 7', 'text 9', LONG_TEXT[:archive.ARCHIVE_TEXT_LIMIT]}
+    assert all(len(body) < 100 for _, body in rows)
+
+
+def test_move_keeps_links_when_archive_write_fails(database):
+    chat_id = 'archive-failing'
+    old = datetime.now() - timedelta(days=30)
+    ids = database.save_links([database.link_row(chat_id, 'u1', 'anna', 'https://example.com/f', 'f', timestamp=old)])
+
+    def sink(links):
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        database.move_links_before(chat_id, datetime.now(), 10, sink)
+    assert [link.id for link in database.get_links_page(chat_id)[0]] == ids
+
+
+def test_move_goes_oldest_first_in_batches(database):
+    chat_id = 'archive-batches'
+    now = datetime.now()
+    ids = database.save_links([
+        database.link_row(chat_id, 'u1', 'anna', f'https://example.com/b{i}', 'b', timestamp=now - timedelta(days=10 + i))
+        for i in range(5)
+    ])
+    batches = []
+    while database.move_links_before(chat_id, now, 2, lambda links: batches.append([link.id for link in links])):
+        pass
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    # Порядок внутри пачки (DELETE ... RETURNING) не задан, пачки - от старых к новым
+    assert [set(batch) for batch in batches] == [set(ids[4:2:-1]), set(ids[2:0:-1]), {ids[0]}]
+    assert database.get_links_page(chat_id) == ([], False)
+
+
+@pytest.mark.parametrize('limit', [1, 2, 4, 5, 6, 7, 12, 20])
+def test_paging_across_hot_and_archive(chat, limit):
+    links, has_more = _load(CHAT, 'all', limit)
+    pages = [[link.id for link in links]]
+    while has_more:
+        cursor = (links[-1].timestamp, links[-1].id)
+        links, has_more = _load(CHAT, 'all', limit, cursor)
+        pages.append([link.id for link in links])
+    assert [link_id for page in pages for link_id in page] == chat
+    assert all(len(page) == limit for page in pages[:-1])
+
+    # Обратно к новым от последней страницы
+    back = []
+    first = links[0]
+    cursor = (first.timestamp, first.id)
+    while True:
+        links, has_more = _load(CHAT, 'all', limit, cursor, backward=True)
+        if not links:
+            break
+        back.append([link.id for link in links])
+        cursor = (links[0].timestamp, links[0].id)
+        if not has_more:
+            break
+    assert [link_id for page in reversed(back) for link_id in page] + pages[-1] == chat
+
+
+def test_youtube_view_across_hot_and_archive(chat):
+    expected = chat[::3]  # i = 0, 3, 6, 9
+    seen, cursor, has_more = [], None, True
+    while has_more:
+        links, has_more = _load(CHAT, 'yt', 1, cursor)
+        seen += [link.id for link in links]
+        cursor = (links[-1].timestamp, links[-1].id)
+    assert seen == expected
+
+
+def test_merge_skips_links_present_in_both_parts(chat):
+    # Сбой между записью архива и удалением: первые ссылки архива есть и в основной БД
+    hot, hot_more = archive.get_page(CHAT, limit=2)
+    cold, cold_more = archive.get_page(CHAT, limit=3)
+    links, has_more = archive.merge_pages(hot, hot_more, cold, cold_more, False, 3)
+    assert [link.id for link in links] == chat[6:9]
+    assert has_more
+
+
+def test_archived_ids_are_not_reused(database):
+    chat_id = 'archive-ids'
+    old = datetime.now() - timedelta(days=30)
+    # Самая новая ссылка БД уходит в архив
+    [archived_id] = database.save_links([database.link_row(chat_id, 'u1', 'anna', 'https://example.com/i1', 'i',
+                                                           timestamp=old)])
+    assert archive.compact_chat(chat_id, 1) == 1
+    [new_id] = database.save_links([database.link_row(chat_id, 'u1', 'anna', 'https://example.com/i2', 'i',
+                                                      timestamp=old)])
+    assert new_id > archived_id
+    assert archive.compact_chat(chat_id, 1) == 1
+    assert [link.id for link in archive.get_page(chat_id)[0]] == [new_id, archived_id]
+
+
+def test_reserve_ids_moves_past_the_archive(database):
+    with archive.get_engine().connect() as conn:
+        last_archived = conn.execute(select(func.max(archive.archived_links.c.id))).scalar()
+    database.reserve_link_ids(last_archived + 100)
+    [link_id] = database.save_links([database.link_row('archive-reserve', 'u1', 'anna', 'https://example.com/r', 'r')])
+    assert link_id == last_archived + 101
+
+
+def test_autoincrement_migration_keeps_links_indexes_and_fts(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [m for m in migrations.MIGRATIONS if m[0] < 16])
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        for i in (1, 2, 3):
+            conn.execute(text(
+                "INSERT INTO links (id, chat_id, url, timestamp, repost_count) VALUES (:id, 'c', :url, '2024-01-01', 1)"
+            ), {'id': i, 'url': f'https://example.com/legacy{i}'})
+        dependents = conn.execute(text(
+            "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = 'links' AND sql IS NOT NULL AND type != 'table'"
+        )).all()
+    monkeypatch.undo()
+    assert migrations.migrate(engine) == migrations.LATEST_VERSION
+
+    with engine.begin() as conn:
+        assert 'AUTOINCREMENT' in conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'links'")).scalar()
+        assert conn.execute(text(
+            "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = 'links' AND sql IS NOT NULL AND type != 'table'"
+        )).all() == dependents
+        assert conn.execute(text("SELECT id, repost_count FROM links ORDER BY id")).all() == [(1, 1), (2, 1), (3, 1)]
+        # Самая новая ссылка удалена: ее id не выдается снова, триггеры FTS работают
+        conn.execute(text("DELETE FROM links WHERE id = 3"))
+        conn.execute(text("INSERT INTO links (chat_id, url) VALUES ('c', 'https://example.com/fresh')"))
+        assert conn.execute(text("SELECT MAX(id) FROM links")).scalar() == 4
+        assert conn.execute(text("SELECT rowid FROM links_fts WHERE links_fts MATCH 'fresh'")).scalars().all() == [4]
+        assert conn.execute(text("SELECT rowid FROM links_fts WHERE links_fts MATCH 'legacy3'")).all() == []
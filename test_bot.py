@@ -33,12 +33,20 @@ try:
     import database as db
     print(f"OK Database module imported")
     
-    # Try to query
-    links = db.session.query(db.Link).limit(1).all()
-    print(f"OK Database query - found {len(links)} links")
+    # Только проверка: схему меняет python run.py migrate, а не тест
+    current, latest = db.check_schema()
+    if current < latest:
+        print(f"ERROR Schema version {current}, bot needs {latest}: run python run.py migrate")
+        sys.exit(1)
+    print(f"OK Schema version {current}")
     
-    presets = db.session.query(db.Preset).limit(1).all()
-    print(f"OK Presets query - found {len(presets)} presets")
+    # Try to query
+    with db.Session() as session:
+        links = session.query(db.Link).limit(1).all()
+        print(f"OK Database query - found {len(links)} links")
+        
+        presets = session.query(db.Preset).limit(1).all()
+        print(f"OK Presets query - found {len(presets)} presets")
 except Exception as e:
     print(f"ERROR Database: {e}")
     traceback.print_exc()
@@ -59,7 +67,8 @@ except Exception as e:
 # Test 4: Bot functions
 print("\n[4/4] Testing bot functions...")
 try:
-    from bot import extract_links, extract_youtube_title, format_links_response
+    from bot import extract_links, extract_youtube_title
+    from render import iter_link_entries, pack_messages
     
     # Test link extraction
     test_text = "Check this: https://example.com and https://youtube.com/watch?v=abc"
@@ -72,7 +81,9 @@ try:
     print(f"OK extract_youtube_title: {title}")
     
     # Test format
-    print(f"OK format_links_response: function available")
+    link = db.Link(url="https://example.com/?a=<b>", username="<user>", message_text="x & y")
+    messages = list(pack_messages("Ссылки:\n\n", iter_link_entries([link] * 200)))
+    print(f"OK render: {len(messages)} messages, longest {max(map(len, messages))} chars")
     
 except Exception as e:
     print(f"ERROR Bot functions: {e}")
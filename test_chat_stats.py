@@ -0,0 +1,54 @@
+"""Tests for chat_stats.py: incremental /stats counters must equal a full rebuild"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import archive
+
+CHATS = ('stats-a', 'stats-b')
+TABLES = ('chat_total_stats', 'chat_domain_stats', 'chat_user_stats', 'chat_day_stats')
+
+
+def _snapshot(database):
+    with database.get_engine().connect() as conn:
+        return {
+            table: sorted(tuple(row) for row in conn.execute(
+                text(f"SELECT * FROM {table} WHERE chat_id IN ('stats-a', 'stats-b')")
+            ))
+            for table in TABLES
+        }
+
+
+def test_incremental_counters_equal_rebuild(database):
+    now = datetime.now()
+    row = database.link_row
+    # Автор сменил имя: последнее имя 'anna' меньше старого 'zed' по алфавиту
+    database.save_links([
+        row('stats-a', 'u1', 'zed', 'https://example.com/1', 'x', timestamp=now - timedelta(days=3)),
+        row('stats-a', 'u2', 'bob', 'https://other.org/1', 'x', timestamp=now - timedelta(days=39)),
+        row('stats-b', 'u1', 'zed', 'https://example.com/1', 'x', timestamp=now - timedelta(days=2)),
+    ])
+    database.save_links([
+        row('stats-a', 'u1', 'anna', 'https://example.com/2', 'x', timestamp=now - timedelta(days=1)),
+        row('stats-a', 'u2', None, 'https://other.org/2', 'x', timestamp=now),
+        # Повтор: растет repost_count, но не счетчики
+        row('stats-a', 'u1', 'anna', 'https://example.com/1', 'x', timestamp=now),
+    ])
+    # Импорт истории: старые даты, один повтор уже сохраненной ссылки
+    database.import_links([
+        row('stats-a', 'u3', 'carol', 'https://example.com/3', 'x', timestamp=now - timedelta(days=60)),
+        row('stats-a', 'u3', 'carol', 'https://example.com/2', 'x', timestamp=now - timedelta(days=60)),
+        row('stats-b', 'u4', None, 'https://other.org/9', 'x', timestamp=now - timedelta(days=50)),
+    ])
+    # Перенос в архив счетчики не меняет
+    assert archive.compact_chat('stats-a', 30) == 2
+
+    incremental = _snapshot(database)
+    users = {(chat_id, user_id): (username, n) for chat_id, user_id, username, n in incremental['chat_user_stats']}
+    assert users[('stats-a', 'u1')] == ('anna', 2)
+    assert users[('stats-a', 'u2')] == ('bob', 2)
+    assert [n for _, n in incremental['chat_total_stats']] == [5, 2]
+
+    database.rebuild_stats(archive.stats_counts)
+    assert _snapshot(database) == incremental
@@ -0,0 +1,167 @@
+"""Tests for enrichment.py: TitleEnricher with stub resolvers"""
+
+import asyncio
+import threading
+
+import pytest
+
+import database
+from enrichment import TitleEnricher
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Записи названий в БД: [(link_ids, title)]"""
+    stored = []
+    monkeypatch.setattr(database, 'update_link_titles', lambda link_ids, title: stored.append((link_ids, title)))
+    return stored
+
+
+def _run(enricher, scenario):
+    async def main():
+        await enricher.start()
+        try:
+            return await scenario()
+        finally:
+            await enricher.stop()
+
+    return asyncio.run(main())
+
+
+def test_same_url_in_flight_is_resolved_once(writes):
+    calls = []
+    release = None
+
+    async def resolver(url):
+        calls.append(url)
+        await release.wait()
+        return 'Title'
+
+    enricher = TitleEnricher(resolver, workers=2, backoff=0)
+    titled = []
+    enricher.on_titled.append(lambda link_ids, title: titled.append((link_ids, title)))
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        assert enricher.submit(1, 'https://a.example')
+        await asyncio.sleep(0.01)  # запрос уже выполняется
+        first = await enricher.put(2, 'https://a.example')
+        assert enricher.submit(3, 'https://a.example')
+        release.set()
+        await first
+
+    _run(enricher, scenario)
+    assert calls == ['https://a.example']
+    assert writes == [([1, 2, 3], 'Title')]
+    assert titled == writes
+
+
+def test_errors_are_retried_with_backoff(writes):
+    calls = []
+
+    def resolver(url):
+        calls.append(url)
+        if len(calls) < 3:
+            raise OSError('temporary')
+        return 'Third time'
+
+    enricher = TitleEnricher(resolver, workers=1, retries=2, backoff=0.01)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await (await enricher.put(1, 'https://b.example'))
+        # Паузы 0.01 и 0.02 между попытками
+        assert loop.time() - started >= 0.03
+
+    _run(enricher, scenario)
+    assert len(calls) == 3
+    assert writes == [([1], 'Third time')]
+
+
+def test_gives_up_after_retries(writes):
+    calls = []
+
+    def resolver(url):
+        calls.append(url)
+        raise OSError('down')
+
+    enricher = TitleEnricher(resolver, workers=1, retries=1, backoff=0)
+
+    async def scenario():
+        await (await enricher.put(1, 'https://c.example'))
+        # После отказа url можно поставить снова
+        assert enricher.submit(2, 'https://c.example')
+
+    _run(enricher, scenario)
+    assert len(calls) == 2
+    assert writes == []
+
+
+def test_slow_resolver_times_out(writes):
+    calls = []
+
+    async def resolver(url):
+        calls.append(url)
+        await asyncio.sleep(10)
+
+    enricher = TitleEnricher(resolver, workers=1, timeout=0.05, retries=1, backoff=0)
+
+    async def scenario():
+        await asyncio.wait_for(await enricher.put(1, 'https://d.example'), 1)
+
+    _run(enricher, scenario)
+    assert len(calls) == 2
+    assert writes == []
+
+
+def test_sync_resolver_runs_in_threads_and_async_in_loop(writes):
+    threads = {}
+
+    def sync_resolver(url):
+        threads['sync'] = threading.current_thread()
+        return 'sync'
+
+    async def async_resolver(url):
+        threads['async'] = threading.current_thread()
+        return 'async'
+
+    sync_enricher = TitleEnricher(sync_resolver, workers=1)
+    async_enricher = TitleEnricher(async_resolver, workers=1)
+
+    async def scenario():
+        await sync_enricher.start()
+        try:
+            await (await sync_enricher.put(1, 'https://e.example'))
+            await (await async_enricher.put(2, 'https://f.example'))
+        finally:
+            await sync_enricher.stop()
+
+    _run(async_enricher, scenario)
+    assert threads['sync'] is not threading.main_thread()
+    assert threads['sync'].name.startswith('enrich')
+    assert threads['async'] is threading.main_thread()
+    assert sorted(writes) == [([1], 'sync'), ([2], 'async')]
+
+
+def test_empty_title_is_not_written(writes):
+    enricher = TitleEnricher(lambda url: None, workers=1)
+
+    async def scenario():
+        await (await enricher.put(1, 'https://g.example'))
+
+    _run(enricher, scenario)
+    assert writes == []
+
+
+def test_full_queue_rejects_submit(writes):
+    enricher = TitleEnricher(lambda url: 't', workers=1, queue_size=1)
+    assert not enricher.submit(1, 'https://h.example')  # еще не запущен
+
+    async def scenario():
+        # Воркер не успевает забрать задачу до второго submit
+        assert enricher.submit(1, 'https://h.example')
+        assert not enricher.submit(2, 'https://i.example')
+
+    _run(enricher, scenario)
@@ -0,0 +1,57 @@
+"""Tests for export.py: write_export and the EXPORT_MAX_BYTES limit"""
+
+import glob
+import gzip
+import json
+import os
+import tempfile
+
+import pytest
+
+import export
+
+CHAT = 'export-big'
+
+
+@pytest.fixture(scope='module')
+def chat(database):
+    """300 ссылок с плохо сжимаемым текстом (~40 КБ в gzip)"""
+    database.save_links([
+        database.link_row(CHAT, 'u1', 'anna', f'https://example.com/e{i}', os.urandom(100).hex())
+        for i in range(300)
+    ])
+    return CHAT
+
+
+def _leftovers():
+    return glob.glob(os.path.join(tempfile.gettempdir(), f'links_{CHAT}_*'))
+
+
+def test_export_writes_all_links(chat):
+    path, count = export.write_export(chat)
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+    finally:
+        os.remove(path)
+    assert count == len(records) == 300
+    assert [r['url'] for r in records] == [f'https://example.com/e{i}' for i in range(300)]
+
+
+def test_export_stops_as_soon_as_limit_is_passed(chat, monkeypatch):
+    written = []
+    record = export._record
+    monkeypatch.setattr(export, '_record', lambda link: written.append(link.id) or record(link))
+    with pytest.raises(export.ExportTooLarge):
+        export.write_export(chat, max_bytes=2000)
+    # Запись прервана задолго до конца чата, временный файл удален
+    assert len(written) < 300
+    assert _leftovers() == []
+
+
+def test_limit_checked_after_final_flush(database):
+    # Меньше _SIZE_CHECK_EVERY записей: проверка в цикле не срабатывает
+    database.save_links([database.link_row(CHAT + '-small', 'u1', 'anna', 'https://example.com/s', 'x' * 10)])
+    with pytest.raises(export.ExportTooLarge):
+        export.write_export(CHAT + '-small', max_bytes=10)
+    assert glob.glob(os.path.join(tempfile.gettempdir(), f'links_{CHAT}-small_*')) == []
@@ -0,0 +1,88 @@
+"""Tests for importer.py: streaming result.json reader across read boundaries"""
+
+import io
+import json
+
+import pytest
+
+import importer
+
+EXPORT = {
+    'name': 'Тестовый чат "кавычки" \\ и ☃',
+    'type': 'private_supergroup',
+    'id': 1234567890,
+    'messages': [
+        {
+            'id': 1, 'type': 'message', 'date': '2024-03-01T12:00:00',
+            'from': 'Анна', 'from_id': 'user42',
+            'text': ['смотри ', {'type': 'link', 'text': 'https://example.com/a?x=1&y=2'}, ' 😀'],
+            'text_entities': [
+                {'type': 'plain', 'text': 'смотри '},
+                {'type': 'link', 'text': 'https://example.com/a?x=1&y=2'},
+                {'type': 'plain', 'text': ' 😀'},
+            ],
+        },
+        {'id': 2, 'type': 'service', 'date': '2024-03-01T12:01:00', 'action': 'pin_message', 'text': ''},
+        {
+            'id': 3, 'type': 'message', 'date': '2024-03-02T08:30:00', 'from': None, 'from_id': 'channel7',
+            'text': 'escapes \\" \\n é 😀', 'width': 1280, 'ratio': 1.5, 'exp': -2.5e-3,
+            'nested': {'list': [True, False, None, 0, -0.0, 12345678901234], 'empty': {}},
+        },
+        {'id': 4, 'type': 'message', 'date': '2024-03-03T00:00:00', 'text': 'https://youtu.be/dQw4w9WgXcQ'},
+    ],
+    'trailing': [1, 2.25, 'after messages'],
+}
+
+
+class _ChunkedFile:
+    """Файл, который отдает не больше size символов за read()"""
+
+    def __init__(self, text, size):
+        self._file = io.StringIO(text)
+        self.size = size
+
+    def read(self, n=-1):
+        return self._file.read(self.size)
+
+
+def _read(text, size):
+    reader = importer.ExportReader(_ChunkedFile(text, size))
+    messages = list(reader.messages())
+    return reader.chat, messages
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 1 << 20])
+@pytest.mark.parametrize('indent', [None, 1])
+def test_stream_matches_json_loads(size, indent):
+    text = json.dumps(EXPORT, ensure_ascii=False, indent=indent)
+    chat, messages = _read(text, size)
+    expected = json.loads(text)
+    assert messages == expected['messages']
+    assert chat == {key: value for key, value in expected.items() if key != 'messages'}
+
+
+def test_number_split_across_reads():
+    # Число на границе куска: "1." и "5" приходят разными read()
+    text = '{"id": 7, "f": 3.75, "messages": [{"ratio": 1.5, "exp": 2e10}], "x": 10, "e": -1e-5}'
+    for size in range(1, len(text) + 1):
+        chat, messages = _read(text, size)
+        assert messages == [{'ratio': 1.5, 'exp': 2e10}], size
+        assert chat == {'id': 7, 'f': 3.75, 'x': 10, 'e': -1e-5}, size
+
+
+def test_empty_messages_and_whitespace():
+    chat, messages = _read(' \n{ "id" : 1 ,\n "messages" : [ ] }\n', 1)
+    assert chat == {'id': 1}
+    assert messages == []
+
+
+def test_truncated_file_raises():
+    text = json.dumps(EXPORT)[:-40]
+    with pytest.raises(ValueError):
+        _read(text, 3)
+
+
+def test_bot_chat_id():
+    assert importer.bot_chat_id({'id': 1234567890, 'type': 'private_supergroup'}) == -1001234567890
+    assert importer.bot_chat_id({'id': 55, 'type': 'private_group'}) == -55
+    assert importer.bot_chat_id({'id': 42, 'type': 'personal_chat'}) == 42
@@ -0,0 +1,175 @@
+"""Tests for links.py: canonical URLs used for de-duplication"""
+
+import pytest
+
+from links import canonicalize_url, link_kind, unique_links, url_hash, youtube_video_id
+
+VIDEO = 'dQw4w9WgXcQ'
+
+# Группы ссылок, которые должны считаться одной и той же
+EQUIVALENT = [
+    [
+        'https://example.com/page',
+        'http://example.com/page',
+        'https://www.example.com/page',
+        'https://EXAMPLE.com/page/',
+        'https://example.com/page#section',
+        'https://example.com:443/page',
+        'example.com/page',
+        '  https://example.com/page  ',
+    ],
+    [
+        'https://example.com/a?x=1&y=2',
+        'https://example.com/a?y=2&x=1',
+        'https://example.com/a?x=1&utm_source=tg&y=2&fbclid=abc',
+        'https://example.com/a/?y=2&utm_campaign=z&x=1#top',
+    ],
+    [
+        'https://example.com',
+        'https://example.com/',
+        'http://www.example.com',
+    ],
+    [
+        f'https://www.youtube.com/watch?v={VIDEO}',
+        f'https://youtube.com/watch?v={VIDEO}&t=42s',
+        f'https://m.youtube.com/watch?feature=share&v={VIDEO}',
+        f'https://music.youtube.com/watch?v={VIDEO}&list=RD123',
+        f'https://youtu.be/{VIDEO}?si=tracking',
+        f'https://www.youtube.com/shorts/{VIDEO}',
+        f'https://www.youtube.com/embed/{VIDEO}',
+        f'https://www.youtube.com/live/{VIDEO}?feature=share',
+    ],
+]
+
+# Пары ссылок, которые нельзя склеивать
+DIFFERENT = [
+    ('https://example.com/a', 'https://example.com/b'),
+    ('https://example.com/Page', 'https://example.com/page'),
+    ('https://example.com/a?x=1', 'https://example.com/a?x=2'),
+    ('https://example.com/a?x=1', 'https://example.com/a'),
+    ('https://example.com/a', 'https://example.com:8080/a'),
+    ('https://example.com/a', 'https://example.org/a'),
+    ('https://sub.example.com/a', 'https://example.com/a'),
+    (f'https://youtube.com/watch?v={VIDEO}', 'https://youtube.com/watch?v=aaaaaaaaaaa'),
+    (f'https://youtube.com/watch?v={VIDEO}', f'https://notyoutube.com/watch?v={VIDEO}'),
+    ('https://youtube.com/playlist?list=A', 'https://youtube.com/playlist?list=B'),
+]
+
+
+@pytest.mark.parametrize('group', EQUIVALENT)
+def test_equivalent_urls_share_canonical_form(group):
+    canonical = {canonicalize_url(url) for url in group}
+    assert len(canonical) == 1, canonical
+    assert len({url_hash(url) for url in group}) == 1
+
+
+@pytest.mark.parametrize('first, second', DIFFERENT)
+def test_different_urls_stay_different(first, second):
+    assert canonicalize_url(first) != canonicalize_url(second)
+    assert url_hash(first) != url_hash(second)
+
+
+def test_canonical_form():
+    assert canonicalize_url('HTTP://WWW.Example.com/Path/?b=2&a=1#x') == 'https://example.com/Path?a=1&b=2'
+    assert canonicalize_url('https://example.com:8080/') == 'https://example.com:8080'
+    assert canonicalize_url(f'https://youtu.be/{VIDEO}') == f'https://youtube.com/watch?v={VIDEO}'
+    # Пустые значения параметров сохраняются
+    assert canonicalize_url('https://example.com/?flag=') == 'https://example.com?flag='
+
+
+def test_canonicalize_is_idempotent():
+    for group in EQUIVALENT:
+        for url in group:
+            canonical = canonicalize_url(url)
+            assert canonicalize_url(canonical) == canonical
+
+
+def test_malformed_urls_do_not_raise():
+    for url in ('http://[::1', 'https://example.com:99999/', 'http://'):
+        assert len(url_hash(url)) == 16
+
+
+def test_url_hash_is_short_hex():
+    value = url_hash('https://example.com')
+    assert len(value) == 16
+    int(value, 16)
+
+
+def test_unique_links_keeps_first_of_each_canonical_url():
+    urls = [
+        'example.com/a',
+        'https://www.example.com/a/',
+        f'https://youtu.be/{VIDEO}',
+        'https://example.com/b',
+        f'https://www.youtube.com/watch?v={VIDEO}',
+    ]
+    assert unique_links(urls) == ['http://example.com/a', f'https://youtu.be/{VIDEO}', 'https://example.com/b']
+
+
+def test_youtube_video_id():
+    assert youtube_video_id(f'https://youtu.be/{VIDEO}/') == VIDEO
+    assert youtube_video_id(f'https://www.youtube.com/watch?v={VIDEO}') == VIDEO
+    assert youtube_video_id('https://www.youtube.com/watch?v=short') is None
+    assert youtube_video_id('https://www.youtube.com/@channel') is None
+    assert youtube_video_id(f'https://youtube.com.evil.example/watch?v={VIDEO}') is None
+
+
+@pytest.mark.parametrize('url, expected', [
+    (f'https://youtu.be/{VIDEO}', ('youtube', VIDEO)),
+    (f'https://m.youtube.com/watch?v={VIDEO}', ('youtube', VIDEO)),
+    (f'https://www.youtube.com/shorts/{VIDEO}', ('short', VIDEO)),
+    ('https://www.youtube.com/playlist?list=PL123', ('playlist', None)),
+    ('https://www.youtube.com/@channel', ('channel', None)),
+    ('https://www.youtube.com/feed/trending', ('youtube', None)),
+    (f'https://youtube.com.evil.example/watch?v={VIDEO}', ('article', None)),
+    ('https://t.me/durov/1', ('telegram', None)),
+    ('https://example.com/cat.JPG', ('image', None)),
+    ('example.com/paper.pdf?dl=1', ('document', None)),
+    ('https://example.com/post', ('article', None)),
+    ('http://[::1', ('article', None)),
+])
+def test_link_kind(url, expected):
+    assert link_kind(url) == expected
+
+
+def test_migration_classifies_legacy_links(database):
+    """Строки, записанные до links.kind, видны в /youtube сразу после миграции"""
+    from sqlalchemy import text
+
+    import migrations
+
+    chat_id = 'kind-migration'
+    database.save_links([
+        database.link_row(chat_id, 'u1', 'anna', f'https://youtu.be/{VIDEO}', 'old video'),
+        database.link_row(chat_id, 'u1', 'anna', 'https://example.com/old', 'old article'),
+    ])
+    with database.get_engine().begin() as conn:
+        # Как у строк, записанных до миграции 11
+        conn.execute(text("UPDATE links SET kind = NULL, video_id = NULL WHERE chat_id = :chat"), {'chat': chat_id})
+        migrations._links_kind_backfill(conn)
+
+    links, _ = database.get_youtube_links_page(chat_id)
+    assert [(link.url, link.kind, link.video_id) for link in links] == [(f'https://youtu.be/{VIDEO}', 'youtube', VIDEO)]
+
+
+def test_duplicate_in_one_batch(database):
+    """Повтор внутри пачки пишется одной строкой (PostgreSQL не обновляет строку дважды за INSERT)"""
+    chat_id = 'batch-dup'
+    rows = [
+        database.link_row(chat_id, 'u1', 'anna', 'https://example.com/dup', 'first'),
+        database.link_row(chat_id, 'u1', 'anna', 'https://example.com/other', 'other'),
+        database.link_row(chat_id, 'u2', 'boris', 'https://www.example.com/dup/', 'second'),
+    ]
+    ids = database.save_links(rows)
+    assert ids[0] is None and ids[1] is not None and ids[2] is not None
+    links, _ = database.get_links_page(chat_id, limit=10)
+    by_id = {link.id: link for link in links}
+    assert len(links) == 2
+    assert (by_id[ids[2]].message_text, by_id[ids[2]].repost_count) == ('second', 2)
+    assert database.get_chat_stats(chat_id)['total'] == 2
+
+    # Повтор уже сохраненной ссылки в следующей пачке - тоже дважды
+    again = database.save_links([rows[0], rows[2]])
+    assert again == [None, None]
+    assert {link.id: link.repost_count for link in database.get_links_page(chat_id, limit=10)[0]}[ids[2]] == 4
+    assert database.get_chat_stats(chat_id)['total'] == 2
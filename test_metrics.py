@@ -0,0 +1,36 @@
+"""Tests for metrics.py: per-query timing survives failed statements"""
+
+import time
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import StaticPool
+
+import metrics
+
+
+def _observed(verb):
+    """(сумма, количество) замеров запросов вида verb"""
+    series = metrics.DB_QUERY_SECONDS._series.get(metrics.DB_QUERY_SECONDS._key({'statement': verb}))
+    return (series[1], series[2]) if series else (0.0, 0)
+
+
+def test_failed_statement_does_not_skew_later_timings():
+    # Одно соединение на весь тест - как соединение из пула
+    engine = create_engine('sqlite://', poolclass=StaticPool)
+    metrics.instrument_engine(engine)
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+        assert not conn.info.get('query_started')
+
+        total, count = _observed('SELECT')
+        time.sleep(0.05)
+        started = time.perf_counter()
+        conn.execute(text("SELECT 1")).all()
+        elapsed = time.perf_counter() - started
+    new_total, new_count = _observed('SELECT')
+    assert new_count == count + 1
+    # Замер относится к этому запросу, а не к началу одного из упавших
+    assert new_total - total <= elapsed
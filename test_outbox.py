@@ -0,0 +1,91 @@
+"""Outbound rate limiting must not hold update slots or break per-chat order"""
+
+import asyncio
+
+import pytest
+
+from chat_processor import ChatOrderedUpdateProcessor
+from outbox import RefreshCoalescer, SendRateLimiter
+
+
+def test_rate_limited_chat_releases_its_slot():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(concurrency=1)
+        # Группа: одно сообщение, дальше пауза в 1/rate секунд
+        limiter = SendRateLimiter(global_rate=1000, group_rate=1, chat_burst=1)
+        done = []
+
+        async def send():
+            return 'sent'
+
+        async def flooded():
+            for _ in range(2):
+                await limiter.process_request(send, (), {}, 'sendMessage', {'chat_id': -1}, None)
+            done.append('flooded')
+
+        async def quiet():
+            done.append('quiet')
+
+        flood = asyncio.create_task(processor.run_in_chat(-1, flooded()))
+        await asyncio.sleep(0.05)
+        # Единственный слот не должен быть занят ожиданием чата -1
+        await asyncio.wait_for(processor.run_in_chat(2, quiet()), 0.5)
+        assert done == ['quiet']
+        await flood
+        assert done == ['quiet', 'flooded']
+        assert processor._active._value == 1
+
+    asyncio.run(scenario())
+
+
+def test_deferred_refresh_waits_for_chat_updates():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor()
+        refresher = RefreshCoalescer(window=0.05, ordered=processor.run_in_chat)
+        events = []
+
+        async def render():
+            events.append('render')
+
+        async def slow_update():
+            events.append('update start')
+            await asyncio.sleep(0.2)
+            events.append('update end')
+
+        await refresher.request('key', render, 7)
+        await refresher.request('key', render, 7)  # склеится и выполнится после окна
+        await processor.run_in_chat(7, slow_update())
+        await asyncio.sleep(0.1)
+        assert events == ['render', 'update start', 'update end', 'render']
+
+    asyncio.run(scenario())
+
+
+def test_edits_do_not_wait_for_group_message_limit():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor()
+        # Группа: 3 сообщения подряд, дальше одно в минуту
+        limiter = SendRateLimiter(global_rate=1000, group_rate=1 / 60, chat_burst=3, edit_rate=100)
+
+        async def call():
+            return 'ok'
+
+        async def burst():
+            loop = asyncio.get_running_loop()
+            for _ in range(3):
+                await limiter.process_request(call, (), {}, 'sendMessage', {'chat_id': -5}, None)
+            started = loop.time()
+            for _ in range(5):
+                await limiter.process_request(call, (), {}, 'editMessageText', {'chat_id': -5}, None)
+            await limiter.process_request(call, (), {}, 'getChatMember', {'chat_id': -5}, None)
+            assert loop.time() - started < 0.2
+            # Новое сообщение по-прежнему ждет лимита группы
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    limiter.process_request(call, (), {}, 'sendMessage', {'chat_id': -5}, None), 0.2
+                )
+
+        await processor.run_in_chat(-5, burst())
+        assert limiter.waiting_chats == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,190 @@
+"""Tests for page_titles.py: PageTitleFetcher against a local HTTP server"""
+
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import page_titles
+import render
+from links import UNKNOWN_TIMESTAMP
+from page_titles import PageTitleFetcher
+
+HEAD_BYTES = 4096
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Маршруты тестовых страниц; пути запросов пишутся в server.requests"""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/html; charset=utf-8', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        port = self.server.server_address[1]
+        if self.path == '/og':
+            self._send(200, b'<html><head><title>Plain</title>'
+                            b'<meta property="og:title" content="Open  Graph &amp; co"></head><body>x</body>')
+        elif self.path == '/title':
+            self._send(200, b'<html><head><title>\n  Just   a title </title></head><body></body></html>')
+        elif self.path == '/cp1251':
+            self._send(200, '<head><meta charset="windows-1251"><title>Привет</title></head>'.encode('cp1251'),
+                       content_type='text/html')
+        elif self.path == '/endless':
+            # Тело без конца: читать можно только до </head>
+            self._send(200, None)
+            self.wfile.write(b'<html><head><title>Head first</title></head><body>')
+            try:
+                while not self.server.stopped.is_set():
+                    self.wfile.write(b'<p>' + b'x' * 8192 + b'</p>')
+                    self.server.body_bytes += 8196
+            except OSError:
+                pass
+        elif self.path == '/late-title':
+            # <title> дальше лимита чтения
+            self._send(200, b'<html><head>' + b'<meta name="x" content="y">' * (HEAD_BYTES // 20)
+                            + b'<title>Too far</title></head>')
+        elif self.path == '/redirect':
+            self._send(302, headers=[('Location', '/og')])
+        elif self.path == '/loop':
+            self._send(302, headers=[('Location', '/loop')])
+        elif self.path == '/to-loopback':
+            self._send(302, headers=[('Location', f'http://127.0.0.1:{port}/og')])
+        elif self.path == '/image':
+            self._send(200, b'\x89PNG', content_type='image/png')
+        elif self.path == '/error':
+            self._send(500, b'oops')
+        else:
+            self._send(404, b'<title>Not found</title>')
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    httpd.body_bytes = 0
+    httpd.stopped = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.stopped.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _fetch(url, **kwargs):
+    async def scenario():
+        fetcher = PageTitleFetcher(timeout=5, head_bytes=HEAD_BYTES, **kwargs)
+        try:
+            return await fetcher.fetch(url)
+        finally:
+            await fetcher.close()
+
+    return asyncio.run(scenario())
+
+
+def _base(server, host='127.0.0.1'):
+    return f'http://{host}:{server.server_address[1]}'
+
+
+@pytest.mark.parametrize('path, title', [
+    ('/og', 'Open Graph & co'),
+    ('/title', 'Just a title'),
+    ('/cp1251', 'Привет'),
+    ('/late-title', None),
+    ('/image', None),
+    ('/missing', None),
+])
+def test_titles(server, path, title):
+    assert _fetch(_base(server) + path, allow_private=True) == title
+
+
+def test_reads_only_the_head(server):
+    started = time.perf_counter()
+    assert _fetch(_base(server) + '/endless', allow_private=True) == 'Head first'
+    assert time.perf_counter() - started < 3
+    # Клиент закрыл соединение, не дочитав тело
+    time.sleep(0.2)
+    sent = server.body_bytes
+    time.sleep(0.2)
+    assert server.body_bytes == sent
+
+
+def test_server_error_raises_for_retry(server):
+    with pytest.raises(httpx.HTTPStatusError):
+        _fetch(_base(server) + '/error', allow_private=True)
+
+
+def test_follows_redirects(server):
+    assert _fetch(_base(server) + '/redirect', allow_private=True) == 'Open Graph & co'
+    assert server.requests == ['/redirect', '/og']
+
+
+def test_redirect_loop_gives_up(server):
+    assert _fetch(_base(server) + '/loop', allow_private=True) is None
+    assert len(server.requests) == page_titles.PAGE_MAX_REDIRECTS + 1
+
+
+def test_private_addresses_are_not_requested(server):
+    assert _fetch(_base(server) + '/og') is None
+    assert _fetch(_base(server, 'localhost') + '/og') is None
+    assert server.requests == []
+
+
+def test_redirect_to_private_address_is_refused(server, monkeypatch):
+    # localhost считаем "публичным", чтобы проверить адрес после редиректа
+    async def is_public(host):
+        return host == 'localhost'
+
+    monkeypatch.setattr(page_titles, '_is_public', is_public)
+    assert _fetch(_base(server, 'localhost') + '/to-loopback') is None
+    assert server.requests == ['/to-loopback']
+
+
+@pytest.mark.parametrize('host, public', [
+    ('127.0.0.1', False),
+    ('::1', False),
+    ('10.1.2.3', False),
+    ('192.168.0.1', False),
+    ('169.254.169.254', False),
+    ('8.8.8.8', True),
+    ('', False),
+])
+def test_is_public(host, public):
+    assert asyncio.run(page_titles._is_public(host)) == public
+
+
+class _Link:
+    url = 'https://example.com/article'
+    username = 'anna'
+    timestamp = UNKNOWN_TIMESTAMP
+    message_text = 'почитать вечером'
+    title = 'Article'
+
+
+def test_title_keeps_message_preview():
+    entry = render.render_link(1, _Link(), show_title=True)
+    assert '<b>Article</b>' in entry
+    assert 'почитать вечером' in entry
+
+
+def test_title_hides_preview_that_is_only_the_url():
+    link = _Link()
+    link.message_text = link.url
+    assert '💬' not in render.render_link(1, link, show_title=True)
+    assert '💬' in render.render_link(1, link)
@@ -0,0 +1,130 @@
+"""Keyset paging: pg:<view>:<n|p>:<ts>:<id> callback data and page boundaries"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+
+T0 = datetime(2024, 5, 1, 12, 0, 0, 123456)
+
+
+@pytest.fixture(scope='module')
+def chat(database):
+    """Чат из 7 ссылок, у нескольких одинаковое время"""
+    chat_id = 'paging'
+    offsets = [0, 1, 1, 1, 2, 3, 3]
+    database.save_links([
+        database.link_row(chat_id, 'u1', 'anna', f'https://example.com/p{i}', f'link {i}',
+                          timestamp=T0 + timedelta(minutes=offset))
+        for i, offset in enumerate(offsets)
+    ])
+    links, _ = database.get_links_page(chat_id, limit=100)
+    return chat_id, [link.id for link in links]
+
+
+def _buttons(markup):
+    return {button.text: button.callback_data for row in markup.inline_keyboard for button in row}
+
+
+def _press(database, chat_id, data, limit):
+    """Нажатие кнопки: разбор callback_data, запрос страницы, новые кнопки"""
+    view, cursor, backward = bot.decode_page(data)
+    links, has_more = database.get_links_page(chat_id, cursor, backward, limit)
+    _, markup = bot.render_page(view, bot.VIEW_TITLES[view], links, has_more, cursor, backward)
+    return [link.id for link in links], _buttons(markup)
+
+
+@pytest.mark.parametrize('view', ['all', 'yt', 'p12'])
+@pytest.mark.parametrize('direction', ['n', 'p'])
+def test_callback_data_round_trip(view, direction):
+    class Link:
+        timestamp = T0
+        id = 4242
+
+    data = bot.encode_page(view, direction, Link)
+    assert len(data.encode()) <= 64  # лимит Telegram на callback_data
+    assert bot.decode_page(data) == (view, (T0, 4242), direction == 'p')
+    assert bot.decode_page(bot.encode_page(view)) == (view, None, False)
+
+
+@pytest.mark.parametrize('data', [
+    'pg', 'pg:', 'pg:all:n', 'pg:all:n:20240501120000123456',
+    'pg:nope', 'pg:p', 'pg:pX:n:20240501120000123456:1',
+    'pg:all:x:20240501120000123456:1',
+    'pg:all:n:2024-05-01:1',
+    'pg:all:n:20240501120000123456:abc',
+    'pg:all:n:20240501120000123456:1:extra',
+    'xx:all',
+])
+def test_malformed_callback_data(data):
+    assert bot.decode_page(data) is None
+
+
+def test_malformed_button_is_ignored():
+    class Query:
+        message = None
+
+    # Не бросает исключение и ничего не редактирует
+    asyncio.run(bot._button_action(Query(), 1, 'pg:all:n:garbage:1'))
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 10])
+def test_walk_older_then_newer(database, chat, limit):
+    chat_id, expected = chat
+    ids, buttons = _press(database, chat_id, bot.encode_page('all'), limit)
+    pages = [ids]
+    assert '« Новее' not in buttons
+    while 'Старее »' in buttons:
+        ids, buttons = _press(database, chat_id, buttons['Старее »'], limit)
+        pages.append(ids)
+    # Все ссылки ровно по одному разу, по убыванию (timestamp, id), несмотря на одинаковое время
+    assert [link_id for page in pages for link_id in page] == expected
+    assert all(len(page) == limit for page in pages[:-1])
+
+    # Обратно к новым: страницы от последней, вместе - снова все ссылки по порядку
+    back = [pages[-1]]
+    while '« Новее' in buttons:
+        ids, buttons = _press(database, chat_id, buttons['« Новее'], limit)
+        back.append(ids)
+    assert [link_id for page in reversed(back) for link_id in page] == expected
+
+
+def test_empty_chat(database):
+    assert database.get_links_page('paging-empty') == ([], False)
+    assert database.get_links_page('paging-empty', (T0, 1), True) == ([], False)
+    _, markup = bot.render_page('all', 'Все ссылки:', [], False)
+    assert list(_buttons(markup)) == ['Обновить']
+
+
+def test_exact_page_has_no_older_button(database, chat):
+    chat_id, expected = chat
+    ids, buttons = _press(database, chat_id, bot.encode_page('all'), len(expected))
+    assert ids == expected
+    assert list(buttons) == ['Обновить']
+
+
+def test_cursor_past_either_end(database, chat):
+    chat_id, _ = chat
+    links, _ = database.get_links_page(chat_id, limit=100)
+    newest, oldest = links[0], links[-1]
+    assert database.get_links_page(chat_id, (oldest.timestamp, oldest.id), False, 3) == ([], False)
+    assert database.get_links_page(chat_id, (newest.timestamp, newest.id), True, 3) == ([], False)
+
+
+def test_youtube_pages_with_equal_timestamps(database):
+    chat_id = 'paging-yt'
+    database.save_links([
+        database.link_row(chat_id, 'u1', 'anna', url, 'video', timestamp=T0)
+        for url in ('https://youtu.be/aaaaaaaaaaa', 'https://example.com/not-video',
+                    'https://www.youtube.com/shorts/bbbbbbbbbbb', 'https://youtu.be/ccccccccccc')
+    ])
+    expected = [link.id for link in database.get_youtube_links_page(chat_id, limit=100)[0]]
+    assert len(expected) == 3
+    seen, cursor, has_more = [], None, True
+    while has_more:
+        links, has_more = database.get_youtube_links_page(chat_id, cursor, limit=1)
+        seen += [link.id for link in links]
+        cursor = (links[-1].timestamp, links[-1].id)
+    assert seen == expected
@@ -0,0 +1,121 @@
+"""Tests for preset_index.py: PresetMatcher must equal naive substring matching"""
+
+import contextlib
+import random
+
+import pytest
+
+import preset_index
+from preset_index import AHO_CORASICK_MIN_TERMS, PresetMatcher, link_text
+
+ALPHABET = 'abcab ñß/.:'
+
+
+def _naive(terms, text):
+    return {preset_id for preset_id, term in terms.items() if term and term.casefold() in text}
+
+
+def _random_terms(rng, count):
+    terms = {}
+    for preset_id in range(1, count + 1):
+        # Короткие слова из маленького алфавита: много вложений и пересечений
+        terms[preset_id] = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 6)))
+    return terms
+
+
+def _texts(rng, terms):
+    texts = ['', 'zzz', ''.join(terms.values()).casefold()]
+    for _ in range(200):
+        texts.append(''.join(rng.choice(ALPHABET + 'xyz') for _ in range(rng.randint(0, 80))).casefold())
+    return texts
+
+
+@pytest.mark.parametrize('count', [1, 5, AHO_CORASICK_MIN_TERMS - 1, AHO_CORASICK_MIN_TERMS, 400])
+def test_matches_naive_substring_search(count):
+    rng = random.Random(count)
+    terms = _random_terms(rng, count)
+    matcher = PresetMatcher(terms)
+    assert (matcher._goto is not None) == (count >= AHO_CORASICK_MIN_TERMS)
+    for text in _texts(rng, terms):
+        assert matcher.match(text) == _naive(terms, text), text
+
+
+def test_automaton_handles_nested_and_overlapping_terms():
+    base = {1: 'he', 2: 'she', 3: 'his', 4: 'hers', 5: 'e', 6: 'ushers', 7: 'HERS'}
+    # Добиваем до порога уникальными словами, чтобы включился автомат
+    terms = dict(base, **{str(i): f'zq{i:04d}#' for i in range(AHO_CORASICK_MIN_TERMS)})
+    matcher = PresetMatcher(terms)
+    assert matcher._goto is not None
+    assert matcher.match('ushers') == {1, 2, 4, 5, 6, 7}
+    assert matcher.match('this') == {3}
+    assert matcher.match('zq0007#') == {'7'}
+    assert matcher.match('') == set()
+
+
+def test_empty_terms_are_ignored():
+    terms = {1: '', 2: 'abc'}
+    assert PresetMatcher(terms).match('abc') == {2}
+
+
+def test_link_text_is_casefolded():
+    text = link_text('https://Example.com/Straße', 'Заголовок', None)
+    assert text == 'https://example.com/strasse\nзаголовок'
+    assert PresetMatcher({1: 'STRASSE'}).match(text) == {1}
+
+
+def test_matcher_cache_rebuilds_when_presets_change():
+    preset_index.invalidate('chat')
+    first = preset_index.matcher_for('chat', {1: 'a'})
+    assert preset_index.matcher_for('chat', {1: 'a'}) is first
+    second = preset_index.matcher_for('chat', {1: 'a', 2: 'b'})
+    assert second is not first
+    assert second.match('b') == {2}
+
+
+def _preset_link_ids(database, preset):
+    _, link_ids, _ = database.get_preset_links_page(preset.chat_id, preset.id, limit=1000)
+    return set(link_ids)
+
+
+def test_create_preset_backfills_in_short_transactions(database, monkeypatch):
+    chat_id = 'preset-backfill'
+    ids = database.save_links([
+        database.link_row(chat_id, 'u1', 'anna', f'https://example.com/{i}', 'match' if i % 3 == 0 else 'skip')
+        for i in range(25)
+    ])
+    # Ссылки другого чата между ссылками этого не попадают в пресет
+    database.save_links([database.link_row('preset-other', 'u1', 'anna', 'https://example.com/o', 'match')])
+    ids += database.save_links([database.link_row(chat_id, 'u1', 'anna', 'https://example.com/late', 'MATCH')])
+
+    windows = []
+    backfill = preset_index.backfill
+
+    def counting_backfill(begin, *args, **kwargs):
+        @contextlib.contextmanager
+        def counting_begin():
+            with begin() as conn:
+                # Пресет уже зафиксирован до досверки
+                assert conn.exec_driver_sql('SELECT COUNT(*) FROM presets WHERE chat_id = ?', (chat_id,)).scalar() == 1
+                windows.append(conn)
+                yield conn
+
+        return backfill(counting_begin, *args, chunk_size=4)
+
+    monkeypatch.setattr(preset_index, 'backfill', counting_backfill)
+    preset = database.create_preset(chat_id, 'm', 'match')
+    assert _preset_link_ids(database, preset) == {ids[i] for i in (0, 3, 6, 9, 12, 15, 18, 21, 24, 25)}
+    # Запрос диапазона id и по транзакции на каждое окно из 4 id
+    assert len(windows) == 1 + -(-(ids[-1] - ids[0] + 1) // 4)
+
+
+def test_create_preset_removed_when_backfill_fails(database, monkeypatch):
+    chat_id = 'preset-failing'
+    database.save_links([database.link_row(chat_id, 'u1', 'anna', 'https://example.com/f', 'match')])
+
+    def failing_backfill(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(preset_index, 'backfill', failing_backfill)
+    with pytest.raises(OSError):
+        database.create_preset(chat_id, 'm', 'match')
+    assert not database.preset_exists(chat_id, 'm')
@@ -0,0 +1,185 @@
+"""Tests for recent_links.py: RecentLinks first-page cache against a stub loader"""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from links import YOUTUBE_KINDS
+from recent_links import RecentLinks
+
+T0 = datetime(2024, 5, 1, 12, 0)
+
+
+def _link(link_id, chat_id='c1', kind='other', title=None, minutes=None):
+    return SimpleNamespace(
+        id=link_id, chat_id=chat_id, url=f'https://example.com/{link_id}', kind=kind, title=title,
+        username='anna', message_text=f'text {link_id}',
+        timestamp=T0 + timedelta(minutes=link_id if minutes is None else minutes),
+    )
+
+
+def _row(link):
+    return {name: getattr(link, name) for name in
+            ('chat_id', 'url', 'kind', 'title', 'username', 'timestamp', 'message_text')}
+
+
+class _Loader:
+    """Первая страница из списка ссылок чата; during_load - вызывается посреди запроса"""
+
+    def __init__(self, links):
+        self.links = links
+        self.calls = []
+        self.during_load = None
+
+    async def __call__(self, chat_id, view, limit):
+        self.calls.append((chat_id, view))
+        if self.during_load:
+            self.during_load()
+        await asyncio.sleep(0)
+        links = [link for link in self.links if link.chat_id == chat_id
+                 and (view == 'all' or link.kind in YOUTUBE_KINDS)]
+        links.sort(key=lambda link: (link.timestamp, link.id), reverse=True)
+        return links[:limit], len(links) > limit
+
+    def save(self, recent, *links, ids=None):
+        self.links.extend(links)
+        recent.add_saved([_row(link) for link in links], ids or [link.id for link in links])
+
+
+def _page(recent, chat_id, view='all'):
+    links, has_more = asyncio.run(recent.first_page(chat_id, view))
+    return [link.id for link in links], has_more
+
+
+def _accounted(recent):
+    """Размер всех записей колец (общая запись в двух кольцах - один раз)"""
+    entries = {id(entry): entry for chat in recent._chats.values()
+               for ring in chat.rings.values() for entry in ring.entries}
+    return sum(entry.size for entry in entries.values())
+
+
+def test_second_request_is_served_from_memory():
+    loader = _Loader([_link(i) for i in range(1, 6)])
+    recent = RecentLinks(loader, limit=3)
+    assert _page(recent, 'c1') == ([5, 4, 3], True)
+    assert _page(recent, 'c1') == ([5, 4, 3], True)
+    assert len(loader.calls) == 1
+    assert (recent.hits, recent.misses) == (1, 1)
+    assert recent.size == _accounted(recent) > 0
+
+
+def test_saved_links_are_pushed_and_ring_is_capped():
+    loader = _Loader([_link(i) for i in range(1, 4)])
+    recent = RecentLinks(loader, limit=3)
+    assert _page(recent, 'c1') == ([3, 2, 1], False)
+    loader.save(recent, _link(4), _link(5))
+    assert _page(recent, 'c1') == ([5, 4, 3], True)
+    # Повтор (id None) и ссылка старше обрезанного кольца не добавляются
+    loader.save(recent, _link(6), ids=[None])
+    loader.save(recent, _link(7, minutes=0))
+    assert _page(recent, 'c1') == ([5, 4, 3], True)
+    assert len(loader.calls) == 1
+    assert recent.size == _accounted(recent)
+    assert set(recent._by_id) == {5, 4, 3}
+
+
+def test_link_saved_during_warm_up_is_not_cached():
+    loader = _Loader([_link(1)])
+    recent = RecentLinks(loader, limit=3)
+    loader.during_load = lambda: loader.save(recent, _link(2))
+    # Запрос мог прочитать БД до записи: страницу показываем, но не кэшируем
+    _page(recent, 'c1')
+    assert recent.chats == 0
+    loader.during_load = None
+    assert _page(recent, 'c1') == ([2, 1], False)
+    assert _page(recent, 'c1') == ([2, 1], False)
+    assert len(loader.calls) == 2
+
+
+def test_other_chat_saved_during_warm_up_does_not_matter():
+    loader = _Loader([_link(1)])
+    recent = RecentLinks(loader, limit=3)
+    loader.during_load = lambda: loader.save(recent, _link(2, chat_id='c2'))
+    _page(recent, 'c1')
+    assert recent.chats == 1
+
+
+def test_set_title_on_cached_link_updates_size():
+    loader = _Loader([_link(1), _link(2)])
+    recent = RecentLinks(loader, limit=3)
+    _page(recent, 'c1')
+    before = recent.size
+    recent.set_title([1], 'A much longer title than before ' * 4)
+    links, _ = asyncio.run(recent.first_page('c1', 'all'))
+    assert links[1].title.startswith('A much longer title')
+    assert recent.size > before
+    assert recent.size == _accounted(recent)
+    recent.set_title([1], None)
+    assert recent.size == before
+
+
+def test_set_title_on_uncached_link_marks_warm_up_dirty():
+    loader = _Loader([_link(1)])
+    recent = RecentLinks(loader, limit=3)
+    # Нет прогрева: неизвестный id ничего не меняет
+    recent.set_title([99], 'ignored')
+    assert recent.size == 0
+
+    loader.during_load = lambda: recent.set_title([1], 'Late title')
+    _page(recent, 'c1')
+    assert recent.chats == 0
+    loader.during_load = None
+    _page(recent, 'c1')
+    assert recent.chats == 1
+
+
+def test_eviction_keeps_size_under_max_bytes():
+    loader = _Loader([_link(i, chat_id=f'c{i % 3}') for i in range(1, 10)])
+    probe = RecentLinks(loader, limit=3)
+    _page(probe, 'c0')
+    one_chat = probe.size
+
+    recent = RecentLinks(loader, limit=3, max_bytes=2 * one_chat + one_chat // 2)
+    _page(recent, 'c0')
+    _page(recent, 'c1')
+    _page(recent, 'c0')  # c0 становится самым свежим
+    _page(recent, 'c2')
+    assert list(recent._chats) == ['c0', 'c2']
+    assert recent.size == _accounted(recent) <= recent.max_bytes
+    assert {entry.chat_id for entry in recent._by_id.values()} == {'c0', 'c2'}
+
+    # Вытесненный чат прогревается заново
+    calls = len(loader.calls)
+    _page(recent, 'c1')
+    assert len(loader.calls) == calls + 1
+    assert recent.size == _accounted(recent) <= recent.max_bytes
+
+
+def test_youtube_view_shares_entries_with_all():
+    loader = _Loader([_link(1, kind='youtube'), _link(2), _link(3, kind='short')])
+    recent = RecentLinks(loader, limit=3)
+    assert _page(recent, 'c1', 'yt') == ([3, 1], False)
+    assert _page(recent, 'c1') == ([3, 2, 1], False)
+    assert recent._by_id[3].refs == 2
+    assert recent.size == _accounted(recent)
+
+    loader.save(recent, _link(4), _link(5, kind='youtube'))
+    assert _page(recent, 'c1', 'yt') == ([5, 3, 1], False)
+    assert _page(recent, 'c1') == ([5, 4, 3], True)
+    # 1 ушла из "все", но осталась в YouTube
+    assert recent._by_id[1].refs == 1
+    assert 2 not in recent._by_id
+    assert recent.size == _accounted(recent)
+    assert len(loader.calls) == 2
+
+
+@pytest.mark.parametrize('ttl, loads', [(600, 1), (-1, 2)])
+def test_ttl_reloads_chat(ttl, loads):
+    loader = _Loader([_link(1)])
+    recent = RecentLinks(loader, limit=3, ttl=ttl)
+    _page(recent, 'c1')
+    _page(recent, 'c1')
+    assert len(loader.calls) == loads
+    assert recent.size == _accounted(recent)
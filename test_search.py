@@ -0,0 +1,37 @@
+"""Tests for database.search_links: results stay within the chat on both search paths"""
+
+import pytest
+
+
+@pytest.fixture
+def chats(database):
+    rows = [
+        database.link_row('search-a', 'u1', 'anna', 'https://example.com/python-guide', 'про Python'),
+        database.link_row('search-a', 'u1', 'anna', 'https://example.com/rust', 'python vs rust'),
+        database.link_row('search-a', 'u1', 'anna', 'https://example.com/cooking', 'рецепты'),
+        database.link_row('search-b', 'u2', 'boris', 'https://example.com/python-b', 'python в чате b'),
+    ]
+    database.save_links(rows)
+    return database
+
+
+@pytest.mark.parametrize('scan_links', [0, 10 ** 6])
+def test_search_is_scoped_to_chat(chats, monkeypatch, scan_links):
+    # 0 - любой чат считается большим и ищется через FTS, 10**6 - просмотром чата
+    monkeypatch.setattr(chats, 'SEARCH_SCAN_LINKS', scan_links)
+    urls = {link.url for link in chats.search_links('search-a', 'python')}
+    assert urls == {'https://example.com/python-guide', 'https://example.com/rust'}
+    assert chats.search_links('search-a', 'нет такого') == []
+    assert [link.url for link in chats.search_links('search-b', 'python')] == ['https://example.com/python-b']
+
+
+def test_fts_ranks_only_newest_candidates(chats, monkeypatch):
+    monkeypatch.setattr(chats, 'SEARCH_SCAN_LINKS', 0)
+    monkeypatch.setattr(chats, 'SEARCH_CANDIDATES', 1)
+    assert [link.url for link in chats.search_links('search-a', 'python')] == ['https://example.com/rust']
+
+
+def test_short_terms_use_like(chats, monkeypatch):
+    monkeypatch.setattr(chats, 'SEARCH_SCAN_LINKS', 0)
+    urls = [link.url for link in chats.search_links('search-a', 'vs')]
+    assert urls == ['https://example.com/rust']
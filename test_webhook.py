@@ -0,0 +1,88 @@
+"""Webhook mode: recorded Update JSON POSTed to the local endpoint is processed"""
+
+import asyncio
+import socket
+
+import httpx
+import pytest
+
+SECRET = 'test-secret'
+CHAT_ID = -1001234567890
+
+# Обновление в том виде, в котором его присылает Telegram
+RECORDED_UPDATE = {
+    'update_id': 900000001,
+    'message': {
+        'message_id': 17,
+        'date': 1760000000,
+        'chat': {'id': CHAT_ID, 'type': 'supergroup', 'title': 'webhook test'},
+        'from': {'id': 4242, 'is_bot': False, 'first_name': 'Anna', 'username': 'anna'},
+        'text': 'почитать https://example.com/webhook-article',
+        'entities': [{'type': 'url', 'offset': 9, 'length': 35}],
+    },
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _serve_and_post(bot, port, updates):
+    """Поднимает webhook с заглушкой Bot API и отправляет updates: [(json, secret)]"""
+    from telegram.ext import Application
+    from telegram_stub import StubRequest
+
+    builder = Application.builder().token('1:webhook').request(StubRequest()).get_updates_request(StubRequest())
+    application = bot.build_application(builder)
+    statuses = []
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path=bot.WEBHOOK_PATH,
+            webhook_url=f'https://bot.example.com/{bot.WEBHOOK_PATH}', secret_token=SECRET,
+        )
+        try:
+            async with httpx.AsyncClient() as client:
+                for payload, secret in updates:
+                    response = await client.post(
+                        f'http://127.0.0.1:{port}/{bot.WEBHOOK_PATH}', json=payload,
+                        headers={'X-Telegram-Bot-Api-Secret-Token': secret},
+                    )
+                    statuses.append(response.status_code)
+            # Обновления обрабатываются в фоне - ждем, пока очередь опустеет
+            while application.update_queue.qsize() or application.update_processor.current_concurrent_updates:
+                await asyncio.sleep(0.01)
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            await bot.post_shutdown(application)
+    return statuses
+
+
+def test_recorded_update_is_stored(database):
+    import bot
+
+    forged = dict(RECORDED_UPDATE, update_id=900000002)
+    forged['message'] = dict(RECORDED_UPDATE['message'], text='https://example.com/forged')
+    forged['message']['entities'] = [{'type': 'url', 'offset': 0, 'length': 26}]
+
+    statuses = asyncio.run(_serve_and_post(bot, _free_port(), [
+        (RECORDED_UPDATE, SECRET),
+        (forged, 'wrong-secret'),
+    ]))
+
+    assert statuses == [200, 403]
+    links, _ = database.get_links_page(CHAT_ID, limit=10)
+    assert [link.url for link in links] == ['https://example.com/webhook-article']
+    assert links[0].username == 'anna'
+
+
+def test_webhook_mode_requires_public_url(monkeypatch, database):
+    import bot
+
+    monkeypatch.setattr(bot, 'WEBHOOK_URL', None)
+    with pytest.raises(SystemExit, match='WEBHOOK_URL'):
+        bot.main(webhook=True)